@@ -0,0 +1,107 @@
+# benchmark dos backends de busca do índice de hashes contra a força bruta
+#
+#   python benchmarks/busca_hamming.py --tamanhos 1e5,1e6,1e7 --consultas 200
+#
+# gera um catálogo sintético de pHash (uint64 aleatórios, ~12 frames por
+# chapa com variações pequenas entre frames) e consultas misturando frames
+# perturbados de chapas existentes com hashes que não casam com nada.
+# confere que todo backend devolve o mesmo resultado que a força bruta:
+# o mesmo ranking de chapas (modo ranking, o que a consulta usa) ou os
+# mesmos frames dentro do raio (modo raio).
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hash_index import HashIndex, criar_backend  # noqa: E402
+
+
+def perturbar(rng, hashes, max_bits):
+    # liga/desliga até max_bits bits aleatórios de cada hash
+    qtd = rng.integers(0, max_bits + 1, size=len(hashes))
+    bits = rng.integers(0, 64, size=(len(hashes), max_bits), dtype=np.uint64)
+    usados = np.arange(max_bits) < qtd[:, None]
+    mascaras = np.where(usados, np.uint64(1) << bits, np.uint64(0))
+    return hashes ^ np.bitwise_xor.reduce(mascaras, axis=1)
+
+
+def gerar_catalogo(rng, n, frames_por_chapa=12):
+    n_chapas = max(1, n // frames_por_chapa)
+    base = rng.integers(0, 2**64, size=n_chapas, dtype=np.uint64)
+    chapa_ids = np.repeat(np.arange(1, n_chapas + 1), frames_por_chapa)[:n]
+    hashes = perturbar(rng, base[chapa_ids - 1], 6)
+    return chapa_ids, hashes
+
+
+def gerar_consultas(rng, hashes, n):
+    metade = n // 2
+    perto = perturbar(rng, hashes[rng.integers(0, len(hashes), size=metade)], 12)
+    longe = rng.integers(0, 2**64, size=n - metade, dtype=np.uint64)
+    return np.concatenate([perto, longe])
+
+
+def medir(indice, consultas, raio, modo, k):
+    tempos = []
+    resultados = []
+    for q in consultas:
+        q = int(q)
+        t0 = time.perf_counter()
+        if modo == "ranking":
+            r = indice.ranquear(q, raio, k)
+            resultados.append(tuple((c["chapa_id"], c["media"]) for c in r))
+        else:
+            _, dists = indice.vizinhos(q, raio)
+            resultados.append(tuple(sorted(int(d) for d in dists)))
+        tempos.append(time.perf_counter() - t0)
+    tempos = np.array(tempos) * 1000
+    return resultados, float(tempos.mean()), float(np.percentile(tempos, 95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark dos backends de busca de hashes")
+    parser.add_argument("--tamanhos", default="1e5,1e6,1e7")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--raio", type=int, default=24)
+    parser.add_argument("--modo", choices=("ranking", "raio"), default="ranking")
+    parser.add_argument("--k", type=int, default=5, help="tamanho do ranking no modo ranking")
+    parser.add_argument("--backends", default="mih,bktree")
+    parser.add_argument("--mih-substrings", type=int, default=4)
+    parser.add_argument("--bktree-max", type=float, default=1e6,
+                        help="catálogos maiores que isso pulam a BK-tree (construção em Python puro)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'N':>10} {'backend':>8} {'build s':>9} {'média ms':>9} {'p95 ms':>9} {'speedup':>8}  exato")
+
+    for tamanho in args.tamanhos.split(","):
+        n = int(float(tamanho))
+        chapa_ids, hashes = gerar_catalogo(rng, n)
+        consultas = gerar_consultas(rng, hashes, args.consultas)
+
+        base = HashIndex("linear")
+        base.adicionar(chapa_ids, hashes)
+        esperado, media_base, p95_base = medir(base, consultas, args.raio, args.modo, args.k)
+        print(f"{n:>10} {'linear':>8} {0:>9.2f} {media_base:>9.3f} {p95_base:>9.3f} {1:>8.1f}")
+
+        for nome in args.backends.split(","):
+            if nome == "bktree" and n > args.bktree_max:
+                print(f"{n:>10} {nome:>8}  (pulado, > --bktree-max)")
+                continue
+            opcoes = {"substrings": args.mih_substrings} if nome == "mih" else {}
+            indice = HashIndex(criar_backend(nome, **opcoes))
+            t0 = time.perf_counter()
+            indice.adicionar(chapa_ids, hashes)
+            build = time.perf_counter() - t0
+            obtido, media, p95 = medir(indice, consultas, args.raio, args.modo, args.k)
+            exato = "sim" if obtido == esperado else "NÃO"
+            print(f"{n:>10} {nome:>8} {build:>9.2f} {media:>9.3f} {p95:>9.3f} {media_base / media:>8.1f}  {exato}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# tempo de hash dos frames de um cadastro: sequencial x pool de processos
+#
+#   python benchmarks/cadastro_pool.py --frames 12 --workers 4
+#
+# usa as mesmas funções do /api/cadastro (decode + preprocess + phash +
+# qualidade e cor) em frames sintéticos 1080p e confere que o pool devolve
+# os mesmos hashes, na mesma ordem.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sintetico import data_url, frames_video  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hash dos frames do cadastro: sequencial x pool")
+    parser.add_argument("--frames", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--largura", type=int, default=1920)
+    parser.add_argument("--altura", type=int, default=1080)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    # banco descartável: importar o app cria as tabelas
+    tmp = tempfile.mkdtemp()
+    os.environ["CHAPAS_DB"] = os.path.join(tmp, "chapas.db")
+    os.environ["CHAPAS_IMG_DIR"] = os.path.join(tmp, "chapas")
+    os.environ["HASH_WORKERS"] = str(args.workers)
+    import chapa_foto
+
+    frames = [data_url(f) for f in frames_video(0, args.frames, args.largura, args.altura)]
+
+    def medir(fn):
+        melhor = None
+        for _ in range(args.repeticoes):
+            t0 = time.perf_counter()
+            hashes = fn(frames)
+            dt = time.perf_counter() - t0
+            melhor = dt if melhor is None else min(melhor, dt)
+        return hashes, melhor
+
+    # aquece o pool (fork dos processos) fora da medição
+    chapa_foto.analisar_frames(frames[:2])
+
+    seq, t_seq = medir(lambda fs: [chapa_foto.analisar_frames_lote([f])[0][0] for f in fs])
+    par, t_par = medir(lambda fs: [a[0] for a in chapa_foto.analisar_frames(fs)])
+
+    print(f"frames: {args.frames} ({args.largura}x{args.altura}), workers: {chapa_foto.HASH_WORKERS}, cpus: {os.cpu_count()}")
+    print(f"sequencial: {t_seq * 1000:8.1f} ms/cadastro")
+    print(f"pool:       {t_par * 1000:8.1f} ms/cadastro")
+    print(f"speedup:    {t_seq / t_par:8.2f}x")
+    print(f"mesmos hashes na mesma ordem: {'sim' if seq == par else 'NÃO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# frame inteiro x frame já reduzido no navegador (/api/config)
+#
+#   python benchmarks/captura_reduzida.py --frames 24 --tolerancia 4
+#
+# simula o que a página de captura faz com a captura reduzida ligada:
+# recorta o quadrado do meio do vídeo e reduz pro lado do hash antes de
+# gerar o JPEG (o navegador usa uma interpolação bilinear). Compara com o
+# envio do frame inteiro: bytes por frame, tempo de CPU do servidor por
+# frame (analisar_frames_lote: decode + hash + qualidade + cor) e quanto o
+# pHash muda. Como no decode_reduzido.py, a diferença precisa ficar dentro
+# de --tolerancia pra não mexer no casamento com as chapas já cadastradas.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sintetico import frames_video, jpeg_bytes  # noqa: E402
+
+RESOLUCOES = {"720p": (1280, 720), "1080p": (1920, 1080), "4K": (3840, 2160)}
+
+
+def recorte_navegador(img: Image.Image, lado: int) -> Image.Image:
+    # o drawImage do canvas com o recorte do quadrado do meio
+    w, h = img.size
+    origem = min(w, h)
+    caixa = ((w - origem) // 2, (h - origem) // 2, (w + origem) // 2, (h + origem) // 2)
+    return img.resize((min(lado, origem),) * 2, Image.BILINEAR, box=caixa)
+
+
+def cpu_por_frame(fn, frames, repeticoes):
+    melhor = None
+    for _ in range(repeticoes):
+        t0 = time.process_time()
+        resultado = [fn(f) for f in frames]
+        dt = (time.process_time() - t0) / len(frames)
+        melhor = dt if melhor is None else min(melhor, dt)
+    return resultado, melhor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="frame inteiro x reduzido no navegador")
+    parser.add_argument("--frames", type=int, default=24)
+    parser.add_argument("--qualidade", type=int, default=85, help="qualidade JPEG dos frames")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--tolerancia", type=int, default=4,
+                        help="máximo de bits de diferença aceito entre os hashes dos dois envios")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["CHAPAS_DB"] = os.path.join(tmp, "chapas.db")
+    os.environ["CHAPAS_IMG_DIR"] = os.path.join(tmp, "chapas")
+    import chapa_foto
+    from hash_index import hash_to_int
+
+    def analisar(raw):
+        return chapa_foto.analisar_frames_lote([raw])[0][0]
+
+    print(f"{'frames':>6} {'inteiro KB':>10} {'reduzido KB':>11} {'inteiro ms':>10} {'reduzido ms':>11} "
+          f"{'speedup':>8} {'drift méd':>9} {'drift máx':>9}")
+    ok = True
+    for nome, (largura, altura) in RESOLUCOES.items():
+        originais = [
+            f
+            for seed in range(0, args.frames, 6)
+            for f in frames_video(seed, min(6, args.frames - seed), largura, altura)
+        ]
+        inteiros = [jpeg_bytes(f, args.qualidade) for f in originais]
+        reduzidos = [jpeg_bytes(recorte_navegador(f, chapa_foto.LADO_HASH), args.qualidade) for f in originais]
+
+        h_inteiro, t_inteiro = cpu_por_frame(analisar, inteiros, args.repeticoes)
+        h_reduzido, t_reduzido = cpu_por_frame(analisar, reduzidos, args.repeticoes)
+
+        drift = np.array([bin(hash_to_int(a) ^ hash_to_int(b)).count("1") for a, b in zip(h_inteiro, h_reduzido)])
+        ok &= bool(drift.max() <= args.tolerancia)
+        kb_inteiro = np.mean([len(r) for r in inteiros]) / 1024
+        kb_reduzido = np.mean([len(r) for r in reduzidos]) / 1024
+        print(f"{nome:>6} {kb_inteiro:>10.1f} {kb_reduzido:>11.1f} {t_inteiro * 1000:>10.1f} "
+              f"{t_reduzido * 1000:>11.1f} {t_inteiro / t_reduzido:>7.2f}x {drift.mean():>9.2f} {drift.max():>9d}")
+
+    print(f"drift dentro da tolerância ({args.tolerancia} bits): {'sim' if ok else 'NÃO'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
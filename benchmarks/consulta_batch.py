@@ -0,0 +1,90 @@
+# /api/consulta/batch x N chamadas separadas de /api/consulta
+#
+#   python benchmarks/consulta_batch.py --imagens 32 --catalogo 1e6 --workers 4
+#
+# monta um banco descartável com um catálogo sintético de hashes, faz as
+# chamadas pelo test client do Flask (sem rede) e mostra o tempo por imagem
+# de ponta a ponta e só da etapa de busca no índice.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sintetico import data_url, textura_mdf  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="consulta em lote x consultas separadas")
+    parser.add_argument("--imagens", type=int, default=32)
+    parser.add_argument("--catalogo", type=float, default=1e6, help="frames no catálogo")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--largura", type=int, default=1280)
+    parser.add_argument("--altura", type=int, default=720)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["CHAPAS_DB"] = os.path.join(tmp, "chapas.db")
+    os.environ["CHAPAS_IMG_DIR"] = os.path.join(tmp, "chapas")
+    os.environ["HASH_WORKERS"] = str(args.workers)
+    # sem cache: as chamadas separadas e o batch repetem as mesmas imagens
+    os.environ["CACHE_CONSULTAS"] = "0"
+    import chapa_foto
+
+    rng = random.Random(0)
+    conn = chapa_foto.get_conn()
+    n_frames = int(args.catalogo)
+    with conn:
+        for inicio in range(0, n_frames, 12):
+            cur = conn.execute(
+                "INSERT INTO chapas (sku, descricao, image_filename, image_hash, created_at) "
+                "VALUES ('SKU', 'sintética', 'x.jpg', 0, '2024-01-01 00:00:00')"
+            )
+            conn.executemany(
+                "INSERT INTO chapa_hashes (chapa_id, image_hash) VALUES (?, ?)",
+                [(cur.lastrowid, rng.getrandbits(63)) for _ in range(min(12, n_frames - inicio))],
+            )
+    chapa_foto.sync_hash_index(forcar=True)
+
+    imagens = [data_url(textura_mdf(i, args.largura, args.altura), 95) for i in range(args.imagens)]
+    client = chapa_foto.app.test_client()
+    client.post("/api/consulta/batch", json={"images": imagens[:2]})  # aquece o pool
+
+    t0 = time.perf_counter()
+    separadas = [client.post("/api/consulta", json={"image": img}).get_json() for img in imagens]
+    t_sep = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    lote = client.post("/api/consulta/batch", json={"images": imagens}).get_json()["resultados"]
+    t_lote = time.perf_counter() - t0
+
+    queries = np.array(
+        [chapa_foto.hash_to_int(a[0]) for a in chapa_foto.analisar_frames(imagens)], dtype=np.uint64
+    )
+    t0 = time.perf_counter()
+    for q in queries:
+        chapa_foto.hash_index.vizinhos(int(q), chapa_foto.LIMIAR)
+    t_busca_sep = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    chapa_foto.hash_index.vizinhos_em_lote(queries, chapa_foto.LIMIAR)
+    t_busca_lote = time.perf_counter() - t0
+
+    n = args.imagens
+    print(f"{n} imagens {args.largura}x{args.altura}, catálogo {n_frames} frames, "
+          f"workers {chapa_foto.HASH_WORKERS}, cpus {os.cpu_count()}")
+    print(f"ponta a ponta  separadas: {t_sep / n * 1000:8.2f} ms/imagem")
+    print(f"ponta a ponta  batch:     {t_lote / n * 1000:8.2f} ms/imagem  ({t_sep / t_lote:.2f}x)")
+    print(f"só a busca     separadas: {t_busca_sep / n * 1000:8.3f} ms/imagem")
+    print(f"só a busca     batch:     {t_busca_lote / n * 1000:8.3f} ms/imagem  ({t_busca_sep / t_busca_lote:.2f}x)")
+    print(f"mesmos resultados: {'sim' if separadas == lote else 'NÃO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# cache de consultas: mesma foto escaneada de novo x consulta que vai ao índice
+#
+#   python benchmarks/consulta_cache.py --catalogo 1e6 --consultas 200
+#
+# monta um banco descartável com um catálogo sintético de hashes e mede, já
+# com o pHash calculado, o tempo de responder_consulta (índice + ranking +
+# banco) na primeira vez que um hash aparece (miss) e nas repetições (hit).
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="consulta com e sem cache")
+    parser.add_argument("--catalogo", type=float, default=1e6, help="frames no catálogo")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--repeticoes", type=int, default=5, help="scans repetidos de cada hash")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["CHAPAS_DB"] = os.path.join(tmp, "chapas.db")
+    os.environ["CHAPAS_IMG_DIR"] = os.path.join(tmp, "chapas")
+    import chapa_foto
+
+    rng = random.Random(0)
+    conn = chapa_foto.get_conn()
+    n_frames = int(args.catalogo)
+    hashes = []
+    with conn:
+        for inicio in range(0, n_frames, 12):
+            cur = conn.execute(
+                "INSERT INTO chapas (sku, descricao, image_filename, image_hash, created_at) "
+                "VALUES ('SKU', 'sintética', 'x.jpg', 0, '2024-01-01 00:00:00')"
+            )
+            lote = [rng.getrandbits(63) for _ in range(min(12, n_frames - inicio))]
+            hashes.extend(lote)
+            conn.executemany(
+                "INSERT INTO chapa_hashes (chapa_id, image_hash) VALUES (?, ?)",
+                [(cur.lastrowid, h) for h in lote],
+            )
+    chapa_foto.sync_hash_index(forcar=True)
+
+    # metade das consultas casa com um frame do catálogo, metade não casa
+    consultas = [format(rng.choice(hashes) ^ (1 << rng.randrange(64)), "016x") for _ in range(args.consultas // 2)]
+    consultas += [format(rng.getrandbits(64), "016x") for _ in range(args.consultas - len(consultas))]
+
+    miss, hit = [], []
+    with chapa_foto.app.test_request_context():
+        for q in consultas:
+            t0 = time.perf_counter()
+            primeira = chapa_foto.responder_consulta(q).get_json()
+            miss.append(time.perf_counter() - t0)
+            for _ in range(args.repeticoes):
+                t0 = time.perf_counter()
+                repetida = chapa_foto.responder_consulta(q).get_json()
+                hit.append(time.perf_counter() - t0)
+            assert repetida == primeira
+
+    miss = np.array(miss) * 1e6
+    hit = np.array(hit) * 1e6
+    print(f"catálogo {n_frames} frames, {args.consultas} hashes x {args.repeticoes} repetições")
+    print(f"miss: {np.median(miss):10.1f} µs (p95 {np.percentile(miss, 95):.1f})")
+    print(f"hit:  {np.median(hit):10.1f} µs (p95 {np.percentile(hit, 95):.1f})  "
+          f"({np.median(miss) / np.median(hit):.0f}x)")
+    print(chapa_foto.cache_consultas.estatisticas())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# decode do JPEG em resolução cheia x decode reduzido (draft do libjpeg)
+#
+#   python benchmarks/decode_reduzido.py --frames 24 --tolerancia 4
+#
+# mede o tempo de CPU por frame de analisar_frames_lote (consulta e frames
+# do cadastro) e do frame do meio do cadastro (imagem salva + hash) em frames
+# sintéticos 1080p e 4K, com DECODE_REDUZIDO ligado e desligado. Também
+# mede o quanto o pHash muda entre os dois modos: o limiar da consulta é 24
+# bits, e a diferença precisa ficar dentro de --tolerancia pra não mexer no
+# casamento com chapas cadastradas antes da mudança.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sintetico import frames_video, jpeg_bytes  # noqa: E402
+
+RESOLUCOES = {"1080p": (1920, 1080), "4K": (3840, 2160)}
+
+
+def cpu_por_frame(fn, frames, repeticoes):
+    melhor = None
+    for _ in range(repeticoes):
+        t0 = time.process_time()
+        resultado = [fn(f) for f in frames]
+        dt = (time.process_time() - t0) / len(frames)
+        melhor = dt if melhor is None else min(melhor, dt)
+    return resultado, melhor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="decode cheio x reduzido dos frames")
+    parser.add_argument("--frames", type=int, default=24)
+    parser.add_argument("--qualidade", type=int, default=90, help="qualidade JPEG dos frames")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--tolerancia", type=int, default=4,
+                        help="máximo de bits de diferença aceito entre os hashes dos dois modos")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["CHAPAS_DB"] = os.path.join(tmp, "chapas.db")
+    os.environ["CHAPAS_IMG_DIR"] = os.path.join(tmp, "chapas")
+    import chapa_foto
+    from hash_index import hash_to_int
+
+    def analisar(raw):
+        return chapa_foto.analisar_frames_lote([raw])[0][0]
+
+    def preview_antigo(raw):
+        # como era: decode cheio pra imagem salva e outro decode cheio pro hash
+        chapa_foto.preprocess_image_for_save(chapa_foto.decode_bytes_to_image(raw))
+        return chapa_foto.hash_image(chapa_foto.decode_bytes_to_image(raw))
+
+    def preview_novo(raw):
+        pil, (h, *_) = chapa_foto.decode_preview(raw)
+        chapa_foto.preprocess_image_for_save(pil)
+        return h
+
+    print(f"{'frames':>6} {'etapa':>8} {'cheio ms':>9} {'reduzido ms':>12} {'speedup':>8} "
+          f"{'drift méd':>9} {'drift máx':>9}")
+    ok = True
+    for nome, (largura, altura) in RESOLUCOES.items():
+        frames = [
+            jpeg_bytes(f, args.qualidade)
+            for seed in range(0, args.frames, 6)
+            for f in frames_video(seed, min(6, args.frames - seed), largura, altura)
+        ]
+        for etapa, antigo, novo in (
+            ("hash", analisar, analisar),
+            ("preview", preview_antigo, preview_novo),
+        ):
+            chapa_foto.DECODE_REDUZIDO = False
+            h_cheio, t_cheio = cpu_por_frame(antigo, frames, args.repeticoes)
+            chapa_foto.DECODE_REDUZIDO = True
+            h_red, t_red = cpu_por_frame(novo, frames, args.repeticoes)
+
+            drift = np.array([bin(hash_to_int(a) ^ hash_to_int(b)).count("1") for a, b in zip(h_cheio, h_red)])
+            ok &= bool(drift.max() <= args.tolerancia)
+            print(f"{nome:>6} {etapa:>8} {t_cheio * 1000:>9.1f} {t_red * 1000:>12.1f} "
+                  f"{t_cheio / t_red:>7.2f}x {drift.mean():>9.2f} {drift.max():>9d}")
+
+    print(f"drift dentro da tolerância ({args.tolerancia} bits): {'sim' if ok else 'NÃO'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# pré-filtro de cor antes da busca de hashes x busca no catálogo inteiro
+#
+#   python benchmarks/prefiltro_cor.py --tamanhos 1e6,1e7 --limiar-cor 25
+#
+# catálogo sintético de pHash (o mesmo do busca_hamming.py) com uma
+# assinatura L*a*b* aleatória por chapa; cada consulta leva a assinatura da
+# chapa de onde veio, com um ruído de iluminação. Mostra quantas chapas o
+# filtro descarta, o tempo por consulta com e sem filtro e se a chapa certa
+# continua sendo encontrada.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from busca_hamming import gerar_catalogo, perturbar  # noqa: E402
+
+from hash_index import AssinaturasCor, HashIndex  # noqa: E402
+
+
+def assinaturas_aleatorias(rng, n):
+    # médias de L*, a*, b* numa faixa de chapas reais (claras a escuras,
+    # pouco saturadas) e desvios pequenos
+    medias = np.column_stack([
+        rng.uniform(20, 90, n), rng.uniform(-30, 40, n), rng.uniform(-30, 60, n)
+    ])
+    desvios = rng.uniform(2, 12, size=(n, 3))
+    return np.hstack([medias, desvios]).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pré-filtro de cor x busca no catálogo inteiro")
+    parser.add_argument("--tamanhos", default="1e6,1e7")
+    parser.add_argument("--consultas", type=int, default=100)
+    parser.add_argument("--raio", type=int, default=24)
+    parser.add_argument("--limiar-cor", type=float, default=25)
+    parser.add_argument("--ruido-cor", type=float, default=6, help="desvio do ruído de iluminação na consulta")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'N':>10} {'descartadas':>11} {'sem filtro ms':>13} {'com filtro ms':>13} {'speedup':>8} {'achou':>6}")
+
+    for tamanho in args.tamanhos.split(","):
+        n = int(float(tamanho))
+        chapa_ids, hashes = gerar_catalogo(rng, n)
+        n_chapas = int(chapa_ids.max())
+
+        indice = HashIndex("linear")
+        indice.adicionar(chapa_ids, hashes)
+        indice.cores = AssinaturasCor()
+        sigs = assinaturas_aleatorias(rng, n_chapas)
+        indice.cores.adicionar(np.arange(1, n_chapas + 1), sigs)
+
+        origem = rng.integers(0, n, size=args.consultas)
+        consultas = perturbar(rng, hashes[origem], 8)
+        cores = sigs[chapa_ids[origem] - 1] + rng.normal(0, args.ruido_cor, size=(args.consultas, 6)).astype(np.float32)
+
+        # monta o agrupamento por chapa fora da medição
+        indice.agrupar_por_chapa()
+
+        t_sem = t_com = 0.0
+        descartadas = achou = 0
+        for q, cor, esperado in zip(consultas, cores, chapa_ids[origem]):
+            t0 = time.perf_counter()
+            indice.vizinhos(int(q), args.raio)
+            t_sem += time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            excluir = indice.cores.reprovadas(cor, args.limiar_cor)
+            ids, _ = indice.vizinhos(int(q), args.raio, excluir=excluir)
+            t_com += time.perf_counter() - t0
+
+            descartadas += len(excluir)
+            achou += bool(np.any(ids == esperado))
+
+        m = args.consultas
+        print(f"{n:>10} {descartadas / m / n_chapas * 100:>10.1f}% {t_sem / m * 1000:>13.2f} "
+              f"{t_com / m * 1000:>13.2f} {t_sem / t_com:>7.2f}x {achou / m * 100:>5.0f}%")
+
+
+if __name__ == "__main__":
+    main()
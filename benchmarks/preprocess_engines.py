@@ -0,0 +1,79 @@
+# motor do pré-processamento do hash: cadeia de filtros do PIL x numpy em pilha
+#
+#   python benchmarks/preprocess_engines.py --cadastros 4 --frames 12 --tolerancia 4
+#
+# pega os frames de cada cadastro sintético já decodificados e compara, por
+# frame, o pré-processamento + pHash do caminho PIL (preprocess_image_for_hash
+# um frame por vez) com o preprocess_numpy (o cadastro inteiro numa pilha).
+# Confere também quantos bits os hashes dos dois motores diferem.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import imagehash
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import preprocess_numpy  # noqa: E402
+from sintetico import frames_video  # noqa: E402
+
+from hash_index import hash_to_int  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pré-processamento do hash: PIL x numpy")
+    parser.add_argument("--cadastros", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=12, help="frames por cadastro")
+    parser.add_argument("--largura", type=int, default=960, help="largura do frame já decodificado")
+    parser.add_argument("--altura", type=int, default=540)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--tolerancia", type=int, default=4,
+                        help="máximo de bits de diferença aceito entre os hashes dos dois motores")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["CHAPAS_DB"] = os.path.join(tmp, "chapas.db")
+    os.environ["CHAPAS_IMG_DIR"] = os.path.join(tmp, "chapas")
+    import chapa_foto
+
+    def motor_pil(frames):
+        return [str(imagehash.phash(chapa_foto.preprocess_image_for_hash(f))) for f in frames]
+
+    def motor_numpy(frames):
+        return preprocess_numpy.phash_stack(preprocess_numpy.preprocess_stack(preprocess_numpy.empilhar(frames)))
+
+    cadastros = [frames_video(seed, args.frames, args.largura, args.altura) for seed in range(args.cadastros)]
+    for frames in cadastros:
+        for f in frames:
+            f.load()
+
+    def medir(fn):
+        melhor = None
+        for _ in range(args.repeticoes):
+            t0 = time.process_time()
+            hashes = [fn(frames) for frames in cadastros]
+            dt = time.process_time() - t0
+            melhor = dt if melhor is None else min(melhor, dt)
+        return [h for lote in hashes for h in lote], melhor / (args.cadastros * args.frames)
+
+    h_pil, t_pil = medir(motor_pil)
+    h_np, t_np = medir(motor_numpy)
+    drift = np.array([bin(hash_to_int(a) ^ hash_to_int(b)).count("1") for a, b in zip(h_pil, h_np)])
+
+    print(f"{args.cadastros} cadastros x {args.frames} frames {args.largura}x{args.altura}")
+    print(f"pil:   {t_pil * 1000:7.2f} ms/frame")
+    print(f"numpy: {t_np * 1000:7.2f} ms/frame  ({t_pil / t_np:.2f}x)")
+    print(f"drift: média {drift.mean():.2f} bits, máx {drift.max()} bits, "
+          f"{(drift == 0).mean() * 100:.0f}% dos hashes iguais")
+    ok = bool(drift.max() <= args.tolerancia)
+    print(f"drift dentro da tolerância ({args.tolerancia} bits): {'sim' if ok else 'NÃO'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
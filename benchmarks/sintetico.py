@@ -0,0 +1,54 @@
+# imagens sintéticas com cara de chapa MDF (veio de madeira + ruído + cor),
+# usadas pelos benchmarks no lugar de fotos reais
+
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+from scipy.ndimage import gaussian_filter
+
+
+def textura_mdf(seed: int, largura: int = 1920, altura: int = 1080) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    # gera numa resolução menor e amplia: o veio é de baixa frequência mesmo
+    h, w = max(altura // 4, 8), max(largura // 4, 8)
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    angulo = rng.uniform(0, np.pi)
+    freq = rng.uniform(0.05, 0.2)
+    veio = np.sin((x * np.cos(angulo) + y * np.sin(angulo)) * freq + gaussian_filter(rng.random((h, w)), 8) * 20)
+    ruido = gaussian_filter(rng.random((h, w)), 1.5)
+    base = 0.6 * veio + 0.4 * (ruido - ruido.mean()) * 8
+    base = (base - base.min()) / (np.ptp(base) + 1e-9)
+
+    cor = rng.uniform(40, 220, size=3)
+    rgb = (base[..., None] * 0.5 + 0.5) * cor
+    img = Image.fromarray(rgb.clip(0, 255).astype(np.uint8), "RGB")
+    img = img.resize((largura, altura), Image.BILINEAR)
+
+    # um pouco de ruído de sensor em resolução cheia
+    arr = np.asarray(img, dtype=np.int16) + rng.integers(-6, 7, size=(altura, largura, 1), dtype=np.int16)
+    return Image.fromarray(arr.clip(0, 255).astype(np.uint8), "RGB")
+
+
+def frames_video(seed: int, n: int = 12, largura: int = 1920, altura: int = 1080):
+    # simula o vídeo de 5s: a mesma chapa vista de ângulos levemente diferentes
+    base = textura_mdf(seed, largura + largura // 8, altura + altura // 8)
+    rng = np.random.default_rng(seed + 1)
+    frames = []
+    for _ in range(n):
+        dx = int(rng.integers(0, largura // 8))
+        dy = int(rng.integers(0, altura // 8))
+        frame = base.crop((dx, dy, dx + largura, dy + altura)).rotate(float(rng.uniform(-3, 3)))
+        frames.append(frame)
+    return frames
+
+
+def jpeg_bytes(img: Image.Image, quality: int = 85) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def data_url(img: Image.Image, quality: int = 85) -> str:
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg_bytes(img, quality)).decode()
@@ -0,0 +1,162 @@
+# carga concorrente no SQLite: como o app fazia (conexão nova por operação,
+# journal padrão) x como faz agora (conexão reaproveitada, WAL, pragmas)
+#
+#   python benchmarks/sqlite_concorrencia.py --processos 4 --operacoes 300
+#
+# cada processo simula um worker do gunicorn atendendo uma mistura de
+# cadastros (1 chapa + 12 hashes numa transação) e consultas (sincronização
+# do índice por id + busca da chapa encontrada); mede a latência de cada
+# operação e mostra p50/p99 por modo.
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+MODOS = {
+    # antes: sqlite3.connect() a cada requisição, journal DELETE, synchronous FULL
+    "antigo": {"reusar": False, "pragmas": []},
+    "novo": {
+        "reusar": True,
+        "journal": "WAL",
+        "pragmas": [
+            "PRAGMA synchronous = NORMAL",
+            "PRAGMA cache_size = -65536",
+            f"PRAGMA mmap_size = {256 * 1024 * 1024}",
+        ],
+    },
+}
+
+
+def criar_banco(path, journal, chapas):
+    conn = sqlite3.connect(path)
+    if journal:
+        conn.execute(f"PRAGMA journal_mode = {journal}")
+    conn.executescript(
+        """
+        CREATE TABLE chapas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sku TEXT NOT NULL, descricao TEXT NOT NULL, image_filename TEXT NOT NULL,
+            image_hash INTEGER, created_at TEXT NOT NULL
+        );
+        CREATE TABLE chapa_hashes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chapa_id INTEGER NOT NULL, image_hash INTEGER NOT NULL
+        );
+        CREATE INDEX idx_chapa_hashes_chapa_id ON chapa_hashes (chapa_id);
+        """
+    )
+    for i in range(chapas):
+        cadastrar(conn, random.Random(i))
+    conn.commit()
+    conn.close()
+
+
+def cadastrar(conn, rng):
+    cur = conn.execute(
+        "INSERT INTO chapas (sku, descricao, image_filename, image_hash, created_at) VALUES (?, ?, ?, ?, ?)",
+        ("SKU", "chapa", "chapa.jpg", rng.getrandbits(63), "2024-01-01 00:00:00"),
+    )
+    conn.executemany(
+        "INSERT INTO chapa_hashes (chapa_id, image_hash) VALUES (?, ?)",
+        [(cur.lastrowid, rng.getrandbits(63)) for _ in range(12)],
+    )
+
+
+def worker(path, modo, operacoes, frac_escrita, seed, fila):
+    cfg = MODOS[modo]
+    rng = random.Random(seed)
+    conn_fixa = None
+    ultimo_id = 0
+    latencias = {"cadastro": [], "consulta": []}
+
+    def abrir():
+        conn = sqlite3.connect(path, timeout=30)
+        for pragma in cfg["pragmas"]:
+            conn.execute(pragma)
+        return conn
+
+    for _ in range(operacoes):
+        escrita = rng.random() < frac_escrita
+        t0 = time.perf_counter()
+        if cfg["reusar"]:
+            if conn_fixa is None:
+                conn_fixa = abrir()
+            conn = conn_fixa
+        else:
+            conn = abrir()
+
+        if escrita:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                cadastrar(conn, rng)
+        else:
+            rows = conn.execute(
+                "SELECT id, chapa_id, image_hash FROM chapa_hashes WHERE id > ? ORDER BY id",
+                (ultimo_id,),
+            ).fetchall()
+            if rows:
+                ultimo_id = rows[-1][0]
+            conn.execute(
+                "SELECT id, sku, descricao, image_filename, created_at FROM chapas WHERE id = ?",
+                (rng.randint(1, 1000),),
+            ).fetchone()
+
+        if not cfg["reusar"]:
+            conn.close()
+        latencias["cadastro" if escrita else "consulta"].append(time.perf_counter() - t0)
+
+    fila.put(latencias)
+
+
+def rodar(modo, args):
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "chapas.db")
+    criar_banco(path, MODOS[modo].get("journal"), args.chapas)
+
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+    fila = ctx.Queue()
+    procs = [
+        ctx.Process(target=worker, args=(path, modo, args.operacoes, args.escrita, i, fila))
+        for i in range(args.processos)
+    ]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    resultados = [fila.get() for _ in procs]
+    for p in procs:
+        p.join()
+    total = time.perf_counter() - t0
+
+    for tipo in ("cadastro", "consulta"):
+        lat = np.array([x for r in resultados for x in r[tipo]]) * 1000
+        if not len(lat):
+            continue
+        print(
+            f"{modo:>7} {tipo:>9} {len(lat):>6} "
+            f"{np.percentile(lat, 50):>8.2f} {np.percentile(lat, 99):>8.2f} {lat.max():>8.2f}"
+        )
+    ops = args.processos * args.operacoes
+    print(f"{modo:>7} {'total':>9} {ops:>6} ops em {total:.2f}s ({ops / total:.0f} ops/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="latência do SQLite sob carga concorrente")
+    parser.add_argument("--processos", type=int, default=4)
+    parser.add_argument("--operacoes", type=int, default=300, help="operações por processo")
+    parser.add_argument("--escrita", type=float, default=0.2, help="fração de cadastros")
+    parser.add_argument("--chapas", type=int, default=2000, help="chapas já cadastradas no início")
+    args = parser.parse_args()
+
+    print(f"{'modo':>7} {'operação':>9} {'n':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for modo in MODOS:
+        rodar(modo, args)
+
+
+if __name__ == "__main__":
+    main()
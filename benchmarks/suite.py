@@ -0,0 +1,235 @@
+# suíte dos caminhos quentes do cadastro e da consulta, com saída em JSON
+#
+#   python benchmarks/suite.py --saida atual.json
+#   python benchmarks/suite.py --salvar-baseline benchmarks/baseline.json
+#   python benchmarks/suite.py --baseline benchmarks/baseline.json --tolerancia 0.15
+#
+# gera imagens sintéticas com cara de MDF (sintetico.py) e catálogos
+# sintéticos de hashes nos tamanhos pedidos, e mede, etapa por etapa:
+#
+#   decode              decode_data_url_to_image na escala do hash
+#   preprocess          preprocess_image_for_hash
+#   phash               imagehash.phash da imagem pré-processada
+#   analise_frame       analisar_frames_lote de um frame (decode + hash +
+#                       qualidade + cor), o que o pool faz por frame
+#   cadastro            /api/cadastro de ponta a ponta (por chapa)
+#   consulta            /api/consulta de ponta a ponta, por tamanho de catálogo
+#   busca               só o casamento da consulta (índice + ranking + banco),
+#                       com o hash pronto, por tamanho de catálogo
+#
+# pra cada etapa: latência (média, p50, p95), vazão e pico de memória
+# alocada durante uma execução (tracemalloc, medido numa passada à parte pra
+# não pesar na latência; vê o Python e o numpy, não os buffers internos do
+# PIL). O pico de RSS do processo inteiro vai em "meta". Com --baseline,
+# compara p50 e memória com o JSON guardado e sai com código 1 se alguma
+# etapa piorou além da tolerância.
+# O cache de consultas fica desligado: a suíte mede o caminho sem ele.
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sintetico import data_url, frames_video, textura_mdf  # noqa: E402
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def medir(fn, argumentos, repeticoes=1):
+    # roda fn(arg) pra cada argumento; devolve as estatísticas da etapa
+    fn(argumentos[0])  # aquece (imports preguiçosos, caches do PIL)
+    tempos = []
+    for _ in range(repeticoes):
+        for arg in argumentos:
+            t0 = time.perf_counter()
+            fn(arg)
+            tempos.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    for arg in argumentos[:3]:
+        tracemalloc.reset_peak()
+        fn(arg)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tempos = np.array(tempos) * 1000
+    return {
+        "n": len(tempos),
+        "media_ms": round(float(tempos.mean()), 3),
+        "p50_ms": round(float(np.percentile(tempos, 50)), 3),
+        "p95_ms": round(float(np.percentile(tempos, 95)), 3),
+        "ops_s": round(float(1000 / tempos.mean()), 2),
+        "pico_mem_mb": round(pico / 2**20, 2),
+    }
+
+
+def commit_atual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def crescer_catalogo(chapa_foto, rng, ate: int):
+    # completa chapa_hashes até `ate` frames (12 por chapa, hashes aleatórios)
+    conn = chapa_foto.get_conn()
+    atual = conn.execute("SELECT COUNT(*) FROM chapa_hashes").fetchone()[0]
+    with conn:
+        for inicio in range(atual, ate, 12):
+            cur = conn.execute(
+                "INSERT INTO chapas (sku, descricao, image_filename, image_hash, created_at) "
+                "VALUES ('SKU', 'sintética', 'x.jpg', 0, '2024-01-01 00:00:00')"
+            )
+            qtd = min(12, ate - inicio)
+            hashes = rng.integers(0, 2**63, size=qtd, dtype=np.int64)
+            conn.executemany(
+                "INSERT INTO chapa_hashes (chapa_id, image_hash) VALUES (?, ?)",
+                [(cur.lastrowid, int(h)) for h in hashes],
+            )
+    chapa_foto.sync_hash_index(forcar=True)
+
+
+def comparar(resultado, baseline, tolerancia):
+    # [(etapa, métrica, antes, agora)] do que piorou além da tolerância
+    regressoes = []
+    for nome, atual in resultado["etapas"].items():
+        antes = baseline.get("etapas", {}).get(nome)
+        if not antes:
+            continue
+        for metrica in ("p50_ms", "pico_mem_mb"):
+            if antes[metrica] > 0 and atual[metrica] > antes[metrica] * (1 + tolerancia):
+                regressoes.append((nome, metrica, antes[metrica], atual[metrica]))
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="suíte de benchmarks do cadastro e da consulta")
+    parser.add_argument("--imagens", type=int, default=12, help="imagens por etapa de imagem")
+    parser.add_argument("--cadastros", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=12, help="frames por cadastro")
+    parser.add_argument("--largura", type=int, default=1280)
+    parser.add_argument("--altura", type=int, default=720)
+    parser.add_argument("--catalogos", default="1e4,1e5,1e6", help="tamanhos de catálogo (frames)")
+    parser.add_argument("--consultas", type=int, default=20)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--saida", help="grava o resultado neste JSON")
+    parser.add_argument("--baseline", help="JSON de uma rodada anterior pra comparar")
+    parser.add_argument("--salvar-baseline", help="grava o resultado como baseline neste JSON")
+    parser.add_argument("--tolerancia", type=float, default=0.15,
+                        help="quanto p50 ou memória podem subir antes de contar como regressão")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["CHAPAS_DB"] = os.path.join(tmp, "chapas.db")
+    os.environ["CHAPAS_IMG_DIR"] = os.path.join(tmp, "chapas")
+    os.environ["CACHE_CONSULTAS"] = "0"
+    os.environ.setdefault("HASH_WORKERS", "1")
+    import imagehash
+
+    import chapa_foto
+
+    rng = np.random.default_rng(args.seed)
+    etapas = {}
+
+    # etapas de imagem, uma foto por chamada
+    fotos = [data_url(textura_mdf(args.seed + i, args.largura, args.altura), 90) for i in range(args.imagens)]
+    decodificadas = [chapa_foto.decode_data_url_to_image(f, chapa_foto.LADO_HASH) for f in fotos]
+    preprocessadas = [chapa_foto.preprocess_image_for_hash(img) for img in decodificadas]
+    etapas["decode"] = medir(
+        lambda f: chapa_foto.decode_data_url_to_image(f, chapa_foto.LADO_HASH).load(), fotos, args.repeticoes
+    )
+    etapas["preprocess"] = medir(chapa_foto.preprocess_image_for_hash, decodificadas, args.repeticoes)
+    etapas["phash"] = medir(imagehash.phash, preprocessadas, args.repeticoes)
+    etapas["analise_frame"] = medir(lambda f: chapa_foto.analisar_frames_lote([f]), fotos, args.repeticoes)
+
+    client = chapa_foto.app.test_client()
+
+    # cadastro de ponta a ponta: cada chamada é uma chapa nova
+    cadastros = iter(range(10**6))
+
+    def cadastrar(frames):
+        n = next(cadastros)
+        resp = client.post("/api/cadastro", json={"sku": f"BENCH{n}", "descricao": "bench", "frames": frames})
+        assert resp.status_code == 200, resp.get_json()
+
+    videos = [
+        [data_url(f, 90) for f in frames_video(args.seed + 100 + i, args.frames, args.largura, args.altura)]
+        for i in range(args.cadastros)
+    ]
+    etapas["cadastro"] = medir(cadastrar, videos)
+
+    # consulta: metade das fotos veio de chapas cadastradas, metade não
+    consultas = [v[0] for v in videos] + fotos
+    consultas = (consultas * (args.consultas // len(consultas) + 1))[:args.consultas]
+    hashes = [chapa_foto.analisar_frames_lote([c])[0][0] for c in consultas]
+
+    def consultar(foto):
+        resp = client.post("/api/consulta", json={"image": foto})
+        assert resp.status_code == 200, resp.get_json()
+
+    def buscar(h):
+        with chapa_foto.app.test_request_context():
+            chapa_foto.responder_consulta(h)
+
+    for tamanho in args.catalogos.split(","):
+        n = int(float(tamanho))
+        crescer_catalogo(chapa_foto, rng, n)
+        etapas[f"consulta_{tamanho}"] = medir(consultar, consultas)
+        etapas[f"busca_{tamanho}"] = medir(buscar, hashes, args.repeticoes)
+
+    resultado = {
+        "meta": {
+            "commit": commit_atual(),
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "maquina": platform.machine(),
+            "cpus": os.cpu_count(),
+            "hash_backend": chapa_foto.HASH_BACKEND,
+            "hash_engine": chapa_foto.HASH_ENGINE,
+            "parametros": vars(args),
+            "rss_max_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "etapas": etapas,
+    }
+
+    print(f"{'etapa':<16} {'média ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'ops/s':>9} {'pico MB':>8}")
+    for nome, e in etapas.items():
+        print(f"{nome:<16} {e['media_ms']:>9.2f} {e['p50_ms']:>9.2f} {e['p95_ms']:>9.2f} "
+              f"{e['ops_s']:>9.1f} {e['pico_mem_mb']:>8.2f}")
+
+    for destino in (args.saida, args.salvar_baseline):
+        if destino:
+            with open(destino, "w", encoding="utf-8") as f:
+                json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressoes = comparar(resultado, baseline, args.tolerancia)
+        print(f"\ncomparado com {args.baseline} (commit {baseline['meta'].get('commit')}), "
+              f"tolerância {args.tolerancia:.0%}:")
+        for nome, metrica, antes, agora in regressoes:
+            print(f"  REGRESSÃO {nome} {metrica}: {antes} -> {agora} (+{agora / antes - 1:.0%})")
+        if not regressoes:
+            print("  nenhuma regressão")
+        sys.exit(1 if regressoes else 0)
+
+
+if __name__ == "__main__":
+    main()
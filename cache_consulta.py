@@ -0,0 +1,89 @@
+# ---------------- CACHE DE CONSULTAS ---------------- #
+#
+# resultado das consultas recentes, pela chave (pHash, limiar, k, cor): o
+# operador costuma escanear a mesma chapa várias vezes seguidas e, com o
+# hash já calculado, a resposta sai daqui sem passar pelo índice nem pelo
+# banco. A cor só entra na chave quando muda a busca (pré-filtro de cor
+# ligado); fora isso, quem chama guarda um resultado que serve pra qualquer
+# cor e aplica a cor de cada foto em cima. LRU com tamanho máximo e validade (TTL) por entrada; tudo é
+# descartado quando o catálogo muda (época diferente).
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CacheConsultas:
+    # passo em que a assinatura de cor entra na chave: fotos da mesma chapa
+    # com uma variação mínima de iluminação caem na mesma entrada
+    PASSO_COR = 2.0
+
+    def __init__(self, tamanho: int = 1024, ttl: float = 300, prefixo_bits: int = 64):
+        self.tamanho = tamanho
+        self.ttl = ttl
+        # bits do pHash (dos mais significativos, as frequências mais baixas
+        # da DCT) usados na chave; < 64 faz scans quase iguais reaproveitarem
+        # o resultado um do outro, ao custo de a resposta não ser exata
+        self.prefixo_bits = prefixo_bits
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._epoca = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def chave(self, query: int, limiar: int, k: int, cor=None):
+        prefixo = query >> (64 - self.prefixo_bits) if self.prefixo_bits < 64 else query
+        if cor is not None:
+            cor = tuple(np.rint(np.asarray(cor, dtype=np.float64) / self.PASSO_COR).astype(int).tolist())
+        return prefixo, limiar, k, cor
+
+    def _validar_epoca(self, epoca):
+        # chamado com o lock: catálogo mudou (cadastro aqui ou em outro
+        # worker) -> nada do que está guardado vale mais
+        if epoca != self._epoca:
+            self._entradas.clear()
+            self._epoca = epoca
+
+    def obter(self, chave, epoca):
+        # o resultado guardado ou None (conta hit/miss)
+        if self.tamanho <= 0:
+            return None
+        agora = time.monotonic()
+        with self._lock:
+            self._validar_epoca(epoca)
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] < agora:
+                if entrada is not None:
+                    del self._entradas[chave]
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            return entrada[1]
+
+    def guardar(self, chave, epoca, resultado):
+        if self.tamanho <= 0:
+            return
+        with self._lock:
+            self._validar_epoca(epoca)
+            self._entradas[chave] = (time.monotonic() + self.ttl, resultado)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.tamanho:
+                self._entradas.popitem(last=False)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "tamanho": len(self._entradas),
+                "capacidade": self.tamanho,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "taxa_acerto": round(self.hits / total, 4) if total else 0.0,
+            }
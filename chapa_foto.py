@@ -1,72 +1,600 @@
 import os
 import sqlite3
 import base64
+import csv
+import functools
+import gzip
+import hashlib
 import io
-from datetime import datetime
-
+import json
+import multiprocessing
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import click
 from flask import (
     Flask,
+    Response,
+    abort,
+    g,
     request,
     jsonify,
-    render_template_string,
+    render_template,
     url_for,
     send_from_directory,
 )
 
-from PIL import Image, ImageOps, ImageFilter, ImageEnhance
+from jinja2 import DictLoader
+from werkzeug.security import safe_join
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+import numpy as np
+from PIL import Image, ImageOps, ImageFilter, ImageEnhance, features
+from scipy.ndimage import laplace
 import imagehash
 
+try:
+    import brotli
+except ImportError:  # opcional: sem ele as páginas saem só em gzip
+    brotli = None
+
+import preprocess_numpy
+from cache_consulta import CacheConsultas
+from metricas import Metricas, server_timing
+from hash_index import HashIndex, contidos, criar_backend, hash_to_i64, hash_to_int, ranquear
+
 # ---------------- CONFIG BÁSICA ---------------- #
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DB_PATH = os.path.join(BASE_DIR, "chapas.db")
-IMG_DIR = os.path.join(BASE_DIR, "chapas")
+DB_PATH = os.environ.get("CHAPAS_DB", os.path.join(BASE_DIR, "chapas.db"))
+IMG_DIR = os.environ.get("CHAPAS_IMG_DIR", os.path.join(BASE_DIR, "chapas"))
 
 os.makedirs(IMG_DIR, exist_ok=True)
 
+# distância máxima de Hamming pra considerar a chapa encontrada
+# (mais tolerante, já que temos vários frames por chapa)
+LIMIAR = 24
+# maior limiar que o cliente pode pedir: perto de 64 todo frame do índice
+# casa e a consulta vira varredura completa
+LIMIAR_MAX = int(os.environ.get("LIMIAR_MAX", "32"))
+
+# ranking da consulta: quantas chapas devolver (o cliente pode pedir outro k
+# até RANKING_K_MAX) e quantos frames mais próximos entram na média de cada chapa
+RANKING_K = int(os.environ.get("RANKING_K", "5"))
+RANKING_K_MAX = int(os.environ.get("RANKING_K_MAX", "50"))
+RANKING_MELHORES_N = int(os.environ.get("RANKING_MELHORES_N", "3"))
+# o cache guarda o ranking sem o filtro de cor, com RANKING_FOLGA vezes as
+# colocadas pedidas, pra sobrar o bastante depois de tirar as de outra cor
+RANKING_FOLGA = 4
+
+# backend da busca no índice: "linear", "mih" ou "bktree"; no limiar padrão
+# só o linear compensa (mih só ganha com raio pequeno, até ~8; ver README)
+HASH_BACKEND = os.environ.get("HASH_BACKEND", "linear")
+MIH_SUBSTRINGS = int(os.environ.get("MIH_SUBSTRINGS", "4"))
+
+# arquivo com o índice de hashes pronto (gerado por `flask gerar-indice`);
+# os workers abrem com mmap em vez de ler todo o chapa_hashes do banco
+HASH_INDEX_FILE = os.environ.get(
+    "HASH_INDEX_FILE", os.path.splitext(DB_PATH)[0] + ".idx"
+)
+
+# máximo de imagens aceitas por /api/consulta/batch
+BATCH_MAX_IMAGENS = int(os.environ.get("BATCH_MAX_IMAGENS", "64"))
+
+# SQLite: WAL deixa as consultas lerem enquanto um cadastro grava;
+# cache_size negativo é em KiB (padrão ~64 MiB), mmap_size em bytes
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", "-65536"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# decodifica o JPEG já reduzido (draft do libjpeg) até o tamanho que o hash e
+# a imagem salva precisam; 0 decodifica sempre em resolução cheia
+DECODE_REDUZIDO = os.environ.get("DECODE_REDUZIDO", "1") != "0"
+
+# motor do pré-processamento do hash: "pil" (cadeia de filtros do PIL) ou
+# "numpy" (preprocess_numpy, um buffer só e frames do cadastro em pilha)
+HASH_ENGINE = os.environ.get("HASH_ENGINE", "pil")
+
+# seleção dos frames do cadastro: nitidez = variância do laplaciano do miolo
+# da chapa em cinza; o frame precisa ter pelo menos NITIDEZ_MIN e
+# NITIDEZ_RELATIVA da nitidez do melhor frame do mesmo vídeo, brilho médio
+# entre BRILHO_MIN e BRILHO_MAX e no máximo SATURADOS_MAX de pixels
+# estourados/pretos; frames a até DEDUP_RAIO bits de um já aceito são
+# descartados como repetidos
+QUALIDADE_NITIDEZ_MIN = float(os.environ.get("QUALIDADE_NITIDEZ_MIN", "5"))
+QUALIDADE_NITIDEZ_RELATIVA = float(os.environ.get("QUALIDADE_NITIDEZ_RELATIVA", "0.5"))
+QUALIDADE_BRILHO_MIN = float(os.environ.get("QUALIDADE_BRILHO_MIN", "25"))
+QUALIDADE_BRILHO_MAX = float(os.environ.get("QUALIDADE_BRILHO_MAX", "230"))
+QUALIDADE_SATURADOS_MAX = float(os.environ.get("QUALIDADE_SATURADOS_MAX", "0.2"))
+DEDUP_RAIO = int(os.environ.get("DEDUP_RAIO", "4"))
+
+# filtro de cor da consulta: chapas com assinatura de cor (L*a*b*) a
+# distância > COR_LIMIAR da foto saem do resultado (mesmo padrão, outra cor);
+# 0 desliga
+COR_LIMIAR = float(os.environ.get("COR_LIMIAR", "25"))
+# a partir de COR_MIN_FRAMES frames no índice, essas chapas saem antes, nem
+# entram na comparação de hashes; abaixo disso pular as chapas custa mais que
+# comparar o catálogo inteiro (benchmarks/prefiltro_cor.py), e a cor só é
+# conferida nas chapas que a busca achou
+COR_MIN_FRAMES = int(float(os.environ.get("COR_MIN_FRAMES", "1e7")))
+
+# cache do resultado das consultas (por worker): entradas, validade em
+# segundos e bits do pHash na chave (64 = só o mesmo hash; menos que isso
+# reaproveita o resultado de scans quase iguais, de forma aproximada)
+CACHE_CONSULTAS = int(os.environ.get("CACHE_CONSULTAS", "1024"))
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "300"))
+CACHE_PREFIXO_BITS = int(os.environ.get("CACHE_PREFIXO_BITS", "64"))
+
+# processos usados pra gerar os hashes dos frames de um cadastro (1 = sem pool)
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", "0")) or os.cpu_count() or 1
+
+# cadastro assíncrono: com CADASTRO_FILA=1 as rotas de cadastro só gravam os
+# frames numa fila no banco e respondem na hora; threads de cada worker
+# fazem o hash e a gravação. Job "processando" há mais de
+# CADASTRO_FILA_TIMEOUT segundos (worker que morreu) volta pra fila, até
+# CADASTRO_FILA_TENTATIVAS vezes
+CADASTRO_FILA = os.environ.get("CADASTRO_FILA", "0") == "1"
+CADASTRO_FILA_THREADS = int(os.environ.get("CADASTRO_FILA_THREADS", "1"))
+CADASTRO_FILA_TIMEOUT = float(os.environ.get("CADASTRO_FILA_TIMEOUT", "600"))
+CADASTRO_FILA_TENTATIVAS = int(os.environ.get("CADASTRO_FILA_TENTATIVAS", "3"))
+
+# instrumentação das etapas das rotas (exportada em /metrics); com
+# SERVER_TIMING=1 as durações também voltam no cabeçalho Server-Timing
+METRICAS = os.environ.get("METRICAS", "1") != "0"
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+# captura nas páginas (anunciada em /api/config): com CAPTURA_REDUZIDA=1 o
+# navegador recorta o quadrado do meio e reduz os frames pro tamanho do hash
+# (o do meio do cadastro, que vira a imagem salva, pro tamanho dela) antes
+# de gerar o JPEG, com CAPTURA_QUALIDADE. Antes do envio, descarta os frames
+# com nitidez abaixo de CAPTURA_NITIDEZ_RELATIVA da do mais nítido do vídeo
+# e os que mudaram menos que CAPTURA_DIFERENCA_MIN (diferença média em cinza,
+# 0-255) desde o último aproveitado; 0 desliga cada filtro
+CAPTURA_REDUZIDA = os.environ.get("CAPTURA_REDUZIDA", "1") != "0"
+CAPTURA_QUALIDADE = float(os.environ.get("CAPTURA_QUALIDADE", "0.85"))
+CAPTURA_NITIDEZ_RELATIVA = float(os.environ.get("CAPTURA_NITIDEZ_RELATIVA", "0.35"))
+CAPTURA_DIFERENCA_MIN = float(os.environ.get("CAPTURA_DIFERENCA_MIN", "2"))
+
+# miniaturas das imagens salvas (maior lado, em px), geradas na primeira vez
+# que alguém pede e guardadas em IMG_DIR/miniaturas; o card da consulta
+# mostra a imagem a 220 px: a menor serve telas comuns e a maior as de alta
+# densidade. Com MINIATURAS_WEBP=1 (e o Pillow com WebP), navegadores que
+# aceitam image/webp recebem WebP
+MINIATURAS_LADOS = tuple(int(x) for x in os.environ.get("MINIATURAS_LADOS", "240,480").split(","))
+MINIATURAS_WEBP = os.environ.get("MINIATURAS_WEBP", "1") != "0" and features.check("webp")
+
+# modo ASGI (servidor_asgi.py, sob o uvicorn): o corpo da requisição é lido
+# sem ocupar thread e a rota roda num pool de ASGI_THREADS threads; com
+# ASGI_FILA requisições POST esperando além das que estão rodando, as
+# próximas levam 429 com Retry-After de ASGI_RETRY_AFTER segundos
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", "8"))
+ASGI_FILA = int(os.environ.get("ASGI_FILA", "32"))
+ASGI_RETRY_AFTER = int(os.environ.get("ASGI_RETRY_AFTER", "2"))
+
+# a análise da foto da consulta (decode + pHash + cor) roda no pool de hash
+# em vez da thread da requisição; o modo ASGI liga por padrão, porque lá as
+# threads das rotas dividem o mesmo GIL
+CONSULTA_NO_POOL = os.environ.get("CONSULTA_NO_POOL", "0") == "1"
+
 app = Flask(__name__)
+metricas = Metricas(ativo=METRICAS)
+
 
+# tamanho da página de /cadastrados e limite do /api/cadastrados
+CADASTRADOS_POR_PAGINA = int(os.environ.get("CADASTRADOS_POR_PAGINA", "50"))
+CADASTRADOS_LIMITE_MAX = 200
 
 # ---------------- BANCO DE DADOS ---------------- #
 
+_conns = threading.local()
+
+
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+    # uma conexão por thread, reaproveitada entre requisições; o pid evita
+    # reusar uma conexão herdada via fork (gunicorn --preload, pool de hash)
+    conn = getattr(_conns, "conn", None)
+    if conn is not None and _conns.pid == os.getpid():
+        return conn
+
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = {SQLITE_CACHE_SIZE}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    _conns.conn = conn
+    _conns.pid = os.getpid()
+    _conns.data_version = None
     return conn
 
 
+@app.teardown_appcontext
+def rollback_pendente(exc):
+    # a conexão sobrevive à requisição: não pode ficar transação aberta nela
+    conn = getattr(_conns, "conn", None)
+    if conn is not None and _conns.pid == os.getpid() and conn.in_transaction:
+        conn.rollback()
+
+
+# versão do esquema, gravada em PRAGMA user_version:
+#   0 -> original, pHash em texto hex nas duas tabelas
+#   1 -> pHash como INTEGER de 64 bits com sinal + índice em chapa_hashes.chapa_id
+SCHEMA_VERSION = 1
+
+CHAPAS_DDL = """
+CREATE TABLE IF NOT EXISTS {tabela} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sku TEXT NOT NULL,
+    descricao TEXT NOT NULL,
+    image_filename TEXT NOT NULL,
+    image_hash {tipo_hash},
+    created_at TEXT NOT NULL
+)
+"""
+
+CHAPA_HASHES_DDL = """
+CREATE TABLE IF NOT EXISTS {tabela} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chapa_id INTEGER NOT NULL,
+    image_hash {tipo_hash} NOT NULL,
+    FOREIGN KEY (chapa_id) REFERENCES chapas(id)
+)
+"""
+
+
+# assinatura de cor de cada chapa (média/desvio de L*, a*, b* dos frames
+# aproveitados); chapas cadastradas antes dela não têm linha aqui
+CHAPA_CORES_DDL = """
+CREATE TABLE IF NOT EXISTS chapa_cores (
+    chapa_id INTEGER PRIMARY KEY REFERENCES chapas(id),
+    l_media REAL NOT NULL,
+    a_media REAL NOT NULL,
+    b_media REAL NOT NULL,
+    l_desvio REAL NOT NULL,
+    a_desvio REAL NOT NULL,
+    b_desvio REAL NOT NULL
+)
+"""
+
+
+# fila do cadastro assíncrono: o job guarda os campos e o andamento, os
+# frames (JPEG cru) ficam na tabela ao lado até o job terminar
+CADASTRO_JOBS_DDL = """
+CREATE TABLE IF NOT EXISTS cadastro_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sku TEXT NOT NULL,
+    descricao TEXT NOT NULL,
+    status TEXT NOT NULL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    iniciado_em REAL,
+    chapa_id INTEGER REFERENCES chapas(id),
+    resposta TEXT,
+    created_at TEXT NOT NULL
+)
+"""
+
+CADASTRO_JOB_FRAMES_DDL = """
+CREATE TABLE IF NOT EXISTS cadastro_job_frames (
+    job_id INTEGER NOT NULL REFERENCES cadastro_jobs(id),
+    ordem INTEGER NOT NULL,
+    dados BLOB NOT NULL,
+    PRIMARY KEY (job_id, ordem)
+)
+"""
+
+
+# chapas vindas do "flask importar": a chave da entrada (arquivo, pasta ou
+# linha do CSV) marca o que já foi importado, pra retomar depois de uma
+# interrupção; os arquivos de origem servem de fonte pro "flask rehash"
+IMPORTACOES_DDL = """
+CREATE TABLE IF NOT EXISTS importacoes (
+    chave TEXT PRIMARY KEY,
+    chapa_id INTEGER NOT NULL REFERENCES chapas(id),
+    arquivos TEXT NOT NULL
+)
+"""
+
+# contadores do catálogo; epoca_hashes sobe quando um rehash apaga e recria
+# as linhas de chapa_hashes (os workers remontam o índice do zero)
+CATALOGO_META_DDL = """
+CREATE TABLE IF NOT EXISTS catalogo_meta (
+    chave TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL
+)
+"""
+
+
+# busca de SKU/descrição na listagem: índice FTS5 mantido por triggers
+# (content= aponta pra chapas, o texto não é duplicado). Sem FTS5 no SQLite,
+# cai pra busca por prefixo do SKU num índice NOCASE
+CHAPAS_BUSCA_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chapas_busca USING fts5(
+        sku, descricao, content='chapas', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chapas_busca_ai AFTER INSERT ON chapas BEGIN
+        INSERT INTO chapas_busca (rowid, sku, descricao) VALUES (new.id, new.sku, new.descricao);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chapas_busca_ad AFTER DELETE ON chapas BEGIN
+        INSERT INTO chapas_busca (chapas_busca, rowid, sku, descricao)
+        VALUES ('delete', old.id, old.sku, old.descricao);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chapas_busca_au AFTER UPDATE OF sku, descricao ON chapas BEGIN
+        INSERT INTO chapas_busca (chapas_busca, rowid, sku, descricao)
+        VALUES ('delete', old.id, old.sku, old.descricao);
+        INSERT INTO chapas_busca (rowid, sku, descricao) VALUES (new.id, new.sku, new.descricao);
+    END
+    """,
+)
+
+# None até o init_db descobrir se o SQLite tem FTS5
+_busca_fts = None
+
+
+def criar_indices_listagem(cur):
+    # listagem paginada por (created_at, id) + busca; a migração recria a
+    # tabela chapas e chama de novo
+    global _busca_fts
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chapas_created_at_id ON chapas (created_at, id)")
+    existia = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'chapas_busca'"
+    ).fetchone()
+    try:
+        for ddl in CHAPAS_BUSCA_DDL:
+            cur.execute(ddl)
+    except sqlite3.OperationalError:
+        # SQLite compilado sem FTS5
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_chapas_sku ON chapas (sku COLLATE NOCASE)")
+        _busca_fts = False
+        return
+    if not existia:
+        # banco que já tinha chapas: indexa o que existe
+        cur.execute("INSERT INTO chapas_busca (chapas_busca) VALUES ('rebuild')")
+    _busca_fts = True
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def epoca_hashes(conn) -> int:
+    row = conn.execute("SELECT valor FROM catalogo_meta WHERE chave = 'epoca_hashes'").fetchone()
+    return row[0] if row else 0
+
+
+def hash_para_banco(h, versao: int):
+    return hash_to_i64(h) if versao >= 1 else str(h)
+
+
 def init_db():
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS chapas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sku TEXT NOT NULL,
-            descricao TEXT NOT NULL,
-            image_filename TEXT NOT NULL,
-            image_hash TEXT NOT NULL,
-            created_at TEXT NOT NULL
+    # modo do journal fica gravado no arquivo, basta ligar uma vez
+    cur.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+    existe = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chapas'"
+    ).fetchone()
+
+    if not existe:
+        # banco novo já nasce no esquema compacto
+        cur.execute(CHAPAS_DDL.format(tabela="chapas", tipo_hash="INTEGER"))
+        cur.execute(CHAPA_HASHES_DDL.format(tabela="chapa_hashes", tipo_hash="INTEGER"))
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chapa_hashes_chapa_id ON chapa_hashes (chapa_id)"
         )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS chapa_hashes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chapa_id INTEGER NOT NULL,
-            image_hash TEXT NOT NULL,
-            FOREIGN KEY (chapa_id) REFERENCES chapas(id)
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    elif schema_version(conn) < 1:
+        cur.execute(CHAPAS_DDL.format(tabela="chapas", tipo_hash="TEXT NOT NULL"))
+        cur.execute(CHAPA_HASHES_DDL.format(tabela="chapa_hashes", tipo_hash="TEXT"))
+        app.logger.warning(
+            "chapas.db ainda guarda os hashes em texto; "
+            "rode 'flask --app chapa_foto migrar-hashes' pra converter"
         )
-        """
-    )
+    # não dependem do tipo dos hashes, valem pros dois esquemas
+    cur.execute(CHAPA_CORES_DDL)
+    cur.execute(CADASTRO_JOBS_DDL)
+    cur.execute(CADASTRO_JOB_FRAMES_DDL)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_cadastro_jobs_status ON cadastro_jobs (status)")
+    cur.execute(IMPORTACOES_DDL)
+    cur.execute(CATALOGO_META_DDL)
+    criar_indices_listagem(cur)
+
     conn.commit()
-    conn.close()
 
 
 init_db()
 
 
+# ---------------- MIGRAÇÃO DOS HASHES ---------------- #
+
+# (tabela antiga, tabela nova, colunas copiadas, posição do hash nas colunas)
+_MIGRACAO = (
+    ("chapas", "chapas_v1", "id, sku, descricao, image_filename, image_hash, created_at", 4),
+    ("chapa_hashes", "chapa_hashes_v1", "id, chapa_id, image_hash", 2),
+)
+
+
+def _copiar_lote(conn, origem, destino, colunas, pos_hash, desde, lote):
+    # copia um lote de linhas de origem com id > desde, convertendo o hash
+    # hex -> inteiro; devolve (linhas lidas, maior id lido)
+    rows = conn.execute(
+        f"SELECT {colunas} FROM {origem} WHERE id > ? ORDER BY id LIMIT ?",
+        (desde, lote),
+    ).fetchall()
+    if not rows:
+        return 0, desde
+
+    convertidas = []
+    for row in rows:
+        row = list(row)
+        try:
+            row[pos_hash] = hash_to_i64(row[pos_hash])
+        except (TypeError, ValueError):
+            if origem == "chapa_hashes":
+                # hash ilegível nunca casou com nada; não vale a pena carregar
+                continue
+            row[pos_hash] = None
+        convertidas.append(row)
+
+    marcadores = ", ".join("?" * len(colunas.split(",")))
+    conn.executemany(f"INSERT INTO {destino} ({colunas}) VALUES ({marcadores})", convertidas)
+    return len(rows), rows[-1][0]
+
+
+def migrar_hashes(conn, lote: int = 5000, log=print):
+    # migração online: copia em lotes pequenos (cada um numa transação curta)
+    # pra tabelas novas enquanto o app segue lendo/gravando nas antigas; no
+    # fim, numa única transação rápida, copia o resto e troca as tabelas.
+    # se for interrompida, é só rodar de novo que ela continua de onde parou
+    if schema_version(conn) >= SCHEMA_VERSION:
+        log("banco já está no esquema compacto.")
+        return
+
+    conn.execute(CHAPAS_DDL.format(tabela="chapas_v1", tipo_hash="INTEGER"))
+    conn.execute(CHAPA_HASHES_DDL.format(tabela="chapa_hashes_v1", tipo_hash="INTEGER"))
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chapa_hashes_chapa_id ON chapa_hashes_v1 (chapa_id)"
+    )
+    conn.commit()
+
+    ultimos = {}
+    for origem, destino, colunas, pos_hash in _MIGRACAO:
+        ultimo = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {destino}").fetchone()[0]
+        total = 0
+        while True:
+            qtd, ultimo = _copiar_lote(conn, origem, destino, colunas, pos_hash, ultimo, lote)
+            conn.commit()
+            if not qtd:
+                break
+            total += qtd
+            log(f"{origem}: {total} linhas copiadas (até id {ultimo})")
+        ultimos[origem] = ultimo
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for origem, destino, colunas, pos_hash in _MIGRACAO:
+            # o que entrou enquanto os lotes rodavam
+            ultimo = ultimos[origem]
+            while True:
+                qtd, ultimo = _copiar_lote(conn, origem, destino, colunas, pos_hash, ultimo, lote)
+                if not qtd:
+                    break
+        seqs = dict(conn.execute("SELECT name, seq FROM sqlite_sequence").fetchall())
+        conn.execute("DROP TABLE chapa_hashes")
+        conn.execute("DROP TABLE chapas")
+        conn.execute("ALTER TABLE chapas_v1 RENAME TO chapas")
+        conn.execute("ALTER TABLE chapa_hashes_v1 RENAME TO chapa_hashes")
+        # ids nunca voltam pra trás (o índice em memória dos workers usa o id)
+        for tabela in ("chapas", "chapa_hashes"):
+            conn.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?",
+                (seqs.get(tabela, 0), tabela),
+            )
+        # índices e triggers da tabela antiga foram junto com ela
+        criar_indices_listagem(conn.cursor())
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    log("migração concluída; rode VACUUM fora do horário de pico pra devolver o espaço.")
+
+
+@app.cli.command("migrar-hashes")
+@click.option("--lote", default=5000, show_default=True, help="linhas copiadas por transação")
+def migrar_hashes_command(lote):
+    """Converte os hashes de chapas.db de texto hex para INTEGER 64 bits."""
+    migrar_hashes(get_conn(), lote=lote, log=click.echo)
+
+
+# ---------------- ÍNDICE DE HASHES ---------------- #
+
+# carregado uma vez por processo; depois disso só entram as linhas com
+# chapa_hashes.id acima da marca d'água do índice (só recarrega tudo depois
+# de um rehash, quando epoca_hashes muda)
+def novo_hash_index() -> HashIndex:
+    if HASH_BACKEND == "mih":
+        return HashIndex(criar_backend("mih", substrings=MIH_SUBSTRINGS))
+    return HashIndex(HASH_BACKEND)
+
+
+hash_index = novo_hash_index()
+_hash_index_epoca = None
+_hash_index_lock = threading.Lock()
+
+cache_consultas = CacheConsultas(CACHE_CONSULTAS, CACHE_TTL, CACHE_PREFIXO_BITS)
+
+
+def epoca_catalogo():
+    # muda sempre que entra chapa no índice, vinda deste worker ou de outro
+    return _hash_index_epoca, hash_index.ultimo_id, hash_index.cores.ultimo_id
+
+
+def sync_hash_index(forcar: bool = False):
+    # PRAGMA data_version só muda quando OUTRA conexão (outro worker, outro
+    # container no mesmo arquivo) faz commit: se não mudou, não há o que
+    # buscar e a consulta segue sem tocar em chapa_hashes. commits da própria
+    # conexão não mexem nele, por isso o cadastro chama com forcar=True
+    global hash_index, _hash_index_epoca
+    conn = get_conn()
+    versao = conn.execute("PRAGMA data_version").fetchone()[0]
+    if not forcar and versao == _conns.data_version:
+        return
+    if epoca_hashes(conn) != _hash_index_epoca:
+        # rehash apagou as linhas que o índice tem: monta outro e troca
+        with _hash_index_lock:
+            epoca = epoca_hashes(conn)
+            if epoca != _hash_index_epoca:
+                hash_index = load_hash_index(novo_hash_index())
+                _hash_index_epoca = epoca
+    hash_index.sincronizar(conn)
+    hash_index.cores.sincronizar(conn)
+    _conns.data_version = versao
+
+
+def load_hash_index(indice: HashIndex) -> HashIndex:
+    # com o arquivo de índice, o worker sobe só mapeando o arquivo e lendo do
+    # banco o que entrou depois que ele foi gerado
+    conn = get_conn()
+    if os.path.exists(HASH_INDEX_FILE):
+        try:
+            if not indice.carregar_arquivo(HASH_INDEX_FILE, conn):
+                app.logger.warning(
+                    "%s não bate com o banco (gere de novo com 'flask gerar-indice'); ignorando",
+                    HASH_INDEX_FILE,
+                )
+        except ValueError as e:
+            app.logger.warning("ignorando arquivo de índice: %s", e)
+    indice.sincronizar(conn)
+    indice.cores.sincronizar(conn)
+    return indice
+
+
+sync_hash_index(forcar=True)
+
+
+@app.cli.command("gerar-indice")
+def gerar_indice_command():
+    """Gera o arquivo de índice de hashes (mmap) a partir de chapas.db."""
+    sync_hash_index(forcar=True)
+    hash_index.salvar_arquivo(HASH_INDEX_FILE)
+    click.echo(
+        f"{HASH_INDEX_FILE}: {len(hash_index)} hashes (até chapa_hashes.id {hash_index.ultimo_id})"
+    )
+
+
 # ---------------- FUNÇÕES DE IMAGEM ---------------- #
 
 def preprocess_image_for_save(img: Image.Image) -> Image.Image:
@@ -107,22 +635,470 @@ def preprocess_image_for_hash(img: Image.Image) -> Image.Image:
     return img
 
 
-def decode_data_url_to_image(data_url: str) -> Image.Image:
+# menor lado que o preprocess_image_for_hash precisa (recorta o quadrado do
+# meio e reduz pra 400x400) e maior lado da imagem salva
+LADO_HASH = 400
+LADO_SAVE = 800
+
+
+def data_url_to_bytes(data_url: str) -> bytes:
     if "," in data_url:
         _, b64data = data_url.split(",", 1)
     else:
         b64data = data_url
-    raw = base64.b64decode(b64data)
-    return Image.open(io.BytesIO(raw))
+    return base64.b64decode(b64data)
 
 
-def save_image(pil_img: Image.Image) -> str:
-    filename = f"chapa_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jpg"
-    path = os.path.join(IMG_DIR, filename)
-    pil_img.save(path, "JPEG", quality=95)
+def decode_data_url_to_image(data_url: str, menor_lado: int = 0, maior_lado: int = 0) -> Image.Image:
+    return decode_bytes_to_image(data_url_to_bytes(data_url), menor_lado, maior_lado)
+
+
+def decode_bytes_to_image(raw: bytes, menor_lado: int = 0, maior_lado: int = 0) -> Image.Image:
+    # com menor_lado/maior_lado, decodifica na menor escala que ainda cobre os
+    # dois: JPEG usa draft() (o libjpeg decodifica direto em 1/2, 1/4 ou 1/8,
+    # sem passar pela resolução cheia); outros formatos usam reduce()
+    img = Image.open(io.BytesIO(raw))
+    if not DECODE_REDUZIDO or not (menor_lado or maior_lado):
+        return img
+
+    w, h = img.size
+    fator = min(
+        min(w, h) // menor_lado if menor_lado else w,
+        max(w, h) // maior_lado if maior_lado else w,
+    )
+    if fator < 2:
+        return img
+    if img.format == "JPEG":
+        img.draft(img.mode, (-(-w // fator), -(-h // fator)))
+        return img
+    return img.reduce(fator)
+
+
+# imagens salvas endereçadas pelo conteúdo: o nome é o sha256 do JPEG, em
+# subpastas pelos primeiros dígitos (ab/cd/abcd...jpg), pra nenhuma pasta
+# passar de alguns milhares de arquivos; a mesma imagem salva duas vezes é
+# gravada uma vez só. Chapas antigas ainda podem ter o nome
+# chapa_<data>.jpg, até rodar o migrar-imagens
+NOME_CONTEUDO = re.compile(r"[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.jpg")
+
+
+def nome_conteudo(dados: bytes) -> str:
+    digest = hashlib.sha256(dados).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+
+
+def gravar_atomico(caminho: str, salvar):
+    # salvar(arquivo) escreve num temporário da mesma pasta, que só então
+    # troca de nome: quem lê nunca vê um arquivo pela metade, e dois workers
+    # gerando a mesma miniatura não se atrapalham
+    pasta = os.path.dirname(caminho)
+    os.makedirs(pasta, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=pasta, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            salvar(f)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, caminho)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def guardar_imagem(dados: bytes) -> str:
+    # grava o JPEG (se ainda não existe) e devolve o nome relativo a IMG_DIR
+    filename = nome_conteudo(dados)
+    caminho = os.path.join(IMG_DIR, filename)
+    try:
+        # repetida: só renova o mtime, pro gc-imagens (que poupa os arquivos
+        # recentes) não apagar uma imagem que uma chapa nova vai usar
+        os.utime(caminho)
+    except FileNotFoundError:
+        gravar_atomico(caminho, lambda f: f.write(dados))
     return filename
 
 
+def save_image(pil_img: Image.Image) -> str:
+    buf = io.BytesIO()
+    pil_img.save(buf, "JPEG", quality=95)
+    return guardar_imagem(buf.getvalue())
+
+
+def hash_image(pil_img: Image.Image) -> str:
+    return hash_images([pil_img])[0]
+
+
+def hash_images(imagens):
+    # pHash (hex) de cada imagem, None onde a imagem é None; no motor numpy
+    # as imagens são pré-processadas juntas, como uma pilha só
+    validas = [img for img in imagens if img is not None]
+    if not validas:
+        return [None] * len(imagens)
+    if HASH_ENGINE == "numpy":
+        with metricas.etapa("preprocess"):
+            cinzas = preprocess_numpy.preprocess_stack(preprocess_numpy.empilhar(validas))
+        with metricas.etapa("phash"):
+            hashes = iter(preprocess_numpy.phash_stack(cinzas))
+    else:
+        with metricas.etapa("preprocess"):
+            prontas = [preprocess_image_for_hash(img) for img in validas]
+        with metricas.etapa("phash"):
+            hashes = iter([str(imagehash.phash(img)) for img in prontas])
+    return [None if img is None else next(hashes) for img in imagens]
+
+
+def qualidade_frame(img: Image.Image) -> dict:
+    # medido no quadrado do meio reduzido pra 256x256 em cinza, pra não
+    # depender da resolução do frame
+    cinza = img.convert("L")
+    w, h = cinza.size
+    side = min(w, h)
+    left = (w - side) // 2
+    top = (h - side) // 2
+    cinza = cinza.resize((256, 256), Image.BILINEAR, box=(left, top, left + side, top + side))
+    arr = np.asarray(cinza, dtype=np.float32)
+    return {
+        "nitidez": float(laplace(arr).var()),
+        "brilho": float(arr.mean()),
+        "saturados": float(((arr <= 5) | (arr >= 250)).mean()),
+    }
+
+
+# sRGB linear -> XYZ (D65), e o branco de referência
+_RGB_PARA_XYZ = np.array(
+    [[0.4124, 0.3576, 0.1805], [0.2126, 0.7152, 0.0722], [0.0193, 0.1192, 0.9505]],
+    dtype=np.float32,
+)
+_BRANCO_D65 = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+
+def assinatura_cor(img: Image.Image) -> list:
+    # média e desvio de L*, a*, b* no quadrado do meio reduzido pra 64x64:
+    # o pHash é em cinza e não vê a cor da chapa, isso aqui vê
+    rgb = img.convert("RGB")
+    w, h = rgb.size
+    side = min(w, h)
+    left = (w - side) // 2
+    top = (h - side) // 2
+    rgb = rgb.resize((64, 64), Image.BILINEAR, box=(left, top, left + side, top + side))
+    arr = np.asarray(rgb, dtype=np.float32).reshape(-1, 3) / 255
+    linear = np.where(arr <= 0.04045, arr / 12.92, ((arr + 0.055) / 1.055) ** 2.4)
+    xyz = (linear @ _RGB_PARA_XYZ.T) / _BRANCO_D65
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    lab = np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+    return [float(v) for v in (*lab.mean(axis=0), *lab.std(axis=0))]
+
+
+def decode_frame(frame):
+    # data URL ou JPEG cru -> imagem já decodificada na escala do hash, ou
+    # None se não der pra ler
+    try:
+        if isinstance(frame, bytes):
+            raw = frame
+        else:
+            with metricas.etapa("base64"):
+                raw = data_url_to_bytes(frame)
+        with metricas.etapa("decode"):
+            img = decode_bytes_to_image(raw, LADO_HASH)
+            img.load()
+        return img
+    except Exception:
+        return None
+
+
+def _hash_images_ou_none(imagens):
+    # se o lote falhar, tenta imagem por imagem pra perder só a que deu erro
+    try:
+        return hash_images(imagens)
+    except Exception:
+        if len(imagens) == 1:
+            return [None]
+        return [_hash_images_ou_none([img])[0] for img in imagens]
+
+
+def analisar_frames_lote(frames):
+    # roda dentro do pool: (hash, qualidade, assinatura de cor) de cada frame
+    # (data URLs ou JPEG cru), na ordem, None pros que falharem
+    imagens = [decode_frame(f) for f in frames]
+    hashes = _hash_images_ou_none(imagens)
+    with metricas.etapa("qualidade_cor"):
+        return [
+            None if h is None else (h, qualidade_frame(img), assinatura_cor(img))
+            for h, img in zip(hashes, imagens)
+        ]
+
+
+def decode_preview(raw: bytes):
+    # o frame do meio do cadastro é decodificado uma vez só, numa escala que
+    # serve tanto pra imagem salva quanto pro hash: devolve
+    # (imagem, (hash, qualidade, assinatura de cor))
+    with metricas.etapa("decode"):
+        pil = decode_bytes_to_image(raw, LADO_HASH, LADO_SAVE)
+        pil.load()
+    h = hash_image(pil)
+    with metricas.etapa("qualidade_cor"):
+        return pil, (h, qualidade_frame(pil), assinatura_cor(pil))
+
+
+def selecionar_frames(analises):
+    # escolhe os hashes que vão pro índice: descarta frames ilegíveis, fora de
+    # foco ou mal expostos, e os quase iguais a um frame melhor já aceito.
+    # devolve (hashes, assinatura de cor média dos frames aproveitados,
+    # resumo com a contagem de cada descarte)
+    legiveis = [a for a in analises if a is not None]
+    resumo = {"recebidos": len(analises), "ilegiveis": len(analises) - len(legiveis)}
+    if not legiveis:
+        resumo.update(descartados_qualidade=0, repetidos=0, aproveitados=0)
+        return [], None, resumo
+
+    melhor_nitidez = max(q["nitidez"] for _, q, _ in legiveis)
+    nitidez_min = max(QUALIDADE_NITIDEZ_MIN, melhor_nitidez * QUALIDADE_NITIDEZ_RELATIVA)
+    bons = [
+        a for a in legiveis
+        if a[1]["nitidez"] >= nitidez_min
+        and QUALIDADE_BRILHO_MIN <= a[1]["brilho"] <= QUALIDADE_BRILHO_MAX
+        and a[1]["saturados"] <= QUALIDADE_SATURADOS_MAX
+    ]
+    # vídeo todo ruim: fica pelo menos o frame mais nítido, pra chapa não
+    # ficar sem hash nenhum
+    if not bons:
+        bons = [max(legiveis, key=lambda a: a[1]["nitidez"])]
+    resumo["descartados_qualidade"] = len(legiveis) - len(bons)
+
+    # do mais nítido pro menos: cada frame só entra se estiver a mais de
+    # DEDUP_RAIO bits de todos os já aceitos
+    aceitos = []
+    for i in sorted(range(len(bons)), key=lambda i: -bons[i][1]["nitidez"]):
+        valor = hash_to_int(bons[i][0])
+        if all(bin(valor ^ outro).count("1") > DEDUP_RAIO for outro, _ in aceitos):
+            aceitos.append((valor, i))
+    resumo["repetidos"] = len(bons) - len(aceitos)
+    resumo["aproveitados"] = len(aceitos)
+
+    # mantém a ordem do vídeo
+    escolhidos = [bons[i] for i in sorted(i for _, i in aceitos)]
+    cor = np.mean([c for _, _, c in escolhidos], axis=0).tolist()
+    return [h for h, _, _ in escolhidos], cor, resumo
+
+
+# ---------------- MINIATURAS ---------------- #
+#
+# as URLs das imagens levam ?v=<digest do arquivo>: com o digest certo, a
+# resposta pode ficar um ano no cache do navegador (immutable), e qualquer
+# mudança no arquivo muda a URL; nas miniaturas o v leva também o lado e os
+# parâmetros de codificação, que mudam a miniatura sem mudar a imagem
+
+CACHE_IMUTAVEL = 365 * 24 * 3600
+
+CODIFICACAO_MINIATURA = {
+    "JPEG": {"quality": 80, "optimize": True, "progressive": True},
+    "WEBP": {"quality": 75, "method": 4},
+}
+# muda quando CODIFICACAO_MINIATURA muda; também dá nome à pasta das
+# miniaturas no disco, pra que as geradas com os parâmetros velhos não voltem
+PARAMETROS_MINIATURA = hashlib.sha256(
+    repr(sorted((f, sorted(p.items())) for f, p in CODIFICACAO_MINIATURA.items())).encode()
+).hexdigest()[:6]
+
+
+@functools.lru_cache(maxsize=8192)
+def _digest_arquivo(caminho: str, tamanho: int, mtime_ns: int) -> str:
+    # tamanho e mtime entram na chave só pra invalidar quando o arquivo muda
+    with open(caminho, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def versao_imagem(filename: str):
+    # digest da imagem salva (None se ela não existe); no armazenamento por
+    # conteúdo ele já está no nome
+    conteudo = NOME_CONTEUDO.fullmatch(filename)
+    if conteudo:
+        return conteudo.group(1)[:16]
+    caminho = safe_join(IMG_DIR, filename)
+    try:
+        st = os.stat(caminho)
+    except (TypeError, OSError):
+        return None
+    return _digest_arquivo(caminho, st.st_size, st.st_mtime_ns)
+
+
+def versao_miniatura(filename: str, lado: int):
+    versao = versao_imagem(filename)
+    if versao is None:
+        return None
+    return f"{versao}-{lado}-{PARAMETROS_MINIATURA}"
+
+
+def pasta_miniaturas(lado: int) -> str:
+    return os.path.join(IMG_DIR, "miniaturas", f"{lado}-{PARAMETROS_MINIATURA}")
+
+
+def url_imagem(filename: str, lado: int = 0) -> str:
+    # URL versionada da imagem salva (lado=0) ou da miniatura de `lado` px
+    if lado:
+        versao = versao_miniatura(filename, lado)
+        return url_for("chapa_miniatura", lado=lado, filename=filename, v=versao)
+    return url_for("chapa_image", filename=filename, v=versao_imagem(filename))
+
+
+app.add_template_global(url_imagem)
+
+
+def miniatura(filename: str, lado: int, formato: str):
+    # (pasta, nome) da miniatura no disco, gerada se ainda não existe;
+    # None se a imagem original não existe
+    original = safe_join(IMG_DIR, filename)
+    if original is None or not os.path.isfile(original):
+        return None
+    extensao = "webp" if formato == "WEBP" else "jpg"
+    pasta = pasta_miniaturas(lado)
+    nome = f"{os.path.splitext(filename)[0]}.{extensao}"
+    caminho = os.path.join(pasta, nome)
+    # uma imagem endereçada pelo conteúdo nunca muda; as de nome antigo
+    # podem ter sido regravadas depois da miniatura
+    if os.path.exists(caminho) and (
+        NOME_CONTEUDO.fullmatch(filename) or os.path.getmtime(caminho) >= os.path.getmtime(original)
+    ):
+        return pasta, nome
+
+    with metricas.etapa("miniatura"):
+        img = decode_bytes_to_image(_ler_arquivo(original), maior_lado=lado)
+        img = img.convert("RGB")
+        img.thumbnail((lado, lado), Image.LANCZOS)
+        gravar_atomico(caminho, lambda f: img.save(f, formato, **CODIFICACAO_MINIATURA[formato]))
+    return pasta, nome
+
+
+def enviar_imagem(pasta: str, nome: str, imutavel: bool):
+    # sem versão (ou com uma velha) o navegador revalida pelo ETag a cada uso
+    resp = send_from_directory(pasta, nome, max_age=CACHE_IMUTAVEL if imutavel else None)
+    if imutavel:
+        resp.cache_control.immutable = True
+    return resp
+
+
+# ---------------- POOL DE HASH ---------------- #
+
+_hash_pool = None
+_hash_pool_pid = None
+
+
+_hash_pool_lock = threading.Lock()
+
+
+def get_hash_pool():
+    # criado sob demanda dentro de cada worker do gunicorn (nunca herdado do
+    # master); com lock, porque as threads da fila e do modo ASGI podem
+    # chegar aqui juntas
+    global _hash_pool, _hash_pool_pid
+    if HASH_WORKERS <= 1:
+        return None
+    with _hash_pool_lock:
+        if _hash_pool is None or _hash_pool_pid != os.getpid():
+            _hash_pool = criar_pool(HASH_WORKERS)
+            _hash_pool_pid = os.getpid()
+        return _hash_pool
+
+
+def criar_pool(workers: int) -> ProcessPoolExecutor:
+    metodos = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("fork" if "fork" in metodos else None)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+
+
+def dividir_frames(frames):
+    # tarefas do pool: um frame por tarefa no motor pil; no numpy, uma pilha
+    # por processo do pool
+    if HASH_ENGINE != "numpy":
+        return [[f] for f in frames]
+    tamanho = -(-len(frames) // max(1, min(HASH_WORKERS, len(frames))))
+    return [frames[i:i + tamanho] for i in range(0, len(frames), tamanho)]
+
+
+def tarefa_pool(fn, arg):
+    # o que de fato roda no pool: (resultado de fn(arg), etapas medidas no
+    # filho); quem recebe registra as etapas com metricas.registrar_etapas
+    return metricas.medir_tarefa(fn, arg)
+
+
+def mapear_no_pool(pool, fn, partes):
+    # pool.map(fn, partes), com as etapas dos filhos nas métricas daqui
+    resultados = []
+    for resultado, tempos in pool.map(tarefa_pool, [fn] * len(partes), partes):
+        metricas.registrar_etapas(tempos)
+        resultados.append(resultado)
+    return resultados
+
+
+class FuturoPool:
+    # o Future de tarefa_pool, devolvendo só o resultado; as etapas medidas
+    # no filho entram nas métricas da thread que espera por ele
+    __slots__ = ("futuro", "registrado")
+
+    def __init__(self, futuro: Future):
+        self.futuro = futuro
+        self.registrado = False
+
+    def cancel(self) -> bool:
+        return self.futuro.cancel()
+
+    def result(self, timeout=None):
+        resultado, tempos = self.futuro.result(timeout)
+        if not self.registrado:
+            self.registrado = True
+            metricas.registrar_etapas(tempos)
+        return resultado
+
+
+def analisar_frames(frames):
+    # analisar_frames_lote no pool, dividido entre os processos; mesma ordem
+    # dos frames
+    pool = get_hash_pool()
+    if pool is None or len(frames) < 2:
+        return analisar_frames_lote(frames)
+    return [a for parte in mapear_no_pool(pool, analisar_frames_lote, dividir_frames(frames)) for a in parte]
+
+
+def hash_async(fn, arg):
+    # manda um frame pro pool assim que ele chega; sem pool, calcula na hora
+    pool = get_hash_pool()
+    if pool is not None:
+        return FuturoPool(pool.submit(tarefa_pool, fn, arg))
+    fut = Future()
+    fut.set_result(fn(arg))
+    return fut
+
+
+# ---------------- UPLOAD MULTIPART ---------------- #
+
+def iter_multipart(stream, boundary: str, chunk_size: int = 64 * 1024):
+    # lê o corpo aos pedaços e devolve cada parte assim que ela termina:
+    # (nome, bytes); não espera o corpo inteiro nem guarda cópias extras
+    decoder = MultipartDecoder(boundary.encode("latin-1"))
+    nome = None
+    pedacos = []
+    while True:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            chunk = stream.read(chunk_size)
+            decoder.receive_data(chunk or None)
+        elif isinstance(event, (Field, File)):
+            nome = event.name
+            pedacos = []
+        elif isinstance(event, Data):
+            pedacos.append(event.data)
+            if not event.more_data:
+                yield nome, b"".join(pedacos)
+                pedacos = []
+        elif isinstance(event, Epilogue):
+            return
+
+
+def multipart_boundary():
+    if request.mimetype != "multipart/form-data":
+        return None
+    return request.mimetype_params.get("boundary")
+
+
 # ---------------- HTML (TUDO INLINE) ---------------- #
 
 BASE_HTML_HEAD = """
@@ -319,8 +1295,128 @@ HOME_HTML = (
     + BASE_HTML_FOOT
 )
 
+# funções de captura das páginas de cadastro e consulta
+CAPTURA_JS = """
+<script>
+// configuração anunciada pelo servidor; estes valores só valem se o
+// /api/config não responder
+let configCaptura = { lado: 400, lado_salvo: 800, qualidade_jpeg: 0.85, nitidez_relativa: 0.35, diferenca_min: 2 };
+fetch("{{ url_for('api_config') }}")
+    .then(resp => resp.json())
+    .then(data => { configCaptura = data.captura; })
+    .catch(() => {});
+
+const LADO_METRICA = 64;
+
+function capturarBlob(canvas, qualidade) {
+    return new Promise(resolve => canvas.toBlob(resolve, "image/jpeg", qualidade));
+}
+
+function desenharQuadrado(video, canvas, lado) {
+    // quadrado do meio do vídeo, reduzido pra `lado`: é só ele que o hash, a
+    // qualidade e a cor usam no servidor
+    const origem = Math.min(video.videoWidth, video.videoHeight);
+    lado = Math.min(lado, origem);
+    canvas.width = canvas.height = lado;
+    const ctx = canvas.getContext("2d", { willReadFrequently: lado === LADO_METRICA });
+    ctx.imageSmoothingQuality = "high";
+    ctx.drawImage(video, (video.videoWidth - origem) / 2, (video.videoHeight - origem) / 2, origem, origem,
+                  0, 0, lado, lado);
+    return ctx;
+}
+
+function desenharInteiro(video, canvas, maiorLado, menorLado) {
+    // frame inteiro (a imagem salva não é recortada), reduzido até o maior
+    // lado caber em maiorLado sem o menor ficar abaixo de menorLado
+    const w = video.videoWidth, h = video.videoHeight;
+    const escala = maiorLado ? Math.min(1, Math.max(maiorLado / Math.max(w, h), menorLado / Math.min(w, h))) : 1;
+    canvas.width = Math.round(w * escala);
+    canvas.height = Math.round(h * escala);
+    const ctx = canvas.getContext("2d");
+    ctx.imageSmoothingQuality = "high";
+    ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
+}
+
+function capturarFrame(video, canvas, comPreview) {
+    // {blob, preview} do frame atual: blob é o que vai pro hash (o quadrado
+    // do meio no tamanho anunciado, ou o frame inteiro com lado 0); preview
+    // é um canvas com o frame inteiro no tamanho da imagem salva, que só vira
+    // JPEG (blobPreview) se o frame for o escolhido
+    const cfg = configCaptura;
+    if (!cfg.lado) {
+        desenharInteiro(video, canvas, 0, 0);
+        return { blob: capturarBlob(canvas, cfg.qualidade_jpeg), preview: null };
+    }
+    desenharQuadrado(video, canvas, cfg.lado);
+    const blob = capturarBlob(canvas, cfg.qualidade_jpeg);
+    if (!comPreview) return { blob, preview: null };
+    const canvasPreview = document.createElement("canvas");
+    desenharInteiro(video, canvasPreview, cfg.lado_salvo, cfg.lado);
+    return { blob, preview: canvasPreview };
+}
+
+function blobPreview(captura) {
+    // com lado 0 o próprio frame já é a imagem salva
+    if (!captura.preview) return captura.blob;
+    return capturarBlob(captura.preview, configCaptura.qualidade_jpeg);
+}
+
+function metricaFrame(video, canvas) {
+    // miolo em cinza 64x64: nitidez (variância do laplaciano, como no
+    // servidor) e os pixels, pra comparar com o frame anterior
+    const n = LADO_METRICA;
+    const rgba = desenharQuadrado(video, canvas, n).getImageData(0, 0, n, n).data;
+    const cinza = new Float32Array(n * n);
+    for (let i = 0; i < n * n; i++) {
+        cinza[i] = 0.299 * rgba[4 * i] + 0.587 * rgba[4 * i + 1] + 0.114 * rgba[4 * i + 2];
+    }
+    let soma = 0, soma2 = 0, qtd = 0;
+    for (let y = 1; y < n - 1; y++) {
+        for (let x = 1; x < n - 1; x++) {
+            const i = y * n + x;
+            const l = cinza[i - 1] + cinza[i + 1] + cinza[i - n] + cinza[i + n] - 4 * cinza[i];
+            soma += l;
+            soma2 += l * l;
+            qtd++;
+        }
+    }
+    const media = soma / qtd;
+    return { nitidez: soma2 / qtd - media * media, cinza };
+}
+
+function diferencaMedia(a, b) {
+    let soma = 0;
+    for (let i = 0; i < a.length; i++) soma += Math.abs(a[i] - b[i]);
+    return soma / a.length;
+}
+
+function selecionarCapturas(capturas) {
+    // o que vale enviar, na ordem do vídeo: sem os frames borrados (abaixo
+    // de nitidez_relativa do mais nítido) e sem repetir os que quase não
+    // mudaram desde o último aproveitado (fica o mais nítido dos dois)
+    if (!capturas.length) return [];
+    const melhor = capturas.reduce((a, b) => (b.nitidez > a.nitidez ? b : a));
+    const escolhidas = [];
+    for (const c of capturas) {
+        if (c.nitidez < configCaptura.nitidez_relativa * melhor.nitidez) continue;
+        const anterior = escolhidas[escolhidas.length - 1];
+        // com diferenca_min 0 (ou sem o miolo em cinza) não há o que comparar
+        const repetida = configCaptura.diferenca_min > 0 && anterior && anterior.cinza && c.cinza
+            && diferencaMedia(anterior.cinza, c.cinza) < configCaptura.diferenca_min;
+        if (repetida) {
+            if (c.nitidez > anterior.nitidez) escolhidas[escolhidas.length - 1] = c;
+            continue;
+        }
+        escolhidas.push(c);
+    }
+    return escolhidas;
+}
+</script>
+"""
+
 CADASTRO_HTML = (
     BASE_HTML_HEAD
+    + CAPTURA_JS
     + """
 <h2>Cadastrar Chapa MDF (vídeo 5s)</h2>
 
@@ -406,33 +1502,49 @@ function gravarVideoCadastro() {
     msg.textContent = "Gravando 5 segundos... mova o celular em volta da chapa.";
     msg.className = "msg";
 
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
-    const ctx = canvas.getContext("2d");
+    const canvasMetrica = document.createElement("canvas");
 
     const durationMs = 5000;
     const intervalMs = 400; // ~12 frames
     let elapsed = 0;
 
+    // toBlob copia o canvas na hora da chamada; o JPEG fica pronto depois.
+    // Cada frame já sai reduzido; o preview (frame inteiro, pra imagem
+    // salva) fica desenhado num canvas, porque só no fim se sabe qual frame
+    // fica no meio, e só o dele é codificado
+    const capturas = [];
+
     function captureFrame() {
-        ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-        const dataUrl = canvas.toDataURL("image/jpeg", 0.85);
-        framesCadastro.push(dataUrl);
+        const captura = capturarFrame(video, canvas, true);
+        if (configCaptura.nitidez_relativa || configCaptura.diferenca_min) {
+            Object.assign(captura, metricaFrame(video, canvasMetrica));
+        } else {
+            captura.nitidez = 0;
+        }
+        capturas.push(captura);
     }
 
     captureFrame();
 
-    const intervalId = setInterval(() => {
+    const intervalId = setInterval(async () => {
         elapsed += intervalMs;
         captureFrame();
         if (elapsed >= durationMs) {
             clearInterval(intervalId);
-            if (framesCadastro.length > 0) {
-                const mid = Math.floor(framesCadastro.length / 2);
-                imgPreview.src = framesCadastro[mid];
+            // o servidor usa o frame do meio como imagem salva
+            const escolhidas = selecionarCapturas(capturas);
+            const mid = Math.floor(escolhidas.length / 2);
+            framesCadastro = (await Promise.all(
+                escolhidas.map((c, i) => (i === mid ? blobPreview(c) : c.blob))
+            )).filter(Boolean);
+            // com o JPEG pronto, os canvas dos previews só ocupam memória
+            capturas.forEach(c => { if (c.preview) c.preview.width = c.preview.height = 0; });
+            if (framesCadastro.length === escolhidas.length) {
+                if (imgPreview.src) URL.revokeObjectURL(imgPreview.src);
+                imgPreview.src = URL.createObjectURL(framesCadastro[mid]);
                 previewDiv.style.display = "block";
                 form.style.display = "block";
-                msg.textContent = "Vídeo capturado. Preencha os dados e salve.";
+                msg.textContent = `Vídeo capturado (${escolhidas.length} de ${capturas.length} frames). Preencha os dados e salve.`;
                 msg.className = "msg success";
             } else {
                 msg.textContent = "Não foi possível capturar o vídeo.";
@@ -484,16 +1596,27 @@ document.addEventListener("DOMContentLoaded", () => {
             msg.className = "msg error";
             return;
         }
-        const payload = { frames: framesCadastro, sku, descricao };
+        // JPEG cru em multipart: sem o base64 e sem montar um JSON gigante
+        const payload = new FormData();
+        payload.append("sku", sku);
+        payload.append("descricao", descricao);
+        framesCadastro.forEach((blob, i) => payload.append("frames", blob, `frame_${i}.jpg`));
         try {
-            const resp = await fetch("{{ url_for('api_cadastro') }}", {
+            const resp = await fetch("{{ url_for('api_cadastro_multipart') }}", {
                 method: "POST",
-                headers: {"Content-Type": "application/json"},
-                body: JSON.stringify(payload)
+                body: payload
             });
-            const data = await resp.json();
+            let data = await resp.json();
+            // cadastro em fila: acompanha o job até terminar
+            const statusUrl = data.status_url;
+            while (data.status === "fila" || data.status === "processando") {
+                msg.textContent = "Processando cadastro...";
+                msg.className = "msg";
+                await new Promise((r) => setTimeout(r, 1000));
+                data = await (await fetch(statusUrl)).json();
+            }
             if (data.status === "ok") {
-                msg.textContent = "Chapa cadastrada com sucesso.";
+                msg.textContent = `Chapa cadastrada com sucesso (${data.frames.aproveitados} de ${data.frames.recebidos} frames aproveitados).`;
                 msg.className = "msg success";
                 form.reset();
                 form.style.display = "none";
@@ -516,6 +1639,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
 CONSULTA_HTML = (
     BASE_HTML_HEAD
+    + CAPTURA_JS
     + """
 <h2>Consultar Chapa MDF (foto única)</h2>
 
@@ -574,18 +1698,13 @@ async function toggleTorchConsulta() {
     }
 }
 
-function capturarDataUrlConsulta() {
+function capturarBlobConsulta() {
     const video = document.getElementById("videoConsulta");
     const canvas = document.getElementById("canvasConsulta");
 
-    if (!video.videoWidth) return null;
+    if (!video.videoWidth) return Promise.resolve(null);
 
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
-    const ctx = canvas.getContext("2d");
-    ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-
-    return canvas.toDataURL("image/jpeg", 0.95);
+    return capturarFrame(video, canvas, false).blob;
 }
 
 document.addEventListener("DOMContentLoaded", () => {
@@ -598,18 +1717,19 @@ document.addEventListener("DOMContentLoaded", () => {
     const btnLuz = document.getElementById("btnLuzConsulta");
 
     btnCapturar.addEventListener("click", async () => {
-        const dataUrl = capturarDataUrlConsulta();
-        if (!dataUrl) return;
+        const blob = await capturarBlobConsulta();
+        if (!blob) return;
 
         resultadoDiv.style.display = "block";
         resultadoDiv.textContent = "Processando imagem...";
         acaoCadastrarDiv.style.display = "none";
 
         try {
-            const resp = await fetch("{{ url_for('api_consulta') }}", {
+            const payload = new FormData();
+            payload.append("image", blob, "consulta.jpg");
+            const resp = await fetch("{{ url_for('api_consulta_multipart') }}", {
                 method: "POST",
-                headers: {"Content-Type": "application/json"},
-                body: JSON.stringify({ image: dataUrl })
+                body: payload
             });
             const data = await resp.json();
 
@@ -618,8 +1738,8 @@ document.addEventListener("DOMContentLoaded", () => {
                     <strong>Chapa encontrada:</strong><br>
                     SKU: ${data.sku}<br>
                     Descrição: ${data.descricao}<br>
-                    Distância: ${data.distancia}<br>
-                    <img src="${data.image_url}" alt="Chapa cadastrada">
+                    Distância: ${data.distancia} (margem ${data.margem})<br>
+                    <img src="${data.image_url}" srcset="${data.image_url} 1x, ${data.image_url_2x} 2x" alt="Chapa cadastrada">
                 `;
             } else if (data.status === "not_found") {
                 resultadoDiv.textContent = "Chapa não identificada.";
@@ -650,6 +1770,11 @@ CADASTRADOS_HTML = (
     + """
 <h2>Chapas Cadastradas</h2>
 
+<form method="get" action="{{ url_for('cadastrados_page') }}" class="btn-row">
+    <input type="search" name="q" value="{{ q }}" placeholder="Buscar SKU ou descrição">
+    <button type="submit">Buscar</button>
+</form>
+
 <table>
     <thead>
         <tr>
@@ -668,55 +1793,248 @@ CADASTRADOS_HTML = (
             <td>{{ c.descricao }}</td>
             <td>{{ c.created_at }}</td>
             <td>
-                <a href="{{ url_for('chapa_image', filename=c.image_filename) }}" target="_blank">
+                <a href="{{ url_imagem(c.image_filename) }}" target="_blank">
                     Ver
                 </a>
             </td>
         </tr>
     {% else %}
-        <tr><td colspan="5">Nenhuma chapa cadastrada ainda.</td></tr>
+        <tr><td colspan="5">{{ "Nenhuma chapa encontrada." if q else "Nenhuma chapa cadastrada ainda." }}</td></tr>
     {% endfor %}
     </tbody>
 </table>
+
+<div class="btn-row">
+    {% if primeira %}
+    <a href="{{ url_for('cadastrados_page', q=q or None) }}" class="btn-link">« Mais recentes</a>
+    {% endif %}
+    {% if proximo %}
+    <a href="{{ url_for('cadastrados_page', q=q or None, cursor=proximo) }}" class="btn-link">Próxima página »</a>
+    {% endif %}
+</div>
 """
     + BASE_HTML_FOOT
 )
 
+# templates compilados uma vez, na subida: o render_template_string faz o
+# hash do texto inteiro a cada requisição só pra achar o template no cache
+# do Jinja
+app.jinja_loader = DictLoader({
+    "home.html": HOME_HTML,
+    "cadastro.html": CADASTRO_HTML,
+    "consulta.html": CONSULTA_HTML,
+    "cadastrados.html": CADASTRADOS_HTML,
+})
+for _nome in app.jinja_loader.list_templates():
+    app.jinja_env.get_template(_nome)
+
+
+# ---------------- PÁGINAS ESTÁTICAS ---------------- #
+#
+# home, cadastro e consulta não dependem de nada da requisição: são
+# renderizadas uma vez (na primeira visita) e servidas da memória, já
+# comprimidas, com ETag e Last-Modified. O navegador revalida a cada visita
+# (Cache-Control: no-cache) e, se nada mudou, recebe um 304 sem corpo.
+
+# Last-Modified das páginas: os templates moram neste arquivo, então ele só
+# muda num deploy, e é o mesmo em todos os workers
+PAGINAS_MODIFICADAS = datetime.fromtimestamp(int(os.path.getmtime(__file__)), timezone.utc)
+
+# (endpoint, script_root) -> {codificação: (corpo, etag)}
+_paginas = {}
+
+
+def variantes_pagina(corpo: bytes) -> dict:
+    variantes = {"identity": corpo}
+    variantes["gzip"] = gzip.compress(corpo, compresslevel=9, mtime=0)
+    if brotli is not None:
+        variantes["br"] = brotli.compress(corpo, mode=brotli.MODE_TEXT, quality=11)
+    return {
+        codificacao: (dados, hashlib.sha256(dados).hexdigest()[:32])
+        for codificacao, dados in variantes.items()
+        if codificacao == "identity" or len(dados) < len(corpo)
+    }
+
+
+def pagina_estatica(template: str, **contexto):
+    # os links dos templates vêm do url_for, que depende do prefixo em que o
+    # app está montado: uma renderização por prefixo
+    chave = (request.endpoint, request.script_root)
+    variantes = _paginas.get(chave)
+    if variantes is None:
+        variantes = _paginas[chave] = variantes_pagina(render_template(template, **contexto).encode())
+
+    aceitas = request.accept_encodings
+    codificacao = next((c for c in ("br", "gzip") if c in variantes and aceitas[c]), "identity")
+    corpo, etag = variantes[codificacao]
+
+    resp = Response(corpo, mimetype="text/html")
+    resp.set_etag(etag)
+    resp.last_modified = PAGINAS_MODIFICADAS
+    resp.cache_control.no_cache = True
+    resp.vary.add("Accept-Encoding")
+    if codificacao != "identity":
+        resp.content_encoding = codificacao
+    return resp.make_conditional(request)
+
 
 # ---------------- ROTAS PÁGINAS ---------------- #
 
 @app.route("/")
 def index():
-    return render_template_string(HOME_HTML, title="Home")
+    return pagina_estatica("home.html", title="Home")
 
 
 @app.route("/cadastro")
 def cadastro_page():
-    return render_template_string(CADASTRO_HTML, title="Cadastro")
+    return pagina_estatica("cadastro.html", title="Cadastro")
 
 
 @app.route("/consulta")
 def consulta_page():
-    return render_template_string(CONSULTA_HTML, title="Consulta")
+    return pagina_estatica("consulta.html", title="Consulta")
 
 
 @app.route("/cadastrados")
 def cadastrados_page():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM chapas ORDER BY created_at DESC")
-    rows = cur.fetchall()
-    conn.close()
-    return render_template_string(CADASTRADOS_HTML, title="Cadastrados", chapas=rows)
+    q = request.args.get("q", "").strip()
+    try:
+        chapas, proximo = listar_chapas(q, request.args.get("cursor"), CADASTRADOS_POR_PAGINA)
+    except ValueError:
+        chapas, proximo = listar_chapas(q, None, CADASTRADOS_POR_PAGINA)
+    return render_template(
+        "cadastrados.html", title="Cadastrados", chapas=chapas, q=q, proximo=proximo,
+        primeira=bool(request.args.get("cursor")),
+    )
+
+
+@app.route("/api/cadastrados")
+def api_cadastrados():
+    # mesma listagem em JSON: ?q= (busca), ?limite= e ?cursor= (o "proximo"
+    # da página anterior; null quando acabou)
+    try:
+        limite = int(request.args.get("limite", CADASTRADOS_POR_PAGINA))
+    except ValueError:
+        limite = 0
+    if not 1 <= limite <= CADASTRADOS_LIMITE_MAX:
+        return jsonify({"status": "error", "message": f"limite deve estar entre 1 e {CADASTRADOS_LIMITE_MAX}."}), 400
+    try:
+        chapas, proximo = listar_chapas(request.args.get("q", "").strip(), request.args.get("cursor"), limite)
+    except ValueError:
+        return jsonify({"status": "error", "message": "cursor inválido."}), 400
+    return jsonify({
+        "status": "ok",
+        "chapas": [
+            {
+                "id": c["id"],
+                "sku": c["sku"],
+                "descricao": c["descricao"],
+                "created_at": c["created_at"],
+                "image_url": url_imagem(c["image_filename"]),
+            }
+            for c in chapas
+        ],
+        "proximo": proximo,
+    })
+
+
+def codificar_cursor(created_at: str, chapa_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{chapa_id}".encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str):
+    # (created_at, id) da última linha da página anterior; ValueError se inválido
+    try:
+        texto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, chapa_id = texto.rsplit("|", 1)
+        return created_at, int(chapa_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("cursor inválido") from e
+
+
+def termos_busca(q: str) -> str:
+    # texto livre -> consulta FTS5: todas as palavras, cada uma como prefixo
+    return " ".join(f'"{t}"*' for t in re.findall(r"\w+", q))
+
+
+def listar_chapas(q: str, cursor, limite: int):
+    # uma página da listagem, mais recentes primeiro, e o cursor da próxima
+    # (None na última). Paginação por (created_at, id) no índice: cada página
+    # custa o mesmo, não importa quantas vieram antes
+    condicoes = []
+    params = []
+    if cursor:
+        condicoes.append("(created_at, id) < (?, ?)")
+        params += decodificar_cursor(cursor)
+    if q:
+        if _busca_fts:
+            termos = termos_busca(q)
+            if termos:
+                condicoes.append("id IN (SELECT rowid FROM chapas_busca WHERE chapas_busca MATCH ?)")
+                params.append(termos)
+        else:
+            condicoes.append("sku LIKE ? ESCAPE '\\'")
+            params.append(re.sub(r"([\\%_])", r"\\\1", q) + "%")
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    rows = get_conn().execute(
+        f"""
+        SELECT id, sku, descricao, created_at, image_filename
+        FROM chapas {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+        """,
+        (*params, limite + 1),
+    ).fetchall()
+    proximo = None
+    if len(rows) > limite:
+        rows = rows[:limite]
+        proximo = codificar_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, proximo
 
 
 @app.route("/chapas/<path:filename>")
 def chapa_image(filename):
-    return send_from_directory(IMG_DIR, filename)
+    # imagem salva, do tamanho cheio; com ?v= igual ao digest atual, vai com
+    # cache de um ano
+    versao = request.args.get("v")
+    return enviar_imagem(IMG_DIR, filename, imutavel=bool(versao) and versao == versao_imagem(filename))
+
+
+@app.route("/chapas/miniatura/<int:lado>/<path:filename>")
+def chapa_miniatura(lado, filename):
+    if lado not in MINIATURAS_LADOS:
+        abort(404)
+    webp = MINIATURAS_WEBP and request.accept_mimetypes["image/webp"] > 0
+    gerada = miniatura(filename, lado, "WEBP" if webp else "JPEG")
+    if gerada is None:
+        abort(404)
+    versao = request.args.get("v")
+    resp = enviar_imagem(*gerada, imutavel=bool(versao) and versao == versao_miniatura(filename, lado))
+    if MINIATURAS_WEBP:
+        resp.vary.add("Accept")
+    return resp
 
 
 # ---------------- ROTAS API ---------------- #
 
+@app.route("/api/config")
+def api_config():
+    # o que as páginas de captura usam pra reduzir e escolher os frames no
+    # próprio navegador; lado 0 = mandar o frame inteiro, como vem da câmera
+    resp = jsonify({
+        "status": "ok",
+        "captura": {
+            "lado": LADO_HASH if CAPTURA_REDUZIDA else 0,
+            "lado_salvo": LADO_SAVE if CAPTURA_REDUZIDA else 0,
+            "qualidade_jpeg": CAPTURA_QUALIDADE,
+            "nitidez_relativa": CAPTURA_NITIDEZ_RELATIVA,
+            "diferenca_min": CAPTURA_DIFERENCA_MIN,
+        },
+    })
+    resp.cache_control.max_age = 300
+    return resp
+
+
 @app.route("/api/cadastro", methods=["POST"])
 def api_cadastro():
     data = request.get_json(force=True)
@@ -727,57 +2045,665 @@ def api_cadastro():
     if not frames or not isinstance(frames, list) or not sku or not descricao:
         return jsonify({"status": "error", "message": "Dados incompletos."}), 400
 
+    if CADASTRO_FILA:
+        return enfileirar_cadastro(sku, descricao, [data_url_ou_vazio(f) for f in frames])
+
+    resposta, codigo = cadastrar_frames(sku, descricao, frames)
+    return jsonify(resposta), codigo
+
+
+def cadastrar_frames(sku, descricao, frames, job=None):
+    # frames como data URLs ou JPEG cru -> (resposta, código HTTP)
+
     # usa o frame do meio como imagem de referência pra salvar
     mid_index = len(frames) // 2
-    frame_preview = frames[mid_index]
+
+    # gera hash dos outros frames para textura/cor (em paralelo no pool)
+    # enquanto o do meio é decodificado aqui uma vez pra imagem e pro hash
+    outros = frames[:mid_index] + frames[mid_index + 1:]
+    futuros = [hash_async(analisar_frames_lote, parte) for parte in dividir_frames(outros)]
 
     try:
-        pil_preview = decode_data_url_to_image(frame_preview)
+        meio = frames[mid_index]
+        pil_preview, analise_preview = decode_preview(meio if isinstance(meio, bytes) else data_url_to_bytes(meio))
+    except Exception:
+        return {"status": "error", "message": "Erro ao ler frame do vídeo."}, 400
+
+    with metricas.etapa("pool"):
+        analises = [a for f in futuros for a in f.result()]
+    analises.insert(mid_index, analise_preview)
+
+    return gravar_chapa(sku, descricao, pil_preview, analises, job)
+
+
+@app.route("/api/cadastro/multipart", methods=["POST"])
+def api_cadastro_multipart():
+    # mesmo contrato do /api/cadastro, mas com os frames como JPEG cru
+    # (partes "frames") em multipart/form-data; cada frame vai pro pool de
+    # hash assim que a parte dele termina de chegar
+    boundary = multipart_boundary()
+    if not boundary:
+        return jsonify({"status": "error", "message": "Envie multipart/form-data."}), 400
+
+    campos = {}
+    frames = []
+    futuros = []
+    try:
+        for nome, dados in iter_multipart(request.stream, boundary):
+            if nome == "frames":
+                frames.append(dados)
+                if not CADASTRO_FILA:
+                    futuros.append(hash_async(analisar_frames_lote, [dados]))
+            else:
+                campos[nome] = dados.decode("utf-8", "replace")
+    except ValueError:
+        return jsonify({"status": "error", "message": "Upload incompleto."}), 400
+
+    sku = campos.get("sku", "").strip()
+    descricao = campos.get("descricao", "").strip()
+
+    if not frames or not sku or not descricao:
+        return jsonify({"status": "error", "message": "Dados incompletos."}), 400
+
+    if CADASTRO_FILA:
+        return enfileirar_cadastro(sku, descricao, frames)
+
+    # o frame do meio já foi pro pool antes de se saber que era o do meio; se
+    # ainda estiver na fila, sai dela e é decodificado uma vez só aqui
+    mid_index = len(frames) // 2
+    cancelado = futuros[mid_index].cancel()
+    try:
+        if cancelado:
+            pil_preview, analise_preview = decode_preview(frames[mid_index])
+        else:
+            pil_preview = decode_bytes_to_image(frames[mid_index], maior_lado=LADO_SAVE)
     except Exception:
         return jsonify({"status": "error", "message": "Erro ao ler frame do vídeo."}), 400
+    if not cancelado:
+        analise_preview = futuros[mid_index].result()[0]
 
-    img_save = preprocess_image_for_save(pil_preview)
-    filename = save_image(img_save)
+    with metricas.etapa("pool"):
+        analises = [analise_preview if i == mid_index else f.result()[0] for i, f in enumerate(futuros)]
+
+    return registrar_chapa(sku, descricao, pil_preview, analises)
+
+
+def registrar_chapa(sku, descricao, pil_preview, analises):
+    resposta, codigo = gravar_chapa(sku, descricao, pil_preview, analises)
+    return jsonify(resposta), codigo
 
-    # gera hash de todos os frames para textura/cor
-    hashes = []
-    for f in frames:
-        try:
-            pil = decode_data_url_to_image(f)
-            pre = preprocess_image_for_hash(pil)
-            h = imagehash.phash(pre)
-            hashes.append(str(h))
-        except Exception:
-            continue
 
+def gravar_chapa(sku, descricao, pil_preview, analises, job=None):
+    # -> (resposta, código HTTP); job = (id, tentativa) quando vem da fila:
+    # o job é concluído na mesma transação da chapa
+    # só os frames nítidos, bem expostos e não repetidos vão pro índice
+    hashes, cor, resumo_frames = selecionar_frames(analises)
+    metricas.observar("cadastro_frames", resumo_frames["recebidos"], tipo="recebidos")
+    metricas.observar("cadastro_frames", resumo_frames["aproveitados"], tipo="aproveitados")
     if not hashes:
-        return jsonify({"status": "error", "message": "Não foi possível gerar hashes do vídeo."}), 400
+        return {"status": "error", "message": "Não foi possível gerar hashes do vídeo."}, 400
+
+    with metricas.etapa("salvar_imagem"):
+        img_save = preprocess_image_for_save(pil_preview)
+        filename = save_image(img_save)
 
-    # também guarda um hash "principal" na tabela chapas (por compatibilidade)
-    img_hash_principal = hashes[0]
     created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     conn = get_conn()
-    cur = conn.cursor()
+    # uma transação só: chapa + todos os frames, ou nada
+    with metricas.etapa("sqlite"), conn:
+        cur = conn.cursor()
+        # IMMEDIATE: a versão do esquema lida aqui vale até o commit, mesmo com
+        # uma migração rodando em paralelo
+        cur.execute("BEGIN IMMEDIATE")
+        versao = schema_version(conn)
+        chapa_id = inserir_chapa(cur, versao, sku, descricao, filename, hashes, cor, created_at)
+        resposta = {"status": "ok", "frames": resumo_frames}
+        if job is not None:
+            concluir_job(cur, job, resposta, chapa_id)
+
+    with metricas.etapa("indice"):
+        sync_hash_index(forcar=True)
+
+    return resposta, 200
+
+
+def inserir_chapa(cur, versao, sku, descricao, filename, hashes, cor, created_at) -> int:
+    # chapa + hashes dos frames + assinatura de cor, dentro da transação de quem chama
+    # também guarda um hash "principal" na tabela chapas (por compatibilidade)
     cur.execute(
         """
         INSERT INTO chapas (sku, descricao, image_filename, image_hash, created_at)
         VALUES (?, ?, ?, ?, ?)
         """,
-        (sku, descricao, filename, img_hash_principal, created_at),
+        (sku, descricao, filename, hash_para_banco(hashes[0], versao), created_at),
     )
     chapa_id = cur.lastrowid
+    cur.executemany(
+        "INSERT INTO chapa_hashes (chapa_id, image_hash) VALUES (?, ?)",
+        [(chapa_id, hash_para_banco(h, versao)) for h in hashes],
+    )
+    cur.execute(
+        """
+        INSERT INTO chapa_cores
+            (chapa_id, l_media, a_media, b_media, l_desvio, a_desvio, b_desvio)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (chapa_id, *cor),
+    )
+    return chapa_id
+
+
+# ---------------- IMPORTAÇÃO EM LOTE ---------------- #
+
+EXTENSOES_IMAGEM = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+
+
+def _eh_imagem(nome: str) -> bool:
+    return nome.lower().endswith(EXTENSOES_IMAGEM)
+
+
+def ler_entradas(origem: str):
+    # (chave, sku, descricao, [arquivos]) de cada chapa a importar:
+    #   pasta: cada subpasta é uma chapa (sku = nome da subpasta, fotos =
+    #          imagens dentro dela) e cada imagem solta também (sku = nome do
+    #          arquivo sem extensão); a descrição fica igual ao sku
+    #   CSV:   colunas sku, descricao, imagens (caminhos separados por ";",
+    #          relativos à pasta do CSV)
+    if os.path.isdir(origem):
+        for nome in sorted(os.listdir(origem)):
+            caminho = os.path.join(origem, nome)
+            if os.path.isdir(caminho):
+                arquivos = [os.path.join(caminho, f) for f in sorted(os.listdir(caminho)) if _eh_imagem(f)]
+                if arquivos:
+                    yield nome + "/", nome, nome, arquivos
+            elif _eh_imagem(nome):
+                sku = os.path.splitext(nome)[0]
+                yield nome, sku, sku, [caminho]
+        return
+
+    base = os.path.dirname(os.path.abspath(origem))
+    with open(origem, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            sku = (row.get("sku") or "").strip()
+            descricao = (row.get("descricao") or "").strip() or sku
+            imagens = [p.strip() for p in (row.get("imagens") or "").split(";") if p.strip()]
+            if sku and imagens:
+                arquivos = [os.path.join(base, p) for p in imagens]
+                yield f"{os.path.basename(origem)}:{sku}:{';'.join(imagens)}", sku, descricao, arquivos
+
+
+def _ler_arquivo(path: str) -> bytes:
+    # arquivo que sumiu conta como frame ilegível
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return b""
+
+
+def analisar_arquivos(arquivos):
+    # roda no pool: (hashes, cor, resumo) das fotos de uma chapa
+    return selecionar_frames(analisar_frames_lote([_ler_arquivo(p) for p in arquivos]))
 
-    for h in hashes:
-        cur.execute(
-            "INSERT INTO chapa_hashes (chapa_id, image_hash) VALUES (?, ?)",
-            (chapa_id, h),
-        )
 
+def preparar_importacao(entrada):
+    # roda no pool: analisa as fotos e salva a imagem de referência (a do
+    # meio); devolve a entrada + (filename, hashes, cor, resumo)
+    chave, sku, descricao, arquivos = entrada
+    hashes, cor, resumo = analisar_arquivos(arquivos)
+    filename = None
+    if hashes:
+        try:
+            pil = decode_bytes_to_image(_ler_arquivo(arquivos[len(arquivos) // 2]), maior_lado=LADO_SAVE)
+            filename = save_image(preprocess_image_for_save(pil))
+        except Exception:
+            hashes = []
+    return entrada, filename, hashes, cor, resumo
+
+
+def recalcular_chapa(entrada):
+    # roda no pool: hashes novos de uma chapa a partir das fotos de origem da
+    # importação ou, sem elas, da imagem salva no cadastro
+    chapa_id, image_filename, arquivos = entrada
+    arquivos = json.loads(arquivos) if arquivos else []
+    origem = bool(arquivos) and all(os.path.exists(p) for p in arquivos)
+    if not origem:
+        arquivos = [os.path.join(IMG_DIR, image_filename)]
+    hashes, cor, _ = analisar_arquivos(arquivos)
+    return chapa_id, len(arquivos), origem, hashes, cor
+
+
+class Progresso:
+    # "n/total chapas, imagens/s" a cada lote gravado
+    def __init__(self, total: int):
+        self.total = total
+        self.chapas = 0
+        self.imagens = 0
+        self.inicio = time.perf_counter()
+
+    def somar(self, imagens: int):
+        self.chapas += 1
+        self.imagens += imagens
+
+    def texto(self) -> str:
+        dt = max(time.perf_counter() - self.inicio, 1e-9)
+        return (f"{self.chapas}/{self.total} chapas, {self.imagens} imagens, "
+                f"{self.imagens / dt:.1f} imagens/s")
+
+
+def _em_lotes(resultados, lote: int):
+    buffer = []
+    for r in resultados:
+        buffer.append(r)
+        if len(buffer) >= lote:
+            yield buffer
+            buffer = []
+    if buffer:
+        yield buffer
+
+
+@app.cli.command("importar")
+@click.argument("origem", type=click.Path(exists=True))
+@click.option("--lote", default=200, show_default=True, help="chapas gravadas por transação")
+@click.option("--workers", default=HASH_WORKERS, show_default=True, help="processos do pool de hash")
+def importar_command(origem, lote, workers):
+    """Importa chapas de uma pasta de fotos ou de um CSV (sku, descricao, imagens).
+
+    Pode ser interrompido e rodado de novo: o que já foi importado é pulado.
+    """
+    conn = get_conn()
+    feitas = {row[0] for row in conn.execute("SELECT chave FROM importacoes")}
+    entradas = [e for e in ler_entradas(origem) if e[0] not in feitas]
+    click.echo(f"{len(entradas)} chapas a importar ({len(feitas)} já importadas antes)")
+    if not entradas:
+        return
+
+    progresso = Progresso(len(entradas))
+    falhas = 0
+    with criar_pool(workers) as pool:
+        resultados = pool.map(preparar_importacao, entradas, chunksize=4)
+        for bloco in _em_lotes(resultados, lote):
+            created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with conn:
+                cur = conn.cursor()
+                cur.execute("BEGIN IMMEDIATE")
+                versao = schema_version(conn)
+                for (chave, sku, descricao, arquivos), filename, hashes, cor, resumo in bloco:
+                    progresso.somar(resumo["recebidos"])
+                    if not hashes:
+                        falhas += 1
+                        click.echo(f"  {chave}: nenhuma foto legível, pulando", err=True)
+                        continue
+                    chapa_id = inserir_chapa(cur, versao, sku, descricao, filename, hashes, cor, created_at)
+                    cur.execute(
+                        "INSERT INTO importacoes (chave, chapa_id, arquivos) VALUES (?, ?, ?)",
+                        (chave, chapa_id, json.dumps([os.path.abspath(p) for p in arquivos])),
+                    )
+            click.echo(progresso.texto())
+
+    click.echo(f"concluído: {progresso.chapas - falhas} chapas importadas, {falhas} com erro")
+
+
+@app.cli.command("rehash")
+@click.option("--lote", default=200, show_default=True, help="chapas gravadas por transação")
+@click.option("--workers", default=HASH_WORKERS, show_default=True, help="processos do pool de hash")
+@click.option("--incluir-site", is_flag=True,
+              help="recalcula também as chapas cadastradas pelo site, a partir da imagem salva "
+                   "(troca os hashes dos frames por um hash só)")
+def rehash_command(lote, workers, incluir_site):
+    """Recalcula chapa_hashes (e a assinatura de cor) depois de mudar o pré-processamento.
+
+    Por padrão só as chapas importadas, a partir das fotos de origem. As
+    cadastradas pelo site só têm a imagem salva (o preview realçado de
+    800px), que dá hashes piores que os dos frames originais: só entram com
+    --incluir-site. Pode ser interrompido e rodado de novo: continua de onde
+    parou.
+    """
+    conn = get_conn()
+    conn.execute("CREATE TABLE IF NOT EXISTS rehash_feitos (chapa_id INTEGER PRIMARY KEY)")
     conn.commit()
-    conn.close()
+    entradas = [
+        tuple(row) for row in conn.execute(
+            f"""
+            SELECT c.id, c.image_filename, i.arquivos
+            FROM chapas c LEFT JOIN importacoes i ON i.chapa_id = c.id
+            WHERE c.id NOT IN (SELECT chapa_id FROM rehash_feitos)
+            {"" if incluir_site else "AND i.arquivos IS NOT NULL"}
+            ORDER BY c.id
+            """
+        )
+    ]
+    click.echo(f"{len(entradas)} chapas a recalcular")
+
+    progresso = Progresso(len(entradas))
+    falhas = so_imagem_salva = 0
+    with criar_pool(workers) as pool:
+        resultados = pool.map(recalcular_chapa, entradas, chunksize=4)
+        for bloco in _em_lotes(resultados, lote):
+            with conn:
+                cur = conn.cursor()
+                cur.execute("BEGIN IMMEDIATE")
+                versao = schema_version(conn)
+                for chapa_id, qtd_arquivos, origem, hashes, cor in bloco:
+                    progresso.somar(qtd_arquivos)
+                    so_imagem_salva += not origem
+                    if hashes:
+                        cur.execute("DELETE FROM chapa_hashes WHERE chapa_id = ?", (chapa_id,))
+                        cur.executemany(
+                            "INSERT INTO chapa_hashes (chapa_id, image_hash) VALUES (?, ?)",
+                            [(chapa_id, hash_para_banco(h, versao)) for h in hashes],
+                        )
+                        cur.execute(
+                            "UPDATE chapas SET image_hash = ? WHERE id = ?",
+                            (hash_para_banco(hashes[0], versao), chapa_id),
+                        )
+                        cur.execute(
+                            """
+                            INSERT OR REPLACE INTO chapa_cores
+                                (chapa_id, l_media, a_media, b_media, l_desvio, a_desvio, b_desvio)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                            """,
+                            (chapa_id, *cor),
+                        )
+                    else:
+                        falhas += 1
+                        click.echo(f"  chapa {chapa_id}: imagem ilegível, hashes antigos mantidos", err=True)
+                    cur.execute("INSERT INTO rehash_feitos (chapa_id) VALUES (?)", (chapa_id,))
+            click.echo(progresso.texto())
+
+    # fim: os workers remontam o índice (as linhas antigas sumiram) e a
+    # próxima rodada começa do zero
+    with conn:
+        conn.execute(
+            "INSERT INTO catalogo_meta (chave, valor) VALUES ('epoca_hashes', 1) "
+            "ON CONFLICT (chave) DO UPDATE SET valor = valor + 1"
+        )
+        conn.execute("DELETE FROM rehash_feitos")
+    click.echo(
+        f"concluído: {progresso.chapas - falhas} chapas recalculadas ({so_imagem_salva} só com a "
+        f"imagem salva), {falhas} com erro"
+    )
+    click.echo("gere de novo o arquivo de índice: flask --app chapa_foto gerar-indice")
+
+
+# ---------------- IMAGENS SALVAS ---------------- #
+
+@app.cli.command("migrar-imagens")
+@click.option("--lote", default=500, show_default=True, help="chapas atualizadas por transação")
+def migrar_imagens_command(lote):
+    """Passa as imagens com nome antigo (chapa_<data>.jpg) pro armazenamento por conteúdo.
+
+    Copia cada arquivo pro nome novo (imagens iguais viram um arquivo só) e
+    atualiza a chapa. Pode ser interrompido e rodado de novo. Os arquivos
+    antigos ficam onde estão até o gc-imagens.
+    """
+    conn = get_conn()
+    entradas = [
+        (chapa_id, filename)
+        for chapa_id, filename in conn.execute("SELECT id, image_filename FROM chapas ORDER BY id")
+        if not NOME_CONTEUDO.fullmatch(filename)
+    ]
+    click.echo(f"{len(entradas)} chapas com imagem no formato antigo")
+
+    migradas = repetidas = faltando = 0
+    for bloco in _em_lotes(entradas, lote):
+        novos = []
+        for chapa_id, filename in bloco:
+            dados = _ler_arquivo(os.path.join(IMG_DIR, filename))
+            if not dados:
+                faltando += 1
+                click.echo(f"  chapa {chapa_id}: {filename} não encontrado", err=True)
+                continue
+            repetidas += os.path.exists(os.path.join(IMG_DIR, nome_conteudo(dados)))
+            novos.append((guardar_imagem(dados), chapa_id, filename))
+        with conn:
+            # o image_filename antigo na condição: se a chapa mudou no meio
+            # do caminho, fica como está
+            conn.executemany(
+                "UPDATE chapas SET image_filename = ? WHERE id = ? AND image_filename = ?", novos
+            )
+        migradas += len(novos)
+        click.echo(f"{migradas}/{len(entradas)} chapas")
+
+    click.echo(
+        f"concluído: {migradas} chapas migradas ({repetidas} com imagem repetida), "
+        f"{faltando} sem arquivo"
+    )
+    click.echo("os arquivos antigos saem com: flask --app chapa_foto gc-imagens")
+
+
+@app.cli.command("gc-imagens")
+@click.option("--idade-min", default=3600, show_default=True,
+              help="arquivos modificados há menos segundos que isso nunca são apagados")
+@click.option("--simular", is_flag=True, help="só mostra o que seria apagado")
+def gc_imagens_command(idade_min, simular):
+    """Apaga de CHAPAS_IMG_DIR as imagens e miniaturas que nenhuma chapa usa.
+
+    Os arquivos recentes ficam: uma imagem é salva antes da chapa que a usa
+    entrar no banco.
+    """
+    usadas = {row[0] for row in get_conn().execute("SELECT image_filename FROM chapas")}
+    # miniaturas/<lado>-<parâmetros>/<nome da imagem, com .jpg ou .webp>; as
+    # pastas de outros lados ou parâmetros não são mais servidas
+    bases_usadas = {os.path.splitext(f)[0] for f in usadas}
+    pastas_atuais = {os.path.basename(pasta_miniaturas(lado)) for lado in MINIATURAS_LADOS}
+    limite = time.time() - idade_min
+    apagados = liberados = 0
+
+    for raiz, _, arquivos in os.walk(IMG_DIR, topdown=False):
+        for nome in arquivos:
+            caminho = os.path.join(raiz, nome)
+            rel = os.path.relpath(caminho, IMG_DIR).replace(os.sep, "/")
+            extensao = os.path.splitext(nome)[1].lower()
+            # nada além de imagens (e temporários de uma gravação que caiu)
+            if extensao not in EXTENSOES_IMAGEM and extensao != ".tmp":
+                continue
+            if rel.startswith("miniaturas/") and rel.count("/") >= 2:
+                _, pasta, resto = rel.split("/", 2)
+                em_uso = pasta in pastas_atuais and os.path.splitext(resto)[0] in bases_usadas
+            else:
+                em_uso = rel in usadas
+            if em_uso:
+                continue
+            try:
+                st = os.stat(caminho)
+                if st.st_mtime > limite:
+                    continue
+                if not simular:
+                    os.unlink(caminho)
+            except FileNotFoundError:
+                continue
+            apagados += 1
+            liberados += st.st_size
+            if simular:
+                click.echo(rel)
+        # shards vazios há mais de idade_min (um recém-criado pode estar pra
+        # receber uma imagem); os que esvaziaram agora saem na próxima rodada
+        if not simular and raiz != IMG_DIR:
+            try:
+                if os.stat(raiz).st_mtime <= limite:
+                    os.rmdir(raiz)
+            except OSError:
+                pass
+
+    verbo = "seriam apagados" if simular else "apagados"
+    click.echo(f"{apagados} arquivos {verbo} ({liberados / 2**20:.1f} MiB)")
+
+
+# ---------------- FILA DE CADASTRO ---------------- #
+
+class JobPerdido(Exception):
+    # o job voltou pra fila (passou do timeout) e outra thread pegou
+    pass
+
+
+_fila_pid = None
+_fila_lock = threading.Lock()
+_fila_evento = threading.Event()
+
+
+def data_url_ou_vazio(frame) -> bytes:
+    # frame ilegível vai pra fila vazio e conta como ilegível no processamento
+    try:
+        return data_url_to_bytes(frame)
+    except Exception:
+        return b""
+
+
+def enfileirar_cadastro(sku, descricao, frames):
+    # grava o job e os frames crus numa transação e responde na hora (202)
+    conn = get_conn()
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO cadastro_jobs (sku, descricao, status, created_at) VALUES (?, ?, 'fila', ?)",
+            (sku, descricao, created_at),
+        )
+        job_id = cur.lastrowid
+        cur.executemany(
+            "INSERT INTO cadastro_job_frames (job_id, ordem, dados) VALUES (?, ?, ?)",
+            [(job_id, i, frame) for i, frame in enumerate(frames)],
+        )
+    iniciar_fila()
+    _fila_evento.set()
+    return jsonify({
+        "status": "fila",
+        "job_id": job_id,
+        "status_url": url_for("api_cadastro_status", job_id=job_id),
+    }), 202
+
+
+def iniciar_fila():
+    # threads da fila sobem uma vez por processo (depois do fork do gunicorn)
+    global _fila_pid, _fila_evento
+    if not CADASTRO_FILA or _fila_pid == os.getpid():
+        return
+    with _fila_lock:
+        if _fila_pid == os.getpid():
+            return
+        _fila_evento = threading.Event()
+        for i in range(CADASTRO_FILA_THREADS):
+            threading.Thread(target=_loop_fila, name=f"cadastro-fila-{i}", daemon=True).start()
+        _fila_pid = os.getpid()
+
+
+@app.before_request
+def garantir_fila():
+    # também pega os jobs que ficaram na fila de antes de um restart
+    iniciar_fila()
+
+
+def _loop_fila():
+    while True:
+        try:
+            job = pegar_job()
+        except sqlite3.Error:
+            app.logger.exception("erro lendo a fila de cadastro")
+            job = None
+        if job is None:
+            # cadastro neste worker acorda na hora; de outro worker, no
+            # próximo segundo
+            _fila_evento.wait(1.0)
+            _fila_evento.clear()
+            continue
+        processar_job(*job)
+
+
+def pegar_job():
+    # marca o job mais antigo da fila como "processando" e devolve
+    # (id, tentativa, sku, descricao), ou None se não houver
+    conn = get_conn()
+    vencido = time.time() - CADASTRO_FILA_TIMEOUT
+    candidato = (
+        "status = 'fila' OR (status = 'processando' AND iniciado_em < ?)"
+    )
+    # checagem sem lock antes: a fila quase sempre está vazia
+    if conn.execute(f"SELECT 1 FROM cadastro_jobs WHERE {candidato} LIMIT 1", (vencido,)).fetchone() is None:
+        return None
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            f"SELECT id, tentativas, sku, descricao FROM cadastro_jobs WHERE {candidato} ORDER BY id LIMIT 1",
+            (vencido,),
+        ).fetchone()
+        if row is None:
+            return None
+        if row["tentativas"] >= CADASTRO_FILA_TENTATIVAS:
+            resposta = {"status": "error", "message": "Cadastro não concluído (tempo esgotado)."}
+            encerrar_job(conn, row["id"], "error", resposta)
+            return None
+        tentativa = row["tentativas"] + 1
+        conn.execute(
+            "UPDATE cadastro_jobs SET status = 'processando', iniciado_em = ?, tentativas = ? WHERE id = ?",
+            (time.time(), tentativa, row["id"]),
+        )
+    return (row["id"], tentativa), row["sku"], row["descricao"]
+
+
+def processar_job(job, sku, descricao):
+    job_id, tentativa = job
+    metricas.iniciar_requisicao("fila_cadastro")
+    try:
+        conn = get_conn()
+        frames = [
+            bytes(row[0]) for row in conn.execute(
+                "SELECT dados FROM cadastro_job_frames WHERE job_id = ? ORDER BY ordem", (job_id,)
+            )
+        ]
+        try:
+            resposta, _ = cadastrar_frames(sku, descricao, frames, job)
+        except JobPerdido:
+            return
+        except Exception:
+            app.logger.exception("erro no job de cadastro %s", job_id)
+            resposta = {"status": "error", "message": "Erro ao processar o cadastro."}
+        if resposta["status"] != "ok":
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if job_atual(conn, job):
+                    encerrar_job(conn, job_id, "error", resposta)
+    finally:
+        # a thread da fila é reaproveitada: o próximo job começa limpo
+        metricas.encerrar_requisicao()
+
+
+def job_atual(conn, job) -> bool:
+    # a tentativa ainda é dona do job
+    job_id, tentativa = job
+    return conn.execute(
+        "SELECT 1 FROM cadastro_jobs WHERE id = ? AND status = 'processando' AND tentativas = ?",
+        (job_id, tentativa),
+    ).fetchone() is not None
+
+
+def encerrar_job(conn, job_id, status, resposta, chapa_id=None):
+    conn.execute(
+        "UPDATE cadastro_jobs SET status = ?, resposta = ?, chapa_id = ? WHERE id = ?",
+        (status, json.dumps(resposta), chapa_id, job_id),
+    )
+    conn.execute("DELETE FROM cadastro_job_frames WHERE job_id = ?", (job_id,))
 
-    return jsonify({"status": "ok"})
+
+def concluir_job(cur, job, resposta, chapa_id):
+    # dentro da transação da chapa: ou os dois ficam visíveis, ou nenhum
+    if not job_atual(cur, job):
+        raise JobPerdido(job[0])
+    encerrar_job(cur, job[0], "ok", resposta, chapa_id)
+
+
+@app.route("/api/cadastro/status/<int:job_id>")
+def api_cadastro_status(job_id):
+    # "fila" / "processando" enquanto não termina; depois, a mesma resposta
+    # que o cadastro síncrono daria
+    row = get_conn().execute(
+        "SELECT status, resposta FROM cadastro_jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+    if row is None:
+        return jsonify({"status": "error", "message": "Cadastro não encontrado."}), 404
+    resposta = json.loads(row["resposta"]) if row["resposta"] else {"status": row["status"]}
+    resposta["job_id"] = job_id
+    return jsonify(resposta)
 
 
 @app.route("/api/consulta", methods=["POST"])
@@ -788,58 +2714,358 @@ def api_consulta():
     if not image_data:
         return jsonify({"status": "error", "message": "Imagem não recebida."}), 400
 
-    pil_img = decode_data_url_to_image(image_data)
-    pre = preprocess_image_for_hash(pil_img)
-    query_hash = imagehash.phash(pre)
+    params = parametros_consulta(data)
+    if isinstance(params, str):
+        return jsonify({"status": "error", "message": params}), 400
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT c.id AS chapa_id,
-               c.sku,
-               c.descricao,
-               c.image_filename,
-               c.created_at,
-               h.image_hash AS frame_hash
-        FROM chapas c
-        JOIN chapa_hashes h ON h.chapa_id = c.id
-        """
-    )
-    rows = cur.fetchall()
-    conn.close()
+    analise = analisar_consulta(image_data)
+    if analise is None:
+        return jsonify({"status": "error", "message": "Erro ao ler imagem."}), 400
 
-    melhor = None
-    melhor_dist = None
+    query_hash, _, cor = analise
+    return responder_consulta(query_hash, *params, cor=cor)
 
-    for row in rows:
+
+@app.route("/api/consulta/multipart", methods=["POST"])
+def api_consulta_multipart():
+    # mesmo contrato do /api/consulta, com a foto como JPEG cru (parte "image")
+    # e "limiar"/"k" como campos do formulário
+    boundary = multipart_boundary()
+    if not boundary:
+        return jsonify({"status": "error", "message": "Envie multipart/form-data."}), 400
+
+    campos = {}
+    try:
+        for nome, dados in iter_multipart(request.stream, boundary):
+            campos[nome] = dados
+    except ValueError:
+        return jsonify({"status": "error", "message": "Upload incompleto."}), 400
+
+    imagem = campos.pop("image", None)
+    if not imagem:
+        return jsonify({"status": "error", "message": "Imagem não recebida."}), 400
+
+    params = parametros_consulta({n: v.decode("utf-8", "replace") for n, v in campos.items()})
+    if isinstance(params, str):
+        return jsonify({"status": "error", "message": params}), 400
+
+    analise = analisar_consulta(imagem)
+    if analise is None:
+        return jsonify({"status": "error", "message": "Erro ao ler imagem."}), 400
+
+    query_hash, _, cor = analise
+    return responder_consulta(query_hash, *params, cor=cor)
+
+
+def analisar_consulta(foto):
+    # (hash, qualidade, cor) da foto da consulta (data URL ou JPEG cru), ou
+    # None se não der pra ler; com CONSULTA_NO_POOL o trabalho de CPU vai pro
+    # pool de hash e a thread da requisição só espera
+    if CONSULTA_NO_POOL:
+        with metricas.etapa("pool"):
+            return hash_async(analisar_frames_lote, [foto]).result()[0]
+    return analisar_frames_lote([foto])[0]
+
+
+def parametros_consulta(fonte):
+    # (limiar, k) pedidos pelo cliente, com os padrões do servidor;
+    # devolve a mensagem de erro (str) se algum vier inválido
+    try:
+        limiar = int(fonte.get("limiar", LIMIAR))
+        k = int(fonte.get("k", RANKING_K))
+    except (TypeError, ValueError):
+        return "limiar e k devem ser inteiros."
+    if not 0 <= limiar <= LIMIAR_MAX:
+        return f"limiar deve estar entre 0 e {LIMIAR_MAX}."
+    if not 1 <= k <= RANKING_K_MAX:
+        return f"k deve estar entre 1 e {RANKING_K_MAX}."
+    return limiar, k
+
+
+def responder_consulta(query_hash, limiar=LIMIAR, k=RANKING_K, cor=None):
+    # pega o que outros workers cadastraram desde a última consulta
+    with metricas.etapa("indice"):
+        sync_hash_index()
+
+    query = hash_to_int(query_hash)
+    epoca = epoca_catalogo()
+    pre_cor = prefiltro_cor_ativo(cor)
+    chave = cache_consultas.chave(query, limiar, k, cor if pre_cor else None)
+    entrada = cache_consultas.obter(chave, epoca)
+    resultado = None
+    if entrada is not None:
+        with metricas.etapa("filtro_cor"):
+            resultado = resultado_entrada(entrada, None if pre_cor else cor, limiar, k)
+    if resultado is None:
+        with metricas.etapa("filtro_cor"):
+            excluir = chapas_de_outra_cor(cor) if pre_cor else None
+        with metricas.etapa("busca"):
+            chapa_ids, dists = hash_index.vizinhos(query, limiar, excluir=excluir)
+            ranking, completo = ranking_com_folga(chapa_ids, dists, limiar, k)
+        with metricas.etapa("sqlite"):
+            chapas = buscar_chapas(r["chapa_id"] for r in ranking)
+        entrada = (ranking, completo, chapas)
+        cache_consultas.guardar(chave, epoca, entrada)
+        with metricas.etapa("filtro_cor"):
+            resultado = resultado_entrada(entrada, None if pre_cor else cor, limiar, k)
+        if resultado is None:
+            resultado = resultado_sem_folga(chapa_ids, dists, cor, limiar, k)
+    return jsonify(resultado)
+
+
+@app.before_request
+def iniciar_metricas():
+    metricas.iniciar_requisicao(request.endpoint or "-")
+    g.inicio_metricas = time.perf_counter()
+
+
+@app.after_request
+def registrar_metricas(response):
+    tempos = metricas.encerrar_requisicao()
+    inicio = g.get("inicio_metricas")
+    if inicio is not None and request.endpoint != "metrics":
+        rota = request.endpoint or "-"
+        metricas.observar("requisicao_segundos", time.perf_counter() - inicio, rota=rota)
+        metricas.somar("requisicoes_total", rota=rota, codigo=response.status_code)
+    if SERVER_TIMING and tempos:
+        response.headers["Server-Timing"] = server_timing(tempos)
+    return response
+
+
+metricas.histograma("requisicao_segundos", "Duração das requisições por rota, em segundos")
+metricas.histograma("cadastro_frames", "Frames por cadastro (recebidos e aproveitados)",
+                    limites=(1, 2, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96, 128))
+metricas.contador("requisicoes_total", "Requisições por rota e código HTTP")
+metricas.medidor("catalogo_chapas", "Chapas no catálogo",
+                 lambda: get_conn().execute("SELECT COUNT(*) FROM chapas").fetchone()[0])
+metricas.medidor("catalogo_frames", "Frames (hashes) no índice deste worker", lambda: len(hash_index))
+metricas.medidor("cache_consultas_hits_total", "Acertos do cache de consultas deste worker",
+                 lambda: cache_consultas.hits, tipo="counter")
+metricas.medidor("cache_consultas_misses_total", "Faltas do cache de consultas deste worker",
+                 lambda: cache_consultas.misses, tipo="counter")
+metricas.medidor("fila_cadastro_pendentes", "Cadastros na fila ou em processamento",
+                 lambda: get_conn().execute(
+                     "SELECT COUNT(*) FROM cadastro_jobs WHERE status IN ('fila', 'processando')"
+                 ).fetchone()[0])
+
+
+@app.route("/metrics")
+def metrics():
+    # formato texto do Prometheus; os números são deste worker
+    return Response(metricas.exportar(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/consulta/cache")
+def api_consulta_cache():
+    # hits/misses do cache de consultas deste worker
+    return jsonify(cache_consultas.estatisticas())
+
+
+def prefiltro_cor_ativo(cor) -> bool:
+    # as chapas de outra cor saem antes da busca de hashes (catálogo grande,
+    # ver COR_MIN_FRAMES); senão a cor só é aplicada no ranking já pronto
+    return cor is not None and COR_LIMIAR > 0 and len(hash_index) >= COR_MIN_FRAMES
+
+
+def chapas_de_outra_cor(cor):
+    # chapa_ids que o pré-filtro de cor tira da comparação de hashes; None =
+    # filtrar depois da busca
+    if not prefiltro_cor_ativo(cor):
+        return None
+    return hash_index.cores.reprovadas(cor, COR_LIMIAR)
+
+
+def tirar_outra_cor(chapa_ids, dists, cor):
+    # os achados da busca de hashes sem os frames das chapas de outra cor; a
+    # cor só é comparada nas chapas achadas. Como a cor de uma chapa não mexe
+    # na média das outras, dá o mesmo ranking do pré-filtro
+    if cor is None or COR_LIMIAR <= 0 or not len(chapa_ids):
+        return chapa_ids, dists
+    fora = hash_index.cores.reprovadas_entre(cor, COR_LIMIAR, np.unique(chapa_ids))
+    if not len(fora):
+        return chapa_ids, dists
+    fica = ~contidos(chapa_ids, fora)
+    return chapa_ids[fica], dists[fica]
+
+
+def buscar_chapas(chapa_ids):
+    # {id: linha} das chapas encontradas, numa query só
+    ids = sorted(set(chapa_ids))
+    if not ids:
+        return {}
+    marcadores = ", ".join("?" * len(ids))
+    rows = get_conn().execute(
+        f"""
+        SELECT id AS chapa_id, sku, descricao, image_filename, created_at
+        FROM chapas
+        WHERE id IN ({marcadores})
+        """,
+        ids,
+    ).fetchall()
+    return {row["chapa_id"]: row for row in rows}
+
+
+def resultado_consulta(melhor, melhor_dist) -> dict:
+    # image_url é a miniatura que o card mostra (poucos KB); a imagem
+    # salva, do tamanho cheio, vai em imagem_original_url
+    filename = melhor["image_filename"]
+    return {
+        "status": "ok",
+        "sku": melhor["sku"],
+        "descricao": melhor["descricao"],
+        "image_url": url_imagem(filename, MINIATURAS_LADOS[0]),
+        "image_url_2x": url_imagem(filename, MINIATURAS_LADOS[-1]),
+        "imagem_original_url": url_imagem(filename),
+        "id": melhor["chapa_id"],
+        "distancia": int(melhor_dist),
+    }
+
+
+def ranking_com_folga(chapa_ids, dists, limiar, k):
+    # (ranking, completo): as RANKING_FOLGA * max(k, 2) primeiras colocadas,
+    # ainda sem o filtro de cor; é o que vai pro cache, e a cor de cada foto
+    # é aplicada em cima (a cor de uma chapa não mexe na média das outras).
+    # completo = todas as chapas achadas estão aí
+    profundidade = RANKING_FOLGA * max(k, 2)
+    ranking = ranquear(chapa_ids, dists, profundidade, limiar, RANKING_MELHORES_N, hash_index.frames_por_chapa)
+    return ranking, len(ranking) < profundidade
+
+
+def resultado_entrada(entrada, cor, limiar, k):
+    # resposta a partir de (ranking, completo, chapas) tirando as chapas de
+    # outra cor; None se o filtro deixou menos de 2 colocadas (a margem usa
+    # a 2ª) e pode haver outras além da folga
+    ranking, completo, chapas = entrada
+    if cor is not None and COR_LIMIAR > 0 and ranking:
+        fora = set(hash_index.cores.reprovadas_entre(cor, COR_LIMIAR, [r["chapa_id"] for r in ranking]).tolist())
+        ranking = [r for r in ranking if r["chapa_id"] not in fora]
+    if len(ranking) < max(k, 2) and not completo:
+        return None
+    return resultado_ranking(ranking[:max(k, 2)], chapas, limiar, k)
+
+
+def resultado_sem_folga(chapa_ids, dists, cor, limiar, k):
+    # o filtro de cor tirou mais que a folga: ranqueia de novo já sem as
+    # chapas de outra cor (não vai pro cache)
+    with metricas.etapa("filtro_cor"):
+        chapa_ids, dists = tirar_outra_cor(chapa_ids, dists, cor)
+    with metricas.etapa("busca"):
+        ranking = ranquear(chapa_ids, dists, max(k, 2), limiar, RANKING_MELHORES_N, hash_index.frames_por_chapa)
+    with metricas.etapa("sqlite"):
+        chapas = buscar_chapas(r["chapa_id"] for r in ranking)
+    return resultado_ranking(ranking, chapas, limiar, k)
+
+
+def resultado_ranking(ranking, chapas, limiar, k) -> dict:
+    # os campos de sempre (sku, distancia, ...) são da 1ª colocada,
+    # "resultados" traz as k melhores e "margem" é quanto a média da 2ª fica
+    # acima da 1ª (sem 2ª, conta como limiar + 1): margem pequena = chapas
+    # parecidas disputando a mesma foto
+    ranking = [r for r in ranking if r["chapa_id"] in chapas]
+    if not ranking:
+        return {"status": "not_found"}
+
+    resultados = []
+    for r in ranking[:k]:
+        item = resultado_consulta(chapas[r["chapa_id"]], r["distancia"])
+        del item["status"]
+        item["media"] = round(r["media"], 2)
+        item["votos"] = r["votos"]
+        resultados.append(item)
+
+    segunda = ranking[1]["media"] if len(ranking) > 1 else limiar + 1
+    resposta = resultado_consulta(chapas[ranking[0]["chapa_id"]], ranking[0]["distancia"])
+    resposta["margem"] = round(segunda - ranking[0]["media"], 2)
+    resposta["resultados"] = resultados
+    return resposta
+
+
+@app.route("/api/consulta/batch", methods=["POST"])
+def api_consulta_batch():
+    # várias chapas de uma vez (ex.: um palete inteiro no recebimento): as
+    # imagens vêm em JSON ({"images": [data URLs]}) ou multipart (partes
+    # "images"), são hasheadas em paralelo no pool e casadas com o catálogo
+    # numa passada só; a resposta traz um resultado por imagem, na ordem,
+    # no mesmo formato do /api/consulta ("limiar"/"k" valem pra todas)
+    boundary = multipart_boundary()
+    if boundary:
+        futuros = []
+        campos = {}
         try:
-            h_db = imagehash.hex_to_hash(row["frame_hash"])
-        except Exception:
-            continue
-        dist = query_hash - h_db
-        if melhor is None or dist < melhor_dist:
-            melhor = row
-            melhor_dist = dist
-
-    # mais tolerante, já que temos vários frames por chapa
-    LIMIAR = 24
-
-    if melhor is None or melhor_dist is None or melhor_dist > LIMIAR:
-        return jsonify({"status": "not_found"})
-
-    image_url = url_for("chapa_image", filename=melhor["image_filename"])
-
-    return jsonify(
-        {
-            "status": "ok",
-            "sku": melhor["sku"],
-            "descricao": melhor["descricao"],
-            "image_url": image_url,
-            "id": melhor["chapa_id"],
-            "distancia": int(melhor_dist),
-        }
-    )
+            for nome, dados in iter_multipart(request.stream, boundary):
+                if nome == "images":
+                    # passou do máximo: para de ler o corpo e tira da fila do
+                    # pool o que ainda não começou
+                    if len(futuros) >= BATCH_MAX_IMAGENS:
+                        for f in futuros:
+                            f.cancel()
+                        return jsonify({"status": "error", "message": f"Máximo de {BATCH_MAX_IMAGENS} imagens."}), 400
+                    futuros.append(hash_async(analisar_frames_lote, [dados]))
+                else:
+                    campos[nome] = dados.decode("utf-8", "replace")
+        except ValueError:
+            for f in futuros:
+                f.cancel()
+            return jsonify({"status": "error", "message": "Upload incompleto."}), 400
+        params = parametros_consulta(campos)
+        with metricas.etapa("pool"):
+            analises = [f.result()[0] for f in futuros]
+    else:
+        data = request.get_json(force=True)
+        images = data.get("images")
+        if not isinstance(images, list):
+            images = None
+        elif len(images) > BATCH_MAX_IMAGENS:
+            return jsonify({"status": "error", "message": f"Máximo de {BATCH_MAX_IMAGENS} imagens."}), 400
+        params = parametros_consulta(data)
+        with metricas.etapa("pool"):
+            analises = analisar_frames(images) if images and not isinstance(params, str) else []
+
+    if isinstance(params, str):
+        return jsonify({"status": "error", "message": params}), 400
+    if not analises:
+        return jsonify({"status": "error", "message": "Imagem não recebida."}), 400
+
+    limiar, k = params
+    with metricas.etapa("indice"):
+        sync_hash_index()
+
+    # o que já está no cache não passa pelo índice
+    epoca = epoca_catalogo()
+    pre_cor = [a is not None and prefiltro_cor_ativo(a[2]) for a in analises]
+    chaves = [
+        cache_consultas.chave(hash_to_int(a[0]), limiar, k, a[2] if pre else None) if a is not None else None
+        for a, pre in zip(analises, pre_cor)
+    ]
+    resultados = [None] * len(analises)
+    with metricas.etapa("filtro_cor"):
+        for i, chave in enumerate(chaves):
+            entrada = cache_consultas.obter(chave, epoca) if chave is not None else None
+            if entrada is not None:
+                resultados[i] = resultado_entrada(entrada, None if pre_cor[i] else analises[i][2], limiar, k)
+    faltam = [i for i, r in enumerate(resultados) if r is None and chaves[i] is not None]
+
+    with metricas.etapa("filtro_cor"):
+        excluir = [chapas_de_outra_cor(analises[i][2]) if pre_cor[i] else None for i in faltam]
+    with metricas.etapa("busca"):
+        vizinhos = hash_index.vizinhos_em_lote([hash_to_int(analises[i][0]) for i in faltam], limiar, excluir=excluir)
+        rankings = [ranking_com_folga(ids, dists, limiar, k) for ids, dists in vizinhos]
+    with metricas.etapa("sqlite"):
+        chapas = buscar_chapas(r["chapa_id"] for ranking, _ in rankings for r in ranking)
+
+    for i, (ids, dists), (ranking, completo) in zip(faltam, vizinhos, rankings):
+        entrada = (ranking, completo, {r["chapa_id"]: chapas[r["chapa_id"]] for r in ranking if r["chapa_id"] in chapas})
+        cache_consultas.guardar(chaves[i], epoca, entrada)
+        cor = None if pre_cor[i] else analises[i][2]
+        with metricas.etapa("filtro_cor"):
+            resultados[i] = resultado_entrada(entrada, cor, limiar, k)
+        if resultados[i] is None:
+            resultados[i] = resultado_sem_folga(ids, dists, cor, limiar, k)
+    resultados = [
+        r if r is not None else {"status": "error", "message": "Erro ao ler imagem."} for r in resultados
+    ]
+
+    return jsonify({"status": "ok", "resultados": resultados})
 
 
 if __name__ == "__main__":
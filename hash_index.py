@@ -0,0 +1,813 @@
+# ---------------- ÍNDICE DE HASHES EM MEMÓRIA ---------------- #
+#
+# guarda todos os pHash de chapa_hashes empacotados em uint64 (um por frame)
+# com um array paralelo de chapa_id; a distância de Hamming é calculada de
+# uma vez só sobre o array inteiro (XOR + popcount) em vez de um loop Python.
+#
+# a busca em si fica num backend plugável:
+#   linear  -> força bruta vetorizada (padrão)
+#   mih     -> multi-index hashing: o hash é quebrado em substrings e cada
+#              uma vira uma tabela; pelo princípio da casa dos pombos, quem
+#              está a distância <= r tem alguma substring a distância <= r // m
+#   bktree  -> árvore BK (métrica de Hamming)
+# todos devolvem resultado exato para qualquer raio. O mih e a bktree só
+# ganham da força bruta com raio pequeno (até ~8 bits): no raio da consulta
+# (24) o mih cai na varredura linear e a bktree, em Python puro, perde feio.
+
+import os
+import struct
+import threading
+from itertools import combinations
+
+import numpy as np
+
+
+def hash_to_int(h) -> int:
+    # aceita ImageHash, a string hex do esquema antigo ou o INTEGER do novo
+    if isinstance(h, int):
+        return h & 0xFFFFFFFFFFFFFFFF
+    return int(str(h), 16)
+
+
+def hash_to_i64(h) -> int:
+    # o SQLite só guarda inteiro de 64 bits com sinal
+    v = hash_to_int(h)
+    return v - (1 << 64) if v >= (1 << 63) else v
+
+
+if hasattr(np, "bitwise_count"):
+
+    def popcount64(arr: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(arr)
+
+else:
+    # numpy < 2.0: tabela de 256 posições aplicada byte a byte
+    _POPCOUNT_BYTE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount64(arr: np.ndarray) -> np.ndarray:
+        arr = np.ascontiguousarray(arr, dtype=np.uint64)
+        por_byte = _POPCOUNT_BYTE[arr.view(np.uint8)].reshape(arr.shape + (8,))
+        return por_byte.sum(axis=-1, dtype=np.uint8)
+
+
+def hamming(hashes: np.ndarray, query: int) -> np.ndarray:
+    return popcount64(np.bitwise_xor(hashes, np.uint64(query)))
+
+
+def vizinhos_em_bloco(hashes: np.ndarray, queries: np.ndarray, raio: int, bloco: int):
+    # matriz de distâncias N x M calculada em fatias de `bloco` colunas (a
+    # matriz inteira não cabe em memória com catálogo grande); devolve, pra
+    # cada query, (posições, distâncias) dos frames a distância <= raio
+    q = queries.astype(np.uint64)[:, None]
+    achados_q, achados_pos, achados_dist = [], [], []
+    for inicio in range(0, len(hashes), bloco):
+        dists = popcount64(np.bitwise_xor(q, hashes[inicio:inicio + bloco][None, :]))
+        qi, pos = np.nonzero(dists <= raio)
+        achados_q.append(qi)
+        achados_pos.append(pos + inicio)
+        achados_dist.append(dists[qi, pos])
+
+    if not achados_q:
+        vazio = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8))
+        return [vazio] * len(queries)
+    qi = np.concatenate(achados_q)
+    ordem = np.argsort(qi, kind="stable")
+    cortes = np.cumsum(np.bincount(qi, minlength=len(queries)))[:-1]
+    return list(
+        zip(
+            np.split(np.concatenate(achados_pos)[ordem], cortes),
+            np.split(np.concatenate(achados_dist)[ordem], cortes),
+        )
+    )
+
+
+def ranquear(chapa_ids: np.ndarray, dists: np.ndarray, k: int, limiar: int, melhores_n: int = 3,
+             frames_por_chapa: np.ndarray = None):
+    # agrega os frames a distância <= limiar por chapa e devolve as k melhores:
+    #   media     -> média das melhores_n distâncias da chapa; frame que falta
+    #                conta como limiar + 1 (1 frame perto não ganha de 3)
+    #   distancia -> menor distância entre os frames da chapa
+    #   votos     -> quantos frames da chapa ficaram dentro do limiar
+    # ordem: media, depois distancia, depois mais votos
+    # frames_por_chapa (indexado pelo chapa_id, ver HashIndex.frames_por_chapa)
+    # é quantos frames cada chapa tem no índice: chapa com menos de
+    # melhores_n frames tira a média só dos que tem, senão um frame exato de
+    # uma chapa de 1 frame perderia pra um frame mediano de uma de 3. Sem
+    # ele, toda chapa conta como tendo melhores_n frames
+    if not len(chapa_ids):
+        return []
+    dists = dists.astype(np.int64)
+    chapas, grupo = np.unique(chapa_ids, return_inverse=True)
+    votos = np.bincount(grupo)
+    n = np.full(len(chapas), melhores_n, dtype=np.int64)
+    if frames_por_chapa is not None:
+        cadastrados = np.zeros(len(chapas), dtype=np.int64)
+        dentro = chapas < len(frames_por_chapa)
+        cadastrados[dentro] = frames_por_chapa[chapas[dentro]]
+        n = np.clip(np.maximum(cadastrados, votos), 1, melhores_n)
+
+    # posição de cada frame dentro da sua chapa, da menor distância pra maior
+    ordem = np.lexsort((dists, grupo))
+    inicio_grupo = np.concatenate(([0], np.cumsum(votos)[:-1]))
+    rank = np.arange(len(ordem)) - inicio_grupo[grupo[ordem]]
+    melhores = ordem[rank < melhores_n]
+    soma = np.bincount(grupo[melhores], weights=dists[melhores], minlength=len(chapas))
+    faltando = n - np.minimum(votos, n)
+    media = (soma + faltando * (limiar + 1)) / n
+
+    minimo = np.full(len(chapas), limiar + 1, dtype=np.int64)
+    np.minimum.at(minimo, grupo, dists)
+
+    # seleção parcial: só quem empata ou fica abaixo da k-ésima média é ordenado
+    if len(chapas) > k:
+        kth = np.partition(media, k - 1)[k - 1]
+        candidatas = np.flatnonzero(media <= kth)
+    else:
+        candidatas = np.arange(len(chapas))
+    c = candidatas
+    top = c[np.lexsort((chapas[c], -votos[c], minimo[c], media[c]))][:k]
+    return [
+        {
+            "chapa_id": int(chapas[i]),
+            "distancia": int(minimo[i]),
+            "media": float(media[i]),
+            "votos": int(votos[i]),
+        }
+        for i in top
+    ]
+
+
+def contidos(valores: np.ndarray, conjunto: np.ndarray) -> np.ndarray:
+    # np.isin pra ids inteiros não negativos (chapa_id): marca o conjunto numa
+    # tabela de bools indexada pelo id, sem ordenar nada
+    if not len(conjunto) or not len(valores):
+        return np.zeros(len(valores), dtype=bool)
+    tabela = np.zeros(int(max(valores.max(), conjunto.max())) + 1, dtype=bool)
+    tabela[conjunto] = True
+    return tabela[valores]
+
+
+# ---------------- BACKENDS ---------------- #
+
+class LinearBackend:
+    nome = "linear"
+
+    def adicionar(self, hashes: np.ndarray, n: int):
+        pass
+
+    def vizinhos(self, hashes: np.ndarray, query: int, raio: int):
+        dists = hamming(hashes, query)
+        posicoes = np.flatnonzero(dists <= raio)
+        return posicoes, dists[posicoes]
+
+
+class MultiIndexBackend:
+    nome = "mih"
+
+    def __init__(self, substrings: int = 4, reconstruir_a_cada: int = 4096):
+        if substrings not in (4, 8, 16):
+            raise ValueError("mih: substrings deve ser 4, 8 ou 16")
+        self.m = substrings
+        self.bits = 64 // substrings
+        self.reconstruir_a_cada = reconstruir_a_cada
+        # (tabelas, indexados): as tabelas cobrem as posições < indexados;
+        # o resto (cauda) é varrido na força bruta até a próxima reconstrução
+        self._estado = ([], 0)
+        self._mascaras = {}
+
+    def _substrings(self, hashes: np.ndarray):
+        mask = np.uint64((1 << self.bits) - 1)
+        for j in range(self.m):
+            shift = np.uint64(64 - self.bits * (j + 1))
+            yield (hashes >> shift) & mask
+
+    def _subs_query(self, query: int):
+        mask = (1 << self.bits) - 1
+        return [(query >> (64 - self.bits * (j + 1))) & mask for j in range(self.m)]
+
+    def adicionar(self, hashes: np.ndarray, n: int):
+        _, indexados = self._estado
+        if n - indexados < max(self.reconstruir_a_cada, indexados // 8):
+            return
+
+        tipo_pos = np.int32 if n < 2**31 else np.int64
+        tabelas = []
+        for sub in self._substrings(hashes[:n]):
+            # uint16/uint8 -> argsort estável vira radix sort
+            sub = sub.astype(np.uint16 if self.bits == 16 else np.uint8)
+            ordem = np.argsort(sub, kind="stable").astype(tipo_pos)
+            offsets = np.zeros((1 << self.bits) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(sub, minlength=1 << self.bits), out=offsets[1:])
+            tabelas.append((ordem, offsets))
+        self._estado = (tabelas, n)
+
+    def _anel(self, s: int) -> np.ndarray:
+        # todos os valores de `bits` bits com exatamente s bits ligados
+        if s not in self._mascaras:
+            self._mascaras[s] = np.array(
+                [sum(1 << b for b in c) for c in combinations(range(self.bits), s)],
+                dtype=np.int64,
+            )
+        return self._mascaras[s]
+
+    def _candidatos(self, tabelas, subs_q, s: int, limite: int):
+        # devolve None se o anel trouxer mais de `limite` candidatos: aí a
+        # força bruta sai mais barata e nem vale a pena juntar os buckets
+        anel = self._anel(s)
+        faixas = []
+        total = 0
+        for (ordem, offsets), sq in zip(tabelas, subs_q):
+            probes = anel ^ sq
+            inicios = offsets[probes]
+            tamanhos = offsets[probes + 1] - inicios
+            qtd = int(tamanhos.sum())
+            total += qtd
+            if total > limite:
+                return None
+            if qtd:
+                faixas.append((ordem, inicios, tamanhos, qtd))
+
+        partes = []
+        for ordem, inicios, tamanhos, qtd in faixas:
+            # concatena os intervalos [inicio, inicio + tamanho) sem loop Python
+            desloc = np.repeat(inicios - (np.cumsum(tamanhos) - tamanhos), tamanhos)
+            partes.append(ordem[desloc + np.arange(qtd)])
+        if not partes:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(partes)
+
+    def _cauda(self, hashes, indexados, query, raio):
+        dists = hamming(hashes[indexados:], query)
+        posicoes = np.flatnonzero(dists <= raio)
+        return posicoes + indexados, dists[posicoes]
+
+    def vizinhos(self, hashes: np.ndarray, query: int, raio: int):
+        tabelas, indexados = self._estado
+        if not tabelas:
+            return LinearBackend.vizinhos(self, hashes, query, raio)
+
+        subs_q = self._subs_query(query)
+        partes = []
+        # juntar candidato de bucket custa bem mais que um item da varredura
+        # linear; passou de ~N/32 candidatos, a força bruta ganha
+        limite = indexados // 32
+        for s in range(raio // self.m + 1):
+            cand = self._candidatos(tabelas, subs_q, s, limite)
+            if cand is None:
+                # raio grande demais pra compensar: varrer tudo sai mais barato
+                return LinearBackend.vizinhos(self, hashes, query, raio)
+            limite -= len(cand)
+            partes.append(cand)
+
+        cand = np.unique(np.concatenate(partes))
+        # as tabelas podem já cobrir frames que entraram depois do `hashes`
+        # que quem chamou leu (adicionar em outro thread): ficam de fora
+        cand = cand[cand < len(hashes)]
+        dists = hamming(hashes[cand], query)
+        ok = dists <= raio
+        pos_cauda, dists_cauda = self._cauda(hashes, indexados, query, raio)
+        return (
+            np.concatenate([cand[ok].astype(np.int64), pos_cauda]),
+            np.concatenate([dists[ok], dists_cauda]),
+        )
+
+
+class BKTreeBackend:
+    nome = "bktree"
+
+    def __init__(self):
+        # nó = [hash, [posições com esse hash], {distância: filho}]
+        self._raiz = None
+        self._indexados = 0
+
+    def adicionar(self, hashes: np.ndarray, n: int):
+        for pos in range(self._indexados, n):
+            h = int(hashes[pos])
+            if self._raiz is None:
+                self._raiz = [h, [pos], {}]
+                continue
+            no = self._raiz
+            while True:
+                d = (h ^ no[0]).bit_count()
+                if d == 0:
+                    no[1].append(pos)
+                    break
+                filho = no[2].get(d)
+                if filho is None:
+                    no[2][d] = [h, [pos], {}]
+                    break
+                no = filho
+        self._indexados = n
+
+    def _buscar(self, query: int, raio: int, n: int):
+        # só as posições < n: a árvore muda no lugar e pode já ter frames
+        # que entraram depois do `hashes` que quem chamou leu
+        achados = []
+        pilha = [self._raiz] if self._raiz is not None else []
+        while pilha:
+            no = pilha.pop()
+            d = (query ^ no[0]).bit_count()
+            if d <= raio and no[1][0] < n:
+                achados.extend((pos, d) for pos in list(no[1]) if pos < n)
+            # só filhos em [d - raio, d + raio] podem ter algo dentro do raio;
+            # get() por chave evita iterar o dict enquanto outro thread insere
+            filhos = no[2]
+            for k in range(max(1, d - raio), d + raio + 1):
+                filho = filhos.get(k)
+                if filho is not None:
+                    pilha.append(filho)
+        return achados
+
+    def vizinhos(self, hashes: np.ndarray, query: int, raio: int):
+        achados = self._buscar(query, raio, n=len(hashes))
+        posicoes = np.array([p for p, _ in achados], dtype=np.int64)
+        dists = np.array([d for _, d in achados], dtype=np.uint8)
+        return posicoes, dists
+
+
+BACKENDS = {
+    "linear": LinearBackend,
+    "mih": MultiIndexBackend,
+    "bktree": BKTreeBackend,
+}
+
+
+def criar_backend(nome: str, **opcoes):
+    try:
+        cls = BACKENDS[nome]
+    except KeyError:
+        raise ValueError(f"backend de busca desconhecido: {nome!r}") from None
+    return cls(**opcoes)
+
+
+# ---------------- ARQUIVO DO ÍNDICE ---------------- #
+#
+# formato (little-endian), pensado pra ser aberto com mmap por todos os
+# workers ao mesmo tempo, dividindo as mesmas páginas físicas:
+#   cabeçalho de 64 bytes: magic, versão, flags, qtd, último chapa_hashes.id
+#                          e o hash dessa última linha (pra conferir com o banco)
+#   qtd x uint64           hashes
+#   qtd x int32            chapa_ids
+# com a flag ARQUIVO_AGRUPADO os frames vêm ordenados por chapa_id (os de uma
+# chapa contíguos): o pré-filtro de cor lê as faixas das chapas direto do
+# mmap, sem cada worker montar uma cópia agrupada do índice
+
+ARQUIVO_MAGIC = b"CHAPAIDX"
+ARQUIVO_VERSAO = 1
+ARQUIVO_AGRUPADO = 1
+_CABECALHO = struct.Struct("<8sIIQqQ")
+_TAM_CABECALHO = 64
+
+
+def salvar_arquivo_indice(path: str, hashes, chapa_ids, ultimo_id: int):
+    hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+    chapa_ids = np.asarray(chapa_ids)
+    if len(chapa_ids) and int(chapa_ids.max()) > np.iinfo(np.int32).max:
+        raise ValueError("chapa_id não cabe em int32")
+    # hashes vêm na ordem do chapa_hashes.id: o último é o da linha ultimo_id
+    ultimo_hash = int(hashes[-1]) if len(hashes) else 0
+    ordem = np.argsort(chapa_ids, kind="stable")
+    hashes, chapa_ids = hashes[ordem], chapa_ids[ordem]
+    cabecalho = _CABECALHO.pack(
+        ARQUIVO_MAGIC, ARQUIVO_VERSAO, ARQUIVO_AGRUPADO, len(hashes), ultimo_id, ultimo_hash
+    )
+
+    # grava ao lado e troca de uma vez: quem já abriu continua com o antigo
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(cabecalho.ljust(_TAM_CABECALHO, b"\0"))
+        f.write(hashes.tobytes())
+        f.write(chapa_ids.astype("<i4").tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def abrir_arquivo_indice(path: str):
+    # devolve (hashes, chapa_ids, ultimo_id, ultimo_hash, agrupado) sem ler o
+    # arquivo inteiro: os arrays são np.memmap somente leitura
+    with open(path, "rb") as f:
+        cabecalho = f.read(_TAM_CABECALHO)
+    if len(cabecalho) < _CABECALHO.size:
+        raise ValueError(f"{path}: arquivo de índice truncado")
+    magic, versao, flags, qtd, ultimo_id, ultimo_hash = _CABECALHO.unpack_from(cabecalho)
+    agrupado = bool(flags & ARQUIVO_AGRUPADO)
+    if magic != ARQUIVO_MAGIC or versao != ARQUIVO_VERSAO:
+        raise ValueError(f"{path}: não é um arquivo de índice v{ARQUIVO_VERSAO}")
+    if os.path.getsize(path) != _TAM_CABECALHO + qtd * 12:
+        raise ValueError(f"{path}: tamanho não bate com o cabeçalho")
+
+    if not qtd:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int32), ultimo_id, ultimo_hash, agrupado
+    hashes = np.memmap(path, dtype="<u8", mode="r", offset=_TAM_CABECALHO, shape=(qtd,))
+    chapa_ids = np.memmap(path, dtype="<i4", mode="r", offset=_TAM_CABECALHO + qtd * 8, shape=(qtd,))
+    return hashes, chapa_ids, ultimo_id, ultimo_hash, agrupado
+
+
+def faixas_por_chapa(hashes, chapa_ids):
+    # (hashes, chapas, inicio, fim) de frames já ordenados por chapa_id: os
+    # frames da chapa chapas[i] são hashes[inicio[i]:fim[i]]
+    if not len(chapa_ids):
+        vazio = np.empty(0, dtype=np.int64)
+        return hashes, vazio, vazio, vazio
+    bordas = np.flatnonzero(chapa_ids[1:] != chapa_ids[:-1]) + 1
+    inicio = np.concatenate(([0], bordas))
+    fim = np.concatenate((bordas, [len(chapa_ids)]))
+    return hashes, np.asarray(chapa_ids[inicio], dtype=np.int64), inicio, fim
+
+
+# ---------------- ÍNDICE ---------------- #
+
+class AssinaturasCor:
+    # assinatura de cor de cada chapa (média e desvio de L*, a*, b* no miolo
+    # da chapa), pra consulta descartar as chapas de cor muito diferente antes
+    # de comparar hashes; chapa sem assinatura (cadastrada antes) nunca é
+    # descartada. L* pesa menos porque varia com a exposição da foto.
+    PESOS = np.array([0.5, 1, 1, 0.5, 1, 1], dtype=np.float32)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (chapa_ids, assinaturas já multiplicadas pelos PESOS, uma coluna por
+        # componente: 6 x M, coluna de cada chapa_id ou -1), trocado de uma
+        # vez pra leitura sem lock
+        self._estado = (
+            np.empty(0, dtype=np.int64), np.empty((6, 0), dtype=np.float32), np.empty(0, dtype=np.int32)
+        )
+        self.ultimo_id = 0
+
+    def __len__(self):
+        return len(self._estado[0])
+
+    def adicionar(self, chapa_ids, assinaturas):
+        novos_ids = np.asarray(chapa_ids, dtype=np.int64)
+        novas = (np.asarray(assinaturas, dtype=np.float32).reshape(-1, 6) * self.PESOS).T
+        if not len(novos_ids):
+            return
+        with self._lock:
+            ids, sigs, coluna = self._estado
+            maior = int(novos_ids.max()) + 1
+            if maior > len(coluna):
+                nova = np.full(max(maior, 2 * len(coluna)), -1, dtype=np.int32)
+                nova[:len(coluna)] = coluna
+                coluna = nova
+            else:
+                coluna = coluna.copy()
+            coluna[novos_ids] = np.arange(len(ids), len(ids) + len(novos_ids), dtype=np.int32)
+            self._estado = (
+                np.concatenate([ids, novos_ids]),
+                np.ascontiguousarray(np.concatenate([sigs, novas], axis=1)),
+                coluna,
+            )
+
+    def sincronizar(self, conn):
+        # chapa_cores.chapa_id cresce junto com chapas.id (a assinatura entra
+        # na mesma transação da chapa), então serve de marca d'água
+        with self._lock:
+            cur = conn.cursor()
+            cur.row_factory = None
+            rows = cur.execute(
+                "SELECT chapa_id, l_media, a_media, b_media, l_desvio, a_desvio, b_desvio "
+                "FROM chapa_cores WHERE chapa_id > ? ORDER BY chapa_id",
+                (self.ultimo_id,),
+            ).fetchall()
+            if not rows:
+                return 0
+            arr = np.array(rows, dtype=np.float64)
+            self.ultimo_id = rows[-1][0]
+        self.adicionar(arr[:, 0], arr[:, 1:])
+        return len(rows)
+
+    def distancias2(self, assinatura):
+        # (chapa_ids, distância ao quadrado de cada assinatura pra consulta)
+        ids, sigs, _ = self._estado
+        consulta = np.asarray(assinatura, dtype=np.float32) * self.PESOS
+        soma = np.zeros(len(ids), dtype=np.float32)
+        for coluna, valor in zip(sigs, consulta):
+            diff = coluna - valor
+            diff *= diff
+            soma += diff
+        return ids, soma
+
+    def reprovadas(self, assinatura, limite: float) -> np.ndarray:
+        # chapa_ids com assinatura a distância > limite da consulta
+        ids, dist2 = self.distancias2(assinatura)
+        return ids[dist2 > np.float32(limite) ** 2]
+
+    def reprovadas_entre(self, assinatura, limite: float, chapa_ids) -> np.ndarray:
+        # como reprovadas, mas só entre chapa_ids (as candidatas de uma busca)
+        _, sigs, coluna = self._estado
+        chapa_ids = np.asarray(chapa_ids, dtype=np.int64)
+        cols = np.full(len(chapa_ids), -1, dtype=np.int64)
+        dentro = chapa_ids < len(coluna)
+        cols[dentro] = coluna[chapa_ids[dentro]]
+        tem = cols >= 0
+        consulta = np.asarray(assinatura, dtype=np.float32) * self.PESOS
+        diff = sigs[:, cols[tem]] - consulta[:, None]
+        dist2 = (diff * diff).sum(axis=0)
+        return chapa_ids[tem][dist2 > np.float32(limite) ** 2]
+
+
+class HashIndex:
+    def __init__(self, backend="linear"):
+        self._lock = threading.RLock()
+        # (hashes, chapa_ids) vindos do arquivo mmap, compartilhados entre
+        # os workers; só o backend linear usa direto, sem copiar
+        self._base = (np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int32))
+        # (hashes, chapa_ids, n): cauda privada do processo, trocada de uma vez
+        # pra leitura sem lock; as posições < n nunca mudam depois de publicadas
+        self._estado = (np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64), 0)
+        # maior chapa_hashes.id já carregado
+        self.ultimo_id = 0
+        self.backend = criar_backend(backend) if isinstance(backend, str) else backend
+        self.cores = AssinaturasCor()
+        # frames agrupados por chapa, pro pré-filtro de cor: (partes, n), com
+        # uma parte (ver faixas_por_chapa) pro arquivo mmap, que já vem
+        # agrupado e não é copiado, e outra pra cópia ordenada da cauda
+        # privada; cobre as n primeiras posições. O que entrou depois é
+        # varrido à parte até um thread montar de novo
+        self._por_chapa = None
+        self._base_agrupada = False
+        self._faixas_base = None
+        self._reagrupando = False
+        # frames por chapa_id, pro ranquear; só cresce, e é atualizado antes
+        # de os frames novos ficarem visíveis
+        self.frames_por_chapa = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self._base[0]) + self._estado[2]
+
+    def _segmentos(self):
+        # pedaços não vazios do índice, na ordem em que os frames entraram
+        segmentos = []
+        if len(self._base[0]):
+            segmentos.append(self._base)
+        hashes, chapa_ids, n = self._estado
+        if n:
+            segmentos.append((hashes[:n], chapa_ids[:n]))
+        return segmentos
+
+    @property
+    def hashes(self) -> np.ndarray:
+        segmentos = self._segmentos()
+        if len(segmentos) == 1:
+            return segmentos[0][0]
+        return np.concatenate([h for h, _ in segmentos]) if segmentos else self._estado[0][:0]
+
+    @property
+    def chapa_ids(self) -> np.ndarray:
+        segmentos = self._segmentos()
+        if len(segmentos) == 1:
+            return segmentos[0][1]
+        return np.concatenate([c for _, c in segmentos]) if segmentos else self._estado[1][:0]
+
+    def carregar_arquivo(self, path: str, conn=None) -> bool:
+        # abre o arquivo gerado por salvar_arquivo_indice; com conn, confere
+        # que a última linha do arquivo ainda existe no banco com o mesmo hash
+        # (arquivo de outro banco ou de antes de um rehash é ignorado)
+        hashes, chapa_ids, ultimo_id, ultimo_hash, agrupado = abrir_arquivo_indice(path)
+        if conn is not None and len(hashes):
+            row = conn.execute(
+                "SELECT image_hash FROM chapa_hashes WHERE id = ?", (ultimo_id,)
+            ).fetchone()
+            try:
+                ok = row is not None and hash_to_int(row[0]) == ultimo_hash
+            except (TypeError, ValueError):
+                ok = False
+            if not ok:
+                return False
+
+        with self._lock:
+            if len(self):
+                raise RuntimeError("carregar_arquivo só pode ser chamado com o índice vazio")
+            if isinstance(self.backend, LinearBackend):
+                self._contar(chapa_ids)
+                self._base = (hashes, chapa_ids)
+                self._base_agrupada = agrupado
+            else:
+                # mih/bktree montam estruturas próprias em memória de qualquer jeito
+                self.adicionar(chapa_ids, hashes)
+            self.ultimo_id = ultimo_id
+        return True
+
+    def salvar_arquivo(self, path: str):
+        with self._lock:
+            salvar_arquivo_indice(path, self.hashes, self.chapa_ids, self.ultimo_id)
+
+    def _contar(self, chapa_ids):
+        # chamado com o lock; cresce por cópia (quem já leu fica com a antiga)
+        if not len(chapa_ids):
+            return
+        contagem = self.frames_por_chapa
+        maior = int(np.max(chapa_ids)) + 1
+        if maior > len(contagem):
+            nova = np.zeros(max(maior, 2 * len(contagem), 1024), dtype=np.int32)
+            nova[:len(contagem)] = contagem
+            contagem = nova
+        contagem += np.bincount(np.asarray(chapa_ids, dtype=np.int64), minlength=len(contagem)).astype(np.int32)
+        self.frames_por_chapa = contagem
+
+    def adicionar(self, chapa_ids, hashes):
+        novos_ids = np.asarray(chapa_ids, dtype=np.int64)
+        novos_hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(novos_hashes):
+            return
+
+        with self._lock:
+            self._contar(novos_ids)
+            buf_hashes, buf_ids, n = self._estado
+            total = n + len(novos_hashes)
+            if total > len(buf_hashes):
+                capacidade = max(total, 2 * len(buf_hashes), 1024)
+                maior_hashes = np.empty(capacidade, dtype=np.uint64)
+                maior_ids = np.empty(capacidade, dtype=np.int64)
+                maior_hashes[:n] = buf_hashes[:n]
+                maior_ids[:n] = buf_ids[:n]
+                buf_hashes, buf_ids = maior_hashes, maior_ids
+            buf_hashes[n:total] = novos_hashes
+            buf_ids[n:total] = novos_ids
+            self.backend.adicionar(buf_hashes, total)
+            self._estado = (buf_hashes, buf_ids, total)
+
+    def sincronizar(self, conn):
+        # carrega só as linhas de chapa_hashes que entraram depois da última carga
+        with self._lock:
+            cur = conn.cursor()
+            cur.row_factory = None
+            rows = cur.execute(
+                "SELECT id, chapa_id, image_hash FROM chapa_hashes WHERE id > ? ORDER BY id",
+                (self.ultimo_id,),
+            ).fetchall()
+            if not rows:
+                return 0
+
+            arr = np.array(rows)
+            if arr.dtype.kind == "i":
+                # esquema compacto: hash já é INTEGER, vai direto pro numpy
+                chapa_ids = arr[:, 1]
+                hashes = arr[:, 2].astype(np.int64).view(np.uint64)
+            else:
+                # esquema antigo (hex em texto): converte linha a linha
+                chapa_ids = []
+                hashes = []
+                for row in rows:
+                    try:
+                        h = hash_to_int(row[2])
+                    except (TypeError, ValueError):
+                        continue
+                    chapa_ids.append(row[1])
+                    hashes.append(h)
+
+            self.ultimo_id = rows[-1][0]
+            self.adicionar(chapa_ids, hashes)
+            return len(hashes)
+
+    def _agrupado_por_chapa(self):
+        # o agrupamento atual, ou None se ainda não tem; se estiver velho
+        # (ou faltando), um thread monta outro: a consulta nunca espera
+        if len(self._base[0]) and not self._base_agrupada:
+            return None
+        agrupado = self._por_chapa
+        if agrupado is None or len(self) - agrupado[1] > max(4096, agrupado[1] // 8):
+            with self._lock:
+                if self._reagrupando:
+                    return agrupado
+                self._reagrupando = True
+            threading.Thread(target=self.agrupar_por_chapa, name="agrupar-por-chapa", daemon=True).start()
+        return agrupado
+
+    def agrupar_por_chapa(self):
+        # monta o agrupamento por chapa; o arquivo mmap só entra se
+        # gerar-indice já gravou ele agrupado (senão, sem agrupamento: copiar
+        # o arquivo inteiro em cada worker é o que o mmap evita)
+        try:
+            base_hashes, base_ids = self._base
+            partes = []
+            if len(base_ids):
+                if not self._base_agrupada:
+                    return None
+                if self._faixas_base is None:
+                    self._faixas_base = faixas_por_chapa(base_hashes, base_ids)
+                partes.append(self._faixas_base)
+            hashes, chapa_ids, n = self._estado
+            if n:
+                ordem = np.argsort(chapa_ids[:n], kind="stable")
+                partes.append(faixas_por_chapa(hashes[:n][ordem], chapa_ids[:n][ordem]))
+            self._por_chapa = (partes, len(base_ids) + n)
+            return self._por_chapa
+        finally:
+            self._reagrupando = False
+
+    def _recorte(self, inicio: int, fim: int = None):
+        # (hashes, chapa_ids) das posições globais [inicio, fim)
+        partes = []
+        offset = 0
+        for hashes, chapa_ids in self._segmentos():
+            a = max(inicio - offset, 0)
+            b = len(hashes) if fim is None else min(fim - offset, len(hashes))
+            if a < b:
+                partes.append((hashes[a:b], chapa_ids[a:b]))
+            offset += len(hashes)
+        if len(partes) == 1:
+            return partes[0]
+        if not partes:
+            return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+        return np.concatenate([h for h, _ in partes]), np.concatenate([c for _, c in partes])
+
+    def _vizinhos_fora_de(self, query: int, raio: int, excluir: np.ndarray):
+        # vizinhos() só entre as chapas que não estão em excluir: lê as faixas
+        # das chapas que sobraram no agrupamento por chapa e compara só essas;
+        # se sobrar muito do catálogo, varre tudo e filtra no fim
+        # ler faixas soltas custa umas 4x a varredura sequencial por frame,
+        # mais o custo fixo de montar as faixas: só compensa em catálogo
+        # grande e quando sobra menos de 1/5 dele
+        agrupado = self._agrupado_por_chapa() if len(self) >= 1 << 20 else None
+        total = None
+        if agrupado is not None:
+            partes, n = agrupado
+            if len(excluir) * 5 >= max((len(p[1]) for p in partes), default=0) * 4:
+                mantidas = []
+                total = 0
+                for hashes_por_chapa, chapas, inicio, fim in partes:
+                    manter = ~contidos(chapas, excluir)
+                    tamanhos = (fim - inicio)[manter]
+                    mantidas.append((hashes_por_chapa, chapas[manter], inicio[manter], tamanhos))
+                    total += int(tamanhos.sum())
+        if total is None or total * 5 > len(self):
+            chapa_ids, dists = self.vizinhos(query, raio)
+            fica = ~contidos(chapa_ids, excluir)
+            return chapa_ids[fica], dists[fica]
+
+        todos_ids = []
+        todas_dists = []
+        for hashes_por_chapa, chapas, inicio, tamanhos in mantidas:
+            qtd = int(tamanhos.sum())
+            if not qtd:
+                continue
+            # posições [inicio, inicio + tamanho) de cada chapa mantida, num array só
+            fins = np.cumsum(tamanhos)
+            deslocamento = np.repeat(inicio - fins + tamanhos, tamanhos)
+            dists = hamming(hashes_por_chapa[deslocamento + np.arange(qtd)], query)
+            sel = np.flatnonzero(dists <= raio)
+            # chapa de cada achado: em qual faixa a posição cai
+            todos_ids.append(chapas[np.searchsorted(fins, sel, side="right")])
+            todas_dists.append(dists[sel])
+
+        # frames que entraram depois do agrupamento
+        cauda_hashes, cauda_ids = self._recorte(n)
+        if len(cauda_ids):
+            fica = ~contidos(cauda_ids, excluir)
+            cauda_dists = hamming(cauda_hashes[fica], query)
+            sel = np.flatnonzero(cauda_dists <= raio)
+            todos_ids.append(cauda_ids[fica][sel].astype(np.int64))
+            todas_dists.append(cauda_dists[sel])
+        if not todos_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        return np.concatenate(todos_ids), np.concatenate(todas_dists)
+
+    def vizinhos(self, query: int, raio: int, excluir=None):
+        # todos os frames a distância <= raio: (chapa_ids, distâncias); com
+        # excluir (chapa_ids), os frames dessas chapas nem são comparados
+        if excluir is not None and len(excluir):
+            return self._vizinhos_fora_de(query, raio, np.asarray(excluir, dtype=np.int64))
+        todos_ids = []
+        todas_dists = []
+        for hashes, chapa_ids in self._segmentos():
+            posicoes, dists = self.backend.vizinhos(hashes, query, raio)
+            todos_ids.append(chapa_ids[posicoes].astype(np.int64))
+            todas_dists.append(dists)
+        if not todos_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        return np.concatenate(todos_ids), np.concatenate(todas_dists)
+
+    def vizinhos_em_lote(self, queries, raio: int, max_elementos: int = 1 << 20, excluir=None):
+        # vizinhos() de várias consultas de uma vez: com o backend linear, uma
+        # passada só pelo catálogo (matriz N x M em blocos de ~max_elementos);
+        # excluir é uma lista de chapa_ids por consulta, aplicada no resultado
+        queries = np.asarray(queries, dtype=np.uint64)
+        if excluir is not None:
+            resultados = self.vizinhos_em_lote(queries, raio, max_elementos)
+            filtrados = []
+            for (chapa_ids, dists), fora in zip(resultados, excluir):
+                fica = slice(None)
+                if fora is not None and len(fora):
+                    fica = ~contidos(chapa_ids, np.asarray(fora, dtype=np.int64))
+                filtrados.append((chapa_ids[fica], dists[fica]))
+            return filtrados
+        if not isinstance(self.backend, LinearBackend) or not len(queries):
+            return [self.vizinhos(int(q), raio) for q in queries]
+
+        bloco = max(1024, max_elementos // len(queries))
+        partes = [([], []) for _ in queries]
+        for hashes, chapa_ids in self._segmentos():
+            for parte, (posicoes, dists) in zip(partes, vizinhos_em_bloco(hashes, queries, raio, bloco)):
+                parte[0].append(chapa_ids[posicoes].astype(np.int64))
+                parte[1].append(dists)
+        return [
+            (np.concatenate(ids), np.concatenate(dists)) if ids else
+            (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8))
+            for ids, dists in partes
+        ]
+
+    def ranquear(self, query: int, limiar: int, k: int, melhores_n: int = 3):
+        chapa_ids, dists = self.vizinhos(query, limiar)
+        return ranquear(chapa_ids, dists, k, limiar, melhores_n, self.frames_por_chapa)
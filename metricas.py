@@ -0,0 +1,245 @@
+# ---------------- MÉTRICAS ---------------- #
+#
+# instrumentação leve das rotas: histogramas de duração por etapa (base64,
+# decode, preprocess, phash, busca, sqlite...), contadores e medidores, e a
+# exportação no formato texto do Prometheus. Cada etapa custa dois
+# perf_counter e um incremento sob lock (~1-2 µs), nada perto do ms de um
+# decode. Os números são do processo: com vários workers, cada um tem os
+# seus.
+
+import bisect
+import os
+import threading
+import time
+
+# limites (em segundos) dos histogramas de duração: de 0,25 ms a 10 s
+LIMITES_SEGUNDOS = (
+    0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+QUANTIS = (0.5, 0.95, 0.99)
+
+
+class Histograma:
+    __slots__ = ("limites", "contagens", "soma", "total")
+
+    def __init__(self, limites):
+        self.limites = limites
+        # contagens[i]: valores <= limites[i] e > limites[i-1]; a última é o +Inf
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+    def quantil(self, q: float) -> float:
+        # estimativa por interpolação linear dentro do balde, como o
+        # histogram_quantile do Prometheus
+        if not self.total:
+            return 0.0
+        alvo = q * self.total
+        acumulado = 0
+        for i, qtd in enumerate(self.contagens):
+            if acumulado + qtd >= alvo and qtd:
+                if i == len(self.limites):
+                    return self.limites[-1]
+                inicio = self.limites[i - 1] if i else 0.0
+                return inicio + (self.limites[i] - inicio) * (alvo - acumulado) / qtd
+            acumulado += qtd
+        return self.limites[-1]
+
+
+class _Cronometro:
+    __slots__ = ("metricas", "nome", "inicio")
+
+    def __init__(self, metricas, nome):
+        self.metricas = metricas
+        self.nome = nome
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metricas.registrar_etapa(self.nome, time.perf_counter() - self.inicio)
+        return False
+
+
+class _Desligado:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_DESLIGADO = _Desligado()
+
+
+def _rotulos(rotulos) -> str:
+    # (("rota", "api_consulta"), ("etapa", "decode")) -> {rota="api_consulta",etapa="decode"}
+    if not rotulos:
+        return ""
+    pares = []
+    for nome, valor in rotulos:
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pares.append(f'{nome}="{valor}"')
+    return "{" + ",".join(pares) + "}"
+
+
+class Metricas:
+    def __init__(self, ativo: bool = True, prefixo: str = "chapafoto"):
+        self.ativo = ativo
+        self.prefixo = prefixo
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # nome -> (tipo, ajuda, extra); extra = limites (histograma) ou função (medidor)
+        self._familias = {}
+        # (nome, rótulos ordenados) -> Histograma ou valor do contador
+        self._series = {}
+        # o pool de hash é criado por fork a partir de uma thread qualquer:
+        # o filho não pode herdar o lock travado por outra
+        os.register_at_fork(after_in_child=self._depois_do_fork)
+        self.histograma("etapa_segundos", "Duração de cada etapa das rotas, em segundos")
+
+    def _depois_do_fork(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # ---- declaração ----
+
+    def histograma(self, nome, ajuda, limites=LIMITES_SEGUNDOS):
+        self._familias[f"{self.prefixo}_{nome}"] = ("histogram", ajuda, tuple(limites))
+
+    def contador(self, nome, ajuda):
+        self._familias[f"{self.prefixo}_{nome}"] = ("counter", ajuda, None)
+
+    def medidor(self, nome, ajuda, fn, tipo="gauge"):
+        # fn() é chamada na hora da exportação; tipo="counter" pra valores
+        # que só crescem e já são contados em outro lugar
+        self._familias[f"{self.prefixo}_{nome}"] = (tipo, ajuda, fn)
+
+    # ---- registro ----
+
+    def observar(self, nome, valor, **rotulos):
+        if not self.ativo:
+            return
+        nome = f"{self.prefixo}_{nome}"
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            hist = self._series.get(chave)
+            if hist is None:
+                hist = self._series[chave] = Histograma(self._familias[nome][2])
+            hist.observar(valor)
+
+    def somar(self, nome, valor=1, **rotulos):
+        if not self.ativo:
+            return
+        chave = (f"{self.prefixo}_{nome}", tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._series[chave] = self._series.get(chave, 0) + valor
+
+    def etapa(self, nome: str):
+        # with metricas.etapa("decode"): ... -> histograma etapa_segundos
+        # com a rota da requisição atual, e entra no Server-Timing dela
+        if not self.ativo:
+            return _DESLIGADO
+        return _Cronometro(self, nome)
+
+    def registrar_etapa(self, nome: str, segundos: float):
+        local = self._local
+        tempos = getattr(local, "tempos", None)
+        if tempos is not None:
+            tempos[nome] = tempos.get(nome, 0.0) + segundos
+        if getattr(local, "repassar", False):
+            return
+        self.observar("etapa_segundos", segundos, rota=getattr(local, "rota", "-"), etapa=nome)
+
+    def registrar_etapas(self, tempos: dict):
+        # etapas medidas em outro processo (ver medir_tarefa), na requisição atual
+        for nome, segundos in tempos.items():
+            self.registrar_etapa(nome, segundos)
+
+    # ---- pool de processos ----
+
+    def medir_tarefa(self, fn, arg):
+        # roda dentro do processo do pool: o registro do filho ninguém
+        # exporta, então as etapas de fn(arg) só são somadas e voltam junto
+        # com o resultado, (resultado, {etapa: segundos}), pro pai registrar
+        local = self._local
+        local.tempos = {}
+        local.repassar = True
+        try:
+            return fn(arg), local.tempos
+        finally:
+            local.tempos = None
+            local.repassar = False
+
+    # ---- requisição ----
+
+    def iniciar_requisicao(self, rota: str):
+        self._local.rota = rota
+        self._local.tempos = {}
+
+    def encerrar_requisicao(self) -> dict:
+        # {etapa: segundos} acumulados na requisição que terminou
+        tempos = getattr(self._local, "tempos", None) or {}
+        self._local.tempos = None
+        self._local.rota = "-"
+        return tempos
+
+    # ---- exportação ----
+
+    def exportar(self) -> str:
+        # formato texto do Prometheus (0.0.4); dos histogramas sai também a
+        # estimativa de p50/p95/p99 como medidor <nome>_quantil
+        with self._lock:
+            series = [
+                (chave, (list(v.contagens), v.soma, v.total) if isinstance(v, Histograma) else v)
+                for chave, v in self._series.items()
+            ]
+        por_familia = {}
+        for (nome, rotulos), valor in series:
+            por_familia.setdefault(nome, []).append((rotulos, valor))
+
+        linhas = []
+        for nome, (tipo, ajuda, extra) in self._familias.items():
+            if callable(extra):
+                try:
+                    valor = extra()
+                except Exception:
+                    continue
+                linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}", f"{nome} {valor}"]
+                continue
+            itens = sorted(por_familia.get(nome, []))
+            if not itens:
+                continue
+            linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"]
+            if tipo == "counter":
+                linhas += [f"{nome}{_rotulos(r)} {v}" for r, v in itens]
+                continue
+            quantis = []
+            for rotulos, (contagens, soma, total) in itens:
+                acumulado = 0
+                for limite, qtd in zip(extra + (float("inf"),), contagens):
+                    acumulado += qtd
+                    le = "+Inf" if limite == float("inf") else repr(limite)
+                    linhas.append(f"{nome}_bucket{_rotulos(rotulos + (('le', le),))} {acumulado}")
+                linhas.append(f"{nome}_sum{_rotulos(rotulos)} {soma}")
+                linhas.append(f"{nome}_count{_rotulos(rotulos)} {total}")
+                hist = Histograma(extra)
+                hist.contagens, hist.total = contagens, total
+                quantis += [
+                    f"{nome}_quantil{_rotulos(rotulos + (('quantil', str(q)),))} {hist.quantil(q)}"
+                    for q in QUANTIS
+                ]
+            linhas += [f"# HELP {nome}_quantil Estimativa de p50/p95/p99 de {nome}",
+                       f"# TYPE {nome}_quantil gauge", *quantis]
+        return "\n".join(linhas) + "\n"
+
+
+def server_timing(tempos: dict) -> str:
+    # valor do cabeçalho Server-Timing: "decode;dur=3.1, phash;dur=0.9"
+    return ", ".join(f"{nome};dur={segundos * 1000:.2f}" for nome, segundos in tempos.items())
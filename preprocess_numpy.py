@@ -0,0 +1,94 @@
+# ---------------- PRÉ-PROCESSAMENTO EM NUMPY ---------------- #
+#
+# mesma cadeia do preprocess_image_for_hash (recorte -> 400x400 -> brilho ->
+# contraste -> cinza -> autocontraste -> unsharp mask) + pHash, mas com os
+# ajustes feitos num buffer só, com operações in-place e filtros do
+# scipy.ndimage, em vez de uma imagem PIL nova a cada etapa. Recebe uma pilha
+# de frames (um cadastro inteiro vira um array N x 400 x 400).
+#
+# não é bit a bit igual ao PIL (o GaussianBlur do PIL é aproximado por box
+# blur e cada etapa dele arredonda pra uint8); a diferença nos hashes é
+# medida em benchmarks/preprocess_engines.py.
+
+import numpy as np
+from PIL import Image
+from scipy.fft import dct
+from scipy.ndimage import gaussian_filter
+
+LADO = 400
+BRILHO = 1.05
+CONTRASTE = 1.10
+AUTOCONTRASTE_CUTOFF = 2
+UNSHARP_RAIO = 1.5
+UNSHARP_PERCENT = 120
+UNSHARP_THRESHOLD = 3
+
+# pesos do convert("L") do PIL (ITU-R 601-2)
+_PESOS_CINZA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def empilhar(imagens) -> np.ndarray:
+    # recorta o quadrado do meio de cada frame e reduz pra LADO x LADO
+    # (o resize com box= faz o recorte junto, sem imagem intermediária)
+    pilha = np.empty((len(imagens), LADO, LADO, 3), dtype=np.uint8)
+    for i, img in enumerate(imagens):
+        img = img.convert("RGB")
+        w, h = img.size
+        side = min(w, h)
+        left = (w - side) // 2
+        top = (h - side) // 2
+        box = (left, top, left + side, top + side)
+        pilha[i] = np.asarray(img.resize((LADO, LADO), Image.LANCZOS, box=box))
+    return pilha
+
+
+def preprocess_stack(pilha: np.ndarray) -> np.ndarray:
+    # pilha N x H x W x 3 (uint8, RGB) -> N x H x W (uint8, cinza)
+    #
+    # brilho e contraste são transformações afins, então são aplicados depois
+    # da conversão pra cinza, num canal só (só difere do PIL onde algum canal
+    # satura antes da conversão)
+    cinza = pilha @ _PESOS_CINZA
+
+    # brilho (mistura com preto) + contraste (mistura com a média de cinza de
+    # cada frame) numa multiplicação e uma soma
+    media = np.floor(cinza.mean(axis=(1, 2)) * BRILHO + 0.5)
+    cinza *= BRILHO * CONTRASTE
+    cinza += (media * (1 - CONTRASTE))[:, None, None]
+    np.clip(cinza, 0, 255, out=cinza)
+    np.rint(cinza, out=cinza)
+
+    # autocontraste: corta AUTOCONTRASTE_CUTOFF% de cada ponta do histograma
+    # de cada frame e estica o resto pra 0..255
+    hist = np.stack([np.bincount(c.ravel(), minlength=256) for c in cinza.astype(np.uint8)])
+    corte = (hist.sum(axis=1) * AUTOCONTRASTE_CUTOFF // 100)[:, None]
+    lo = np.argmax(np.cumsum(hist, axis=1) > corte, axis=1)
+    hi = 255 - np.argmax(np.cumsum(hist[:, ::-1], axis=1) > corte, axis=1)
+    escala = np.where(hi > lo, 255 / np.maximum(hi - lo, 1), 1).astype(np.float32)
+    cinza *= escala[:, None, None]
+    cinza -= (lo * escala * (hi > lo))[:, None, None]
+    np.clip(cinza, 0, 255, out=cinza)
+    np.floor(cinza, out=cinza)
+
+    # unsharp mask: soma a diferença pro blur onde ela passa do threshold
+    diff = gaussian_filter(cinza, sigma=(0, UNSHARP_RAIO, UNSHARP_RAIO))
+    np.subtract(cinza, diff, out=diff)
+    diff[np.abs(diff) < UNSHARP_THRESHOLD] = 0
+    diff *= UNSHARP_PERCENT / 100
+    cinza += diff
+    np.clip(cinza, 0, 255, out=cinza)
+    return cinza.astype(np.uint8)
+
+
+def phash_stack(cinzas: np.ndarray, hash_size: int = 8, highfreq_factor: int = 4):
+    # pHash de cada frame, igual ao imagehash.phash (reduz pra 32x32, DCT 2D,
+    # compara as frequências baixas com a mediana); devolve as strings hex
+    lado = hash_size * highfreq_factor
+    pixels = np.stack(
+        [np.asarray(Image.fromarray(c).resize((lado, lado), Image.LANCZOS)) for c in cinzas]
+    ).astype(np.float64)
+    coef = dct(dct(pixels, axis=1), axis=2)[:, :hash_size, :hash_size].reshape(len(pixels), -1)
+    bits = coef > np.median(coef, axis=1, keepdims=True)
+    inteiros = np.packbits(bits, axis=1).view(">u8").ravel()
+    return [format(int(v), f"0{hash_size * hash_size // 4}x") for v in inteiros]
+
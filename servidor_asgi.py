@@ -0,0 +1,188 @@
+# ---------------- SERVIDOR ASGI ---------------- #
+#
+#   uvicorn servidor_asgi:app --host 0.0.0.0 --port 5000 --workers 2
+#
+# o mesmo app Flask (mesmas rotas e respostas), servido por um servidor
+# assíncrono. No gunicorn com workers sync, um cliente lento no upload ou um
+# hash demorado prendem o worker inteiro. Aqui, o corpo da requisição chega
+# pelo event loop, sem ocupar thread nenhuma. Só com ele completo a rota
+# roda, num pool limitado de threads (ASGI_THREADS). O trabalho de CPU da
+# consulta e do cadastro vai pro pool de processos de hash, então as threads
+# passam a maior parte do tempo esperando.
+#
+# Backpressure: com ASGI_THREADS + ASGI_FILA requisições POST já aceitas e
+# sem resposta, as próximas levam 429 com Retry-After na hora, antes de o
+# corpo ser lido. GETs (páginas, imagens, /metrics) nunca são recusados.
+
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# aqui as threads das rotas dividem o GIL: a análise da consulta vai pro pool
+# de hash (CONSULTA_NO_POOL=0 no ambiente desliga)
+os.environ.setdefault("CONSULTA_NO_POOL", "1")
+
+import chapa_foto  # noqa: E402
+
+# corpo acima disso vai pra um arquivo temporário em vez da memória
+CORPO_EM_MEMORIA = 1024 * 1024
+
+RESPOSTA_OCUPADO = b'{"message":"Servidor ocupado, tente de novo em instantes.","status":"error"}\n'
+
+
+def montar_environ(scope, corpo, tamanho: int) -> dict:
+    # scope do ASGI -> environ do WSGI (PEP 3333: strings em latin-1)
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    servidor = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": servidor[0],
+        "SERVER_PORT": str(servidor[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        # o corpo já foi lido inteiro: o tamanho é conhecido mesmo num
+        # upload chunked
+        "CONTENT_LENGTH": str(tamanho),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": corpo,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for nome, valor in scope.get("headers", []):
+        nome = nome.decode("latin-1").upper().replace("-", "_")
+        valor = valor.decode("latin-1")
+        # o corpo vai pronto, com CONTENT_LENGTH: repassar o chunked faria o
+        # Werkzeug ignorar o tamanho e ler um corpo vazio
+        if nome in ("CONTENT_LENGTH", "TRANSFER_ENCODING"):
+            continue
+        if nome != "CONTENT_TYPE":
+            nome = f"HTTP_{nome}"
+        environ[nome] = f"{environ[nome]},{valor}" if nome in environ else valor
+    return environ
+
+
+def chamar_wsgi(wsgi_app, environ):
+    # roda no pool de threads: (status, cabeçalhos, corpo) da resposta
+    resposta = []
+    pedacos = []
+
+    def start_response(status, cabecalhos, exc_info=None):
+        if exc_info and resposta:
+            raise exc_info[1].with_traceback(exc_info[2])
+        resposta[:] = [status, cabecalhos]
+        return pedacos.append
+
+    itens = wsgi_app(environ, start_response)
+    try:
+        for pedaco in itens:
+            if pedaco:
+                pedacos.append(pedaco)
+    finally:
+        if hasattr(itens, "close"):
+            itens.close()
+    status, cabecalhos = resposta
+    return int(status.split(" ", 1)[0]), cabecalhos, b"".join(pedacos)
+
+
+class AppAsgi:
+    def __init__(self, wsgi_app, threads: int, fila: int, retry_after: int):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.limite = threads + fila
+        self.retry_after = retry_after
+        # requisições aceitas e ainda sem resposta (lendo o corpo, na fila do
+        # pool ou rodando); só o event loop mexe nisso
+        self.pendentes = 0
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # criado no processo que vai usar (o uvicorn sobe um por worker)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="asgi")
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            mensagem = await receive()
+            if mensagem["type"] == "lifespan.startup":
+                # o pool de hash sai por fork, mas o ProcessPoolExecutor só
+                # sobe os processos no primeiro submit: uma tarefa vazia
+                # agora faz o fork antes de existirem as threads do executor
+                pool = chapa_foto.get_hash_pool()
+                if pool is not None:
+                    pool.submit(int).result()
+                await send({"type": "lifespan.startup.complete"})
+            elif mensagem["type"] == "lifespan.shutdown":
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        if scope["method"] == "POST" and self.pendentes >= self.limite:
+            chapa_foto.metricas.somar("asgi_recusadas_total")
+            await self.responder(send, 429, [
+                ("Content-Type", "application/json"),
+                ("Retry-After", str(self.retry_after)),
+            ], RESPOSTA_OCUPADO)
+            return
+
+        self.pendentes += 1
+        try:
+            corpo = tempfile.SpooledTemporaryFile(max_size=CORPO_EM_MEMORIA)
+            with corpo:
+                tamanho = 0
+                while True:
+                    mensagem = await receive()
+                    if mensagem["type"] == "http.disconnect":
+                        return
+                    pedaco = mensagem.get("body", b"")
+                    corpo.write(pedaco)
+                    tamanho += len(pedaco)
+                    if not mensagem.get("more_body", False):
+                        break
+                corpo.seek(0)
+
+                environ = montar_environ(scope, corpo, tamanho)
+                loop = asyncio.get_running_loop()
+                status, cabecalhos, dados = await loop.run_in_executor(
+                    self.executor, chamar_wsgi, self.wsgi_app, environ
+                )
+            await self.responder(send, status, cabecalhos, dados)
+        finally:
+            self.pendentes -= 1
+
+    @staticmethod
+    async def responder(send, status: int, cabecalhos, dados: bytes):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(n.lower().encode("latin-1"), v.encode("latin-1")) for n, v in cabecalhos],
+        })
+        await send({"type": "http.response.body", "body": dados})
+
+
+app = AppAsgi(chapa_foto.app, chapa_foto.ASGI_THREADS, chapa_foto.ASGI_FILA, chapa_foto.ASGI_RETRY_AFTER)
+
+chapa_foto.metricas.contador("asgi_recusadas_total", "Requisições POST recusadas com 429 (pool cheio)")
+chapa_foto.metricas.medidor("asgi_pendentes", "Requisições aceitas no modo ASGI e ainda sem resposta",
+                            lambda: app.pendentes)